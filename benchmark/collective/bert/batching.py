@@ -20,57 +20,56 @@ from __future__ import print_function
 import numpy as np
 
 
-def mask(batch_tokens, total_token_num, vocab_size, CLS=1, SEP=2, MASK=3):
+def mask(batch_tokens, seq_lens, vocab_size, CLS=1, SEP=2, MASK=3):
     """
-    Add mask for batch_tokens, return out, mask_label, mask_pos;
-    Note: mask_pos responding the batch_tokens after padded;
+    Add mask for the padded batch_tokens of shape [batch_size, max_len] in
+    place, return batch_tokens, mask_label, mask_pos;
+    Note: mask_pos indexes the flattened batch_tokens, the labels of a
+    sentence are in the order of its tokens;
     """
-    max_len = max([len(sent) for sent in batch_tokens])
-    mask_label = []
-    mask_pos = []
-    prob_mask = np.random.rand(total_token_num)
+    batch_size, max_len = batch_tokens.shape
+    seq_lens = np.asarray(seq_lens)
+    token_pos = np.arange(max_len)
+    is_token = token_pos < seq_lens[:, None]
+    total_token_num = int(seq_lens.sum())
+    prob_mask = np.ones(batch_tokens.shape)
+    prob_mask[is_token] = np.random.rand(total_token_num)
     # Note: the first token is [CLS], so [low=1]
-    replace_ids = np.random.randint(1, high=vocab_size, size=total_token_num)
-    pre_sent_len = 0
-    prob_index = 0
-    for sent_index, sent in enumerate(batch_tokens):
-        mask_flag = False
-        prob_index += pre_sent_len
-        for token_index, token in enumerate(sent):
-            prob = prob_mask[prob_index + token_index]
-            if prob > 0.15:
-                continue
-            elif 0.03 < prob <= 0.15:
-                # mask
-                if token != SEP and token != CLS:
-                    mask_label.append(sent[token_index])
-                    sent[token_index] = MASK
-                    mask_flag = True
-                    mask_pos.append(sent_index * max_len + token_index)
-            elif 0.015 < prob <= 0.03:
-                # random replace
-                if token != SEP and token != CLS:
-                    mask_label.append(sent[token_index])
-                    sent[token_index] = replace_ids[prob_index + token_index]
-                    mask_flag = True
-                    mask_pos.append(sent_index * max_len + token_index)
-            else:
-                # keep the original token
-                if token != SEP and token != CLS:
-                    mask_label.append(sent[token_index])
-                    mask_pos.append(sent_index * max_len + token_index)
-        pre_sent_len = len(sent)
-
-        # ensure at least mask one word in a sentence
-        while not mask_flag:
-            token_index = int(np.random.randint(1, high=len(sent) - 1, size=1))
-            if sent[token_index] != SEP and sent[token_index] != CLS:
-                mask_label.append(sent[token_index])
-                sent[token_index] = MASK
-                mask_flag = True
-                mask_pos.append(sent_index * max_len + token_index)
-    mask_label = np.array(mask_label).astype("int64").reshape([-1, 1])
-    mask_pos = np.array(mask_pos).astype("int64").reshape([-1, 1])
+    replace_ids = np.zeros_like(batch_tokens)
+    replace_ids[is_token] = np.random.randint(
+        1, high=vocab_size, size=total_token_num)
+
+    maskable = is_token & (batch_tokens != SEP) & (batch_tokens != CLS)
+    # 80% mask, 10% random replace, 10% keep the original token
+    selected = maskable & (prob_mask <= 0.15)
+    to_mask = selected & (prob_mask > 0.03)
+    to_replace = selected & (prob_mask > 0.015) & (prob_mask <= 0.03)
+    rows, cols = np.nonzero(selected)
+    labels = batch_tokens[rows, cols]
+
+    # ensure at least mask one word in a sentence, uniformly among the
+    # maskable tokens except the first and the last one
+    unmasked = ~(to_mask | to_replace).any(axis=1)
+    candidates = maskable & (token_pos >= 1) & (
+        token_pos < seq_lens[:, None] - 1) & unmasked[:, None]
+    extra_rows = np.nonzero(candidates.any(axis=1))[0]
+    scores = np.random.rand(len(extra_rows), max_len)
+    scores[~candidates[extra_rows]] = -1
+    extra_cols = np.argmax(scores, axis=1)
+    extra_labels = batch_tokens[extra_rows, extra_cols]
+
+    batch_tokens[to_replace] = replace_ids[to_replace]
+    batch_tokens[to_mask] = MASK
+    batch_tokens[extra_rows, extra_cols] = MASK
+
+    # the extra mask comes after the other labels of its sentence
+    rows = np.concatenate([rows, extra_rows])
+    order = np.lexsort((np.concatenate(
+        [np.zeros_like(cols), np.ones_like(extra_cols)]), rows))
+    mask_pos = (rows * max_len + np.concatenate([cols, extra_cols]))[order]
+    mask_label = np.concatenate([labels, extra_labels])[order]
+    mask_label = mask_label.astype("int64").reshape([-1, 1])
+    mask_pos = mask_pos.astype("int64").reshape([-1, 1])
     return batch_tokens, mask_label, mask_pos
 
 
@@ -102,20 +101,18 @@ def prepare_batch_data(insts,
         labels = np.array(labels).astype("int64").reshape([-1, 1])
         labels_list.append(labels)
 
-    # First step: do mask without padding
+    # First step: padding
+    src_id, self_input_mask = pad_batch_data(
+        batch_src_ids, pad_idx=pad_id, return_input_mask=True)
+    # Second step: do mask on the padded tokens
     if mask_id >= 0:
-        out, mask_label, mask_pos = mask(
-            batch_src_ids,
-            total_token_num,
+        _, mask_label, mask_pos = mask(
+            src_id.reshape(src_id.shape[:2]),
+            np.array([len(inst) for inst in batch_src_ids]),
             vocab_size=voc_size,
             CLS=cls_id,
             SEP=sep_id,
             MASK=mask_id)
-    else:
-        out = batch_src_ids
-    # Second step: padding
-    src_id, self_input_mask = pad_batch_data(
-        out, pad_idx=pad_id, return_input_mask=True)
     pos_id = pad_batch_data(
         batch_pos_ids,
         pad_idx=pad_id,
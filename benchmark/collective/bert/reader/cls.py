@@ -18,6 +18,7 @@ import csv
 import numpy as np
 import tokenization
 from batching import prepare_batch_data
+from reader import feature_cache
 
 
 class DataProcessor(object):
@@ -29,13 +30,19 @@ class DataProcessor(object):
                  max_seq_len,
                  do_lower_case,
                  in_tokens,
-                 random_seed=None):
+                 random_seed=None,
+                 cache_dir=None,
+                 num_workers=1):
         self.data_dir = data_dir
         self.max_seq_len = max_seq_len
         self.tokenizer = tokenization.FullTokenizer(
             vocab_file=vocab_path, do_lower_case=do_lower_case)
         self.vocab = self.tokenizer.vocab
         self.in_tokens = in_tokens
+        self.vocab_path = vocab_path
+        self.do_lower_case = do_lower_case
+        self.cache_dir = cache_dir
+        self.num_workers = num_workers
 
         np.random.seed(random_seed)
 
@@ -77,6 +84,41 @@ class DataProcessor(object):
             feature.input_ids, feature.segment_ids, input_pos, feature.label_id
         ]
 
+    def _convert_chunk(self, start, examples):
+        labels = self.get_labels()
+        features = [
+            self.convert_example(start + index, example, labels,
+                                 self.max_seq_len, self.tokenizer)
+            for index, example in enumerate(examples)
+        ]
+        return feature_cache.FeatureStore.from_lists(
+            seqs={
+                "input_ids": [feature.input_ids for feature in features],
+                "segment_ids": [feature.segment_ids for feature in features]
+            },
+            values={"label_id": [feature.label_id for feature in features]},
+            dtypes={
+                "input_ids": "int32",
+                "segment_ids": "int8",
+                "label_id": "int64"
+            })
+
+    def get_feature_store(self, examples):
+        """
+        Load the features of the examples from cache_dir, they are converted
+        and saved there on first use. The key covers the content of the
+        examples, the vocab, max_seq_len, lowercasing and the labels.
+        """
+        key = feature_cache.make_key(
+            type(self).__name__,
+            [[example.guid, example.text_a, example.text_b, example.label]
+             for example in examples],
+            feature_cache.file_digest(self.vocab_path), self.max_seq_len,
+            self.do_lower_case, self.get_labels())
+        return feature_cache.load_or_build(self.cache_dir, key,
+                                           self._convert_chunk, examples,
+                                           self.num_workers)
+
     def generate_batch_data(self,
                             batch_data,
                             total_token_num,
@@ -147,6 +189,27 @@ class DataProcessor(object):
             raise ValueError(
                 "Unknown phase, which should be in ['train', 'dev', 'test'].")
 
+        def cached_instance_reader():
+            store = self.get_feature_store(examples)
+            # shuffled the same way as the examples
+            order = list(range(len(store)))
+            for epoch_index in range(epoch):
+                if shuffle:
+                    if shuffle_seed is not None:
+                        np.random.seed(shuffle_seed)
+                    np.random.shuffle(order)
+                if phase == 'train':
+                    self.current_train_epoch = epoch_index
+                for (index, i) in enumerate(order):
+                    if phase == 'train':
+                        self.current_train_example = index + 1
+                    seq_len = store.seq_len(i)
+                    yield [
+                        store.seq("input_ids", i).tolist(),
+                        store.seq("segment_ids", i).tolist(),
+                        list(range(seq_len)), int(store.arrays["label_id"][i])
+                    ]
+
         def instance_reader():
             for epoch_index in range(epoch):
                 if shuffle:
@@ -188,6 +251,7 @@ class DataProcessor(object):
         def wrapper():
             all_dev_batches = []
             for batch_data, total_token_num in batch_reader(
+                    cached_instance_reader if self.cache_dir else
                     instance_reader, batch_size, self.in_tokens):
                 batch_data = self.generate_batch_data(
                     batch_data,
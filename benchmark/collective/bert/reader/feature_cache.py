@@ -0,0 +1,186 @@
+#   Copyright (c) 2019 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent cache of the tokenized features of the fine-tuning readers.
+
+The features of a data set are kept in flat arrays: the per-token fields
+of all features are concatenated and split by one offsets array, the
+per-feature fields hold one value per feature. The arrays are built by a
+process pool on first use, saved under cache_dir/<key>/ and memory-mapped
+by later runs.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+# the function converting a chunk of items in the worker processes, set
+# before the pool is forked
+_chunk_fn = None
+
+
+def file_digest(path, chunk_size=1 << 22):
+    """Returns the sha1 hex digest of the content of the file."""
+    hasher = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(chunk_size)
+            if not buf:
+                break
+            hasher.update(buf)
+    return hasher.hexdigest()
+
+
+def make_key(*parts):
+    """Returns the hex digest of the json serializable parts."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode(
+        "utf-8")).hexdigest()
+
+
+class FeatureStore(object):
+    """The features of a data set in flat arrays.
+
+    Args:
+        seq_arrays: dict of name -> the concatenated per-token values.
+        offsets: the values of feature i are seq_arrays[name][offsets[i]:offsets[i + 1]].
+        arrays: dict of name -> one value per feature.
+    """
+
+    def __init__(self, seq_arrays, offsets, arrays):
+        self.seq_arrays = seq_arrays
+        self.offsets = offsets
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def seq_len(self, i):
+        return int(self.offsets[i + 1] - self.offsets[i])
+
+    def seq(self, name, i):
+        return self.seq_arrays[name][self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def from_lists(cls, seqs, values, dtypes):
+        """Build the store from dicts of name -> list of lists / values."""
+        lens = [len(seq) for seq in next(iter(seqs.values()))]
+        offsets = np.zeros(len(lens) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(lens)
+        seq_arrays = {}
+        for name, seq in seqs.items():
+            flat = np.fromiter(
+                (x for s in seq for x in s),
+                dtype=dtypes[name],
+                count=int(offsets[-1]))
+            seq_arrays[name] = flat
+        arrays = dict((name, np.array(value, dtype=dtypes[name]))
+                      for name, value in values.items())
+        return cls(seq_arrays, offsets, arrays)
+
+    @classmethod
+    def concat(cls, stores):
+        offsets = [np.zeros(1, dtype="int64")]
+        end = 0
+        for store in stores:
+            offsets.append(store.offsets[1:] + end)
+            end += store.offsets[-1]
+        seq_arrays = dict((name, np.concatenate(
+            [store.seq_arrays[name] for store in stores]))
+                          for name in stores[0].seq_arrays)
+        arrays = dict((name, np.concatenate(
+            [store.arrays[name] for store in stores]))
+                      for name in stores[0].arrays)
+        return cls(seq_arrays, np.concatenate(offsets), arrays)
+
+    def save(self, path):
+        """Save the arrays into the directory path, the meta file is
+        written last so that an interrupted save is never loaded."""
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "offsets.npy"), self.offsets)
+        for prefix, arrays in (("seq.", self.seq_arrays), ("", self.arrays)):
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, prefix + name + ".npy"), array)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({
+                "seq_arrays": sorted(self.seq_arrays),
+                "arrays": sorted(self.arrays),
+                "num_features": len(self)
+            }, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # saved by another trainer meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map the arrays saved by save."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        def load_array(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        return cls(
+            dict((name, load_array("seq." + name))
+                 for name in meta["seq_arrays"]),
+            load_array("offsets"),
+            dict((name, load_array(name)) for name in meta["arrays"]))
+
+
+def _convert_chunk(chunk):
+    return _chunk_fn(*chunk)
+
+
+def build_store(chunk_fn, items, num_workers=1, chunk_size=1000):
+    """Convert items with chunk_fn(start, items[start:start + chunk_size])
+    -> FeatureStore in num_workers processes and concatenate the results."""
+    global _chunk_fn
+    chunks = [(start, items[start:start + chunk_size])
+              for start in range(0, len(items), chunk_size)] or [(0, items)]
+    if num_workers > 1 and len(chunks) > 1:
+        _chunk_fn = chunk_fn
+        pool = multiprocessing.Pool(min(num_workers, len(chunks)))
+        try:
+            stores = pool.map(_convert_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            _chunk_fn = None
+    else:
+        stores = [chunk_fn(*chunk) for chunk in chunks]
+    return FeatureStore.concat(stores)
+
+
+def load_or_build(cache_dir, key, chunk_fn, items, num_workers=1):
+    """Load the store of key from cache_dir, or build it from items and save
+    it there."""
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        print("load features from %s" % path)
+        return FeatureStore.load(path)
+    store = build_store(chunk_fn, items, num_workers)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    store.save(path)
+    print("save features to %s" % path)
+    return FeatureStore.load(path) if os.path.exists(path) else store
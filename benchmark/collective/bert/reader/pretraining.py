@@ -19,9 +19,13 @@ import os
 import numpy as np
 import types
 import gzip
+import itertools
 import logging
+import multiprocessing
 import re
 import six
+import time
+import traceback
 import collections
 import tokenization
 
@@ -31,7 +35,35 @@ import paddle.fluid as fluid
 from batching import prepare_batch_data
 
 
+def _pipeline_worker(reader, tasks, out_queue):
+    """
+    Produce the batches of the tasks (epoch, file_index, file, skip_lines)
+    into out_queue, every task is ended by a None.
+    """
+    try:
+        for task in tasks:
+            for item in reader.file_batches(*task):
+                out_queue.put(item)
+            out_queue.put(None)
+    except Exception:
+        out_queue.put(traceback.format_exc())
+
+
 class DataReader(object):
+    """
+    The pretraining data reader. The files of data_dir are shuffled in every
+    epoch with random_seed + epoch, so that all trainers agree on the order,
+    and trainer trainer_id reads every num_trainers-th of them. Each file is
+    decompressed, parsed and batched by one of num_workers processes, the
+    batches are yielded in file order.
+
+    The reading position (epoch, file_index, line_offset) of the yielded
+    batches is returned by get_checkpoint and reading restarts from it if it
+    is passed as checkpoint. With negative sample generation the samples are
+    shuffled within buffers, so a restart may skip or repeat some samples of
+    the last buffer.
+    """
+
     def __init__(self,
                  data_dir,
                  vocab_path,
@@ -42,7 +74,13 @@ class DataReader(object):
                  epoch=100,
                  voc_size=0,
                  is_test=False,
-                 generate_neg_sample=False):
+                 generate_neg_sample=False,
+                 num_workers=0,
+                 queue_size=16,
+                 trainer_id=None,
+                 num_trainers=None,
+                 random_seed=0,
+                 checkpoint=None):
 
         self.vocab = self.load_vocab(vocab_path)
         self.data_dir = data_dir
@@ -62,6 +100,21 @@ class DataReader(object):
         self.mask_id = self.vocab["[MASK]"]
         self.is_test = is_test
         self.generate_neg_sample = generate_neg_sample
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        if trainer_id is None:
+            trainer_id = int(os.environ.get('PADDLE_TRAINER_ID', 0))
+        if num_trainers is None:
+            num_trainers = int(os.environ.get('PADDLE_TRAINERS_NUM', 1))
+        self.trainer_id = trainer_id
+        self.num_trainers = num_trainers
+        self.random_seed = random_seed
+        self.checkpoint = checkpoint
+        self.current_line_offset = 0
+        self._read_offset = 0
+        self.stats = collections.OrderedDict(
+            [("batches", 0), ("samples", 0), ("tokens", 0), ("files", 0)])
+        self.start_time = None
         if self.in_tokens:
             assert self.batch_size >= self.max_seq_len, "The number of " \
                    "tokens in batch should not be smaller than max seq length."
@@ -69,39 +122,67 @@ class DataReader(object):
         if self.is_test:
             self.epoch = 1
             self.shuffle_files = False
+            # every trainer evaluates the whole test set
+            self.trainer_id = 0
+            self.num_trainers = 1
 
     def get_progress(self):
         """return current progress of traning data
         """
         return self.current_epoch, self.current_file_index, self.total_file, self.current_file
 
+    def get_checkpoint(self):
+        """return the reading position of the yielded batches, which can be
+        passed as checkpoint to restart from it
+        """
+        return {
+            "epoch": max(self.current_epoch - 1, 0),
+            "file_index": max(self.current_file_index - 1, 0),
+            "line_offset": self.current_line_offset
+        }
+
+    def get_throughput(self):
+        """return the counters of the yielded data and their rates per second
+        """
+        result = collections.OrderedDict(self.stats)
+        elapsed = time.time() - self.start_time if self.start_time else 0.0
+        for key in self.stats:
+            result[key + "_per_sec"] = self.stats[key] / elapsed \
+                if elapsed > 0 else 0.0
+        return result
+
     def parse_line(self, line, max_seq_len=512):
         """ parse one line to token_ids, sentence_ids, pos_ids, label
         """
         line = line.strip().decode().split(";")
         assert len(line) == 4, "One sample must have 4 fields!"
         (token_ids, sent_ids, pos_ids, label) = line
-        token_ids = [int(token) for token in token_ids.split(" ")]
-        sent_ids = [int(token) for token in sent_ids.split(" ")]
-        pos_ids = [int(token) for token in pos_ids.split(" ")]
+        # the fields are parsed as a whole, then turned into lists since the
+        # samples are extended and masked as lists
+        token_ids = np.fromstring(token_ids, dtype="int64", sep=" ")
+        if len(token_ids) > max_seq_len:
+            return None
+        sent_ids = np.fromstring(sent_ids, dtype="int64", sep=" ")
+        pos_ids = np.fromstring(pos_ids, dtype="int64", sep=" ")
         assert len(token_ids) == len(sent_ids) == len(
             pos_ids
         ), "[Must be true]len(token_ids) == len(sent_ids) == len(pos_ids)"
         label = int(label)
-        if len(token_ids) > max_seq_len:
-            return None
-        return [token_ids, sent_ids, pos_ids, label]
+        return [token_ids.tolist(), sent_ids.tolist(), pos_ids.tolist(), label]
 
-    def read_file(self, file):
+    def read_file(self, file, skip_lines=0):
         assert file.endswith('.gz'), "[ERROR] %s is not a gzip file" % file
         file_path = self.data_dir + "/" + file
+        self._read_offset = skip_lines
         with gzip.open(file_path, "rb") as f:
-            for line in f:
+            for index, line in enumerate(
+                    itertools.islice(f, skip_lines, None), skip_lines):
                 parsed_line = self.parse_line(
                     line, max_seq_len=self.max_seq_len)
-                if parsed_line is None:
-                    continue
-                yield parsed_line
+                if parsed_line is not None:
+                    yield parsed_line
+                # a line counts as read once its sample is taken
+                self._read_offset = index + 1
 
     def convert_to_unicode(self, text):
         """Converts `text` to Unicode (if it's not already), assuming utf-8 input."""
@@ -222,65 +303,149 @@ class DataReader(object):
                   (num_total_miss, pos_sample_num * 2,
                    num_total_miss / (pos_sample_num * 2)))
 
+    def get_files(self, epoch):
+        """
+        The files read by this trainer in the epoch
+        """
+        files = sorted(os.listdir(self.data_dir))
+        if self.shuffle_files:
+            np.random.RandomState(self.random_seed + epoch).shuffle(files)
+        return files[self.trainer_id::self.num_trainers]
+
+    def get_tasks(self):
+        """
+        The (epoch, file_index, file, skip_lines) of every file to read,
+        starting from the checkpoint if any
+        """
+        checkpoint = self.checkpoint or {}
+        start_epoch = checkpoint.get("epoch", 0)
+        start_file = checkpoint.get("file_index", 0)
+        tasks = []
+        for epoch in range(start_epoch, self.epoch):
+            files = self.get_files(epoch)
+            for index, file in enumerate(files):
+                if epoch == start_epoch and index < start_file:
+                    continue
+                skip_lines = checkpoint.get("line_offset", 0) \
+                    if epoch == start_epoch and index == start_file else 0
+                tasks.append((epoch, index, file, skip_lines))
+        return tasks
+
+    def file_batches(self, epoch, file_index, file, skip_lines=0):
+        """
+        Yield (line_offset, num_samples, total_token_num, batch data) for the
+        batches of one file
+        """
+        # the sampling of a file is reproducible when it is read again
+        np.random.seed([self.random_seed, epoch, file_index])
+        sample_generator = self.read_file(file, skip_lines)
+        if not self.is_test and self.generate_neg_sample:
+            sample_generator = self.mixin_negtive_samples(sample_generator)
+
+        def to_batch(batch, total_token_num):
+            return (self._read_offset, len(batch), total_token_num,
+                    prepare_batch_data(
+                        batch,
+                        total_token_num,
+                        voc_size=self.voc_size,
+                        pad_id=self.pad_id,
+                        cls_id=self.cls_id,
+                        sep_id=self.sep_id,
+                        mask_id=self.mask_id,
+                        return_input_mask=True,
+                        return_max_len=False,
+                        return_num_token=False))
+
+        batch, total_token_num, max_len = [], 0, 0
+        for parsed_line in sample_generator:
+            if parsed_line is None:
+                continue
+            token_ids, sent_ids, pos_ids, label = parsed_line
+            max_len = max(max_len, len(token_ids))
+            if self.in_tokens:
+                to_append = (len(batch) + 1) * max_len <= self.batch_size
+            else:
+                to_append = len(batch) < self.batch_size
+            if to_append:
+                batch.append(parsed_line)
+                total_token_num += len(token_ids)
+            else:
+                yield to_batch(batch, total_token_num)
+                batch, total_token_num, max_len = [parsed_line], len(
+                    token_ids), len(token_ids)
+
+        if len(batch) > 0:
+            yield to_batch(batch, total_token_num)
+
+    def _task_results(self, tasks):
+        """
+        Yield the items of file_batches for the tasks, followed by None
+        after every task
+        """
+        if self.num_workers <= 0:
+            for task in tasks:
+                for item in self.file_batches(*task):
+                    yield item
+                yield None
+            return
+
+        num_workers = min(self.num_workers, max(len(tasks), 1))
+        queues = [
+            multiprocessing.Queue(self.queue_size) for _ in range(num_workers)
+        ]
+        workers = [
+            multiprocessing.Process(
+                target=_pipeline_worker,
+                args=(self, tasks[i::num_workers], queues[i]))
+            for i in range(num_workers)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            for i in range(len(tasks)):
+                # worker i % num_workers reads task i, so the batches come
+                # in file order
+                while True:
+                    item = queues[i % num_workers].get()
+                    if isinstance(item, str):
+                        raise RuntimeError("reader worker failed:\n" + item)
+                    yield item
+                    if item is None:
+                        break
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
     def data_generator(self):
         """
         data_generator
         """
         files = os.listdir(self.data_dir)
-        self.total_file = len(files)
-        assert self.total_file > 0, "[Error] data_dir is empty"
+        assert len(files) > 0, "[Error] data_dir is empty"
+        self.total_file = len(self.get_files(0))
 
         def wrapper():
-            def reader():
-                for epoch in range(self.epoch):
-                    self.current_epoch = epoch + 1
-                    if self.shuffle_files:
-                        np.random.shuffle(files)
-                    for index, file in enumerate(files):
-                        self.current_file_index = index + 1
-                        self.current_file = file
-                        sample_generator = self.read_file(file)
-                        if not self.is_test and self.generate_neg_sample:
-                            sample_generator = self.mixin_negtive_samples(
-                                sample_generator)
-                        for sample in sample_generator:
-                            if sample is None:
-                                continue
-                            yield sample
-
-            def batch_reader(reader, batch_size, in_tokens):
-                batch, total_token_num, max_len = [], 0, 0
-                for parsed_line in reader():
-                    token_ids, sent_ids, pos_ids, label = parsed_line
-                    max_len = max(max_len, len(token_ids))
-                    if in_tokens:
-                        to_append = (len(batch) + 1) * max_len <= batch_size
-                    else:
-                        to_append = len(batch) < batch_size
-                    if to_append:
-                        batch.append(parsed_line)
-                        total_token_num += len(token_ids)
-                    else:
-                        yield batch, total_token_num
-                        batch, total_token_num, max_len = [parsed_line], len(
-                            token_ids), len(token_ids)
-
-                if len(batch) > 0:
-                    yield batch, total_token_num
-
-            for batch_data, total_token_num in batch_reader(
-                    reader, self.batch_size, self.in_tokens):
-                yield prepare_batch_data(
-                    batch_data,
-                    total_token_num,
-                    voc_size=self.voc_size,
-                    pad_id=self.pad_id,
-                    cls_id=self.cls_id,
-                    sep_id=self.sep_id,
-                    mask_id=self.mask_id,
-                    return_input_mask=True,
-                    return_max_len=False,
-                    return_num_token=False)
+            tasks = self.get_tasks()
+            self.start_time = time.time()
+            task_id = 0
+            for item in self._task_results(tasks):
+                if item is None:
+                    task_id += 1
+                    self.stats["files"] += 1
+                    continue
+                epoch, file_index, file, _ = tasks[task_id]
+                line_offset, num_samples, total_token_num, batch_data = item
+                self.current_epoch = epoch + 1
+                self.current_file_index = file_index + 1
+                self.current_file = file
+                self.current_line_offset = line_offset
+                self.stats["batches"] += 1
+                self.stats["samples"] += num_samples
+                self.stats["tokens"] += total_token_num
+                yield batch_data
 
         return wrapper
 
@@ -19,8 +19,10 @@ import math
 import json
 import random
 import collections
+import numpy as np
 import tokenization
 from batching import prepare_batch_data
+from reader import feature_cache
 
 
 class SquadExample(object):
@@ -184,12 +186,12 @@ def convert_examples_to_features(
         max_query_length,
         is_training,
         #output_fn
-):
+        start_example_index=0):
     """Loads a data file into a list of `InputBatch`s."""
 
     unique_id = 1000000000
 
-    for (example_index, example) in enumerate(examples):
+    for (example_index, example) in enumerate(examples, start_example_index):
         query_tokens = tokenizer.tokenize(example.question_text)
 
         if len(query_tokens) > max_query_length:
@@ -429,14 +431,25 @@ def _check_is_max_context(doc_spans, cur_span_index, position):
 
 
 class DataProcessor(object):
-    def __init__(self, vocab_path, do_lower_case, max_seq_length, in_tokens,
-                 doc_stride, max_query_length):
+    def __init__(self,
+                 vocab_path,
+                 do_lower_case,
+                 max_seq_length,
+                 in_tokens,
+                 doc_stride,
+                 max_query_length,
+                 cache_dir=None,
+                 num_workers=1):
         self._tokenizer = tokenization.FullTokenizer(
             vocab_file=vocab_path, do_lower_case=do_lower_case)
         self._max_seq_length = max_seq_length
         self._doc_stride = doc_stride
         self._max_query_length = max_query_length
         self._in_tokens = in_tokens
+        self._vocab_path = vocab_path
+        self._do_lower_case = do_lower_case
+        self._cache_dir = cache_dir
+        self._num_workers = num_workers
 
         self.vocab = self._tokenizer.vocab
         self.vocab_size = len(self.vocab)
@@ -474,6 +487,9 @@ class DataProcessor(object):
         return self.num_examples[phase]
 
     def get_features(self, examples, is_training):
+        if self._cache_dir:
+            return self.store_to_features(
+                self.get_feature_store(examples, is_training), is_training)
         features = convert_examples_to_features(
             examples=examples,
             tokenizer=self._tokenizer,
@@ -483,6 +499,116 @@ class DataProcessor(object):
             is_training=is_training)
         return features
 
+    def _convert_chunk(self, start, examples, is_training):
+        features = list(
+            convert_examples_to_features(
+                examples=examples,
+                tokenizer=self._tokenizer,
+                max_seq_length=self._max_seq_length,
+                doc_stride=self._doc_stride,
+                max_query_length=self._max_query_length,
+                is_training=is_training,
+                start_example_index=start))
+        orig_index, max_context = [], []
+        for feature in features:
+            seq_len = len(feature.input_ids)
+            orig_index.append([
+                feature.token_to_orig_map.get(i, -1) for i in range(seq_len)
+            ])
+            max_context.append([
+                int(feature.token_is_max_context.get(i, -1))
+                for i in range(seq_len)
+            ])
+
+        def position(value):
+            return -1 if value is None else value
+
+        return feature_cache.FeatureStore.from_lists(
+            seqs={
+                "input_ids": [feature.input_ids for feature in features],
+                "segment_ids": [feature.segment_ids for feature in features],
+                "orig_index": orig_index,
+                "max_context": max_context
+            },
+            values={
+                "example_index":
+                [feature.example_index for feature in features],
+                "doc_span_index":
+                [feature.doc_span_index for feature in features],
+                "start_position":
+                [position(feature.start_position) for feature in features],
+                "end_position":
+                [position(feature.end_position) for feature in features],
+                "is_impossible":
+                [feature.is_impossible for feature in features]
+            },
+            dtypes={
+                "input_ids": "int32",
+                "segment_ids": "int8",
+                "orig_index": "int32",
+                "max_context": "int8",
+                "example_index": "int64",
+                "doc_span_index": "int32",
+                "start_position": "int64",
+                "end_position": "int64",
+                "is_impossible": "int8"
+            })
+
+    def get_feature_store(self, examples, is_training):
+        """
+        Load the features of the examples from the cache dir, they are
+        converted and saved there on first use. The key covers the content
+        of the examples, the vocab, max_seq_length, doc_stride,
+        max_query_length and lowercasing.
+        """
+        key = feature_cache.make_key(
+            [[
+                example.qas_id, example.question_text, example.doc_tokens,
+                example.orig_answer_text, example.start_position,
+                example.end_position, example.is_impossible
+            ] for example in examples],
+            feature_cache.file_digest(self._vocab_path), self._max_seq_length,
+            self._doc_stride, self._max_query_length, self._do_lower_case,
+            is_training)
+        return feature_cache.load_or_build(
+            self._cache_dir, key,
+            lambda start, chunk: self._convert_chunk(start, chunk, is_training),
+            examples, self._num_workers)
+
+    def store_to_features(self, store, is_training):
+        """
+        The list of InputFeatures of a feature store, in the order of
+        convert_examples_to_features.
+        """
+        features = []
+        arrays = store.arrays
+        for i in range(len(store)):
+            input_ids = store.seq("input_ids", i).tolist()
+            seq_len = len(input_ids)
+            orig_index = store.seq("orig_index", i).tolist()
+            max_context = store.seq("max_context", i).tolist()
+            features.append(
+                InputFeatures(
+                    unique_id=1000000000 + i,
+                    example_index=int(arrays["example_index"][i]),
+                    doc_span_index=int(arrays["doc_span_index"][i]),
+                    tokens=self._tokenizer.convert_ids_to_tokens(input_ids),
+                    token_to_orig_map=collections.OrderedDict(
+                        (pos, orig_index[pos]) for pos in range(seq_len)
+                        if orig_index[pos] >= 0),
+                    token_is_max_context=collections.OrderedDict(
+                        (pos, max_context[pos] == 1) for pos in range(seq_len)
+                        if max_context[pos] >= 0),
+                    input_ids=input_ids,
+                    input_mask=[1] * seq_len,
+                    segment_ids=store.seq("segment_ids", i).tolist(),
+                    start_position=int(arrays["start_position"][i])
+                    if is_training else None,
+                    end_position=int(arrays["end_position"][i])
+                    if is_training else None,
+                    is_impossible=bool(arrays["is_impossible"][i])))
+        return features
+
     def data_generator(self,
                        data_path,
                        batch_size,
@@ -540,15 +666,30 @@ class DataProcessor(object):
             if len(batch) > 0:
                 yield batch, total_token_num
 
+        def cached_features(features_by_example, order):
+            for example_index in order:
+                for feature in features_by_example[example_index]:
+                    yield feature
+
         def wrapper():
+            if self._cache_dir:
+                # the features are converted once, every epoch reorders
+                # them by the shuffled examples
+                features_by_example = [[] for _ in examples]
+                for feature in self.get_features(
+                        examples, is_training=phase == 'train'):
+                    features_by_example[feature.example_index].append(feature)
+                order = list(range(len(examples)))
             for epoch_index in range(epoch):
                 if shuffle:
-                    random.shuffle(examples)
+                    random.shuffle(order if self._cache_dir else examples)
                 if phase == 'train':
                     self.current_train_epoch = epoch_index
-                    features = self.get_features(examples, is_training=True)
+                if self._cache_dir:
+                    features = cached_features(features_by_example, order)
                 else:
-                    features = self.get_features(examples, is_training=False)
+                    features = self.get_features(
+                        examples, is_training=phase == 'train')
 
                 all_dev_batches = []
                 for batch_data, total_token_num in batch_reader(
@@ -77,6 +77,10 @@ data_g.add_arg("in_tokens",     bool, False,
 data_g.add_arg("do_lower_case", bool, True,
                "Whether to lower case the input text. Should be True for uncased models and False for cased models.")
 data_g.add_arg("random_seed",   int,  0,     "Random seed.")
+data_g.add_arg("feature_cache_dir", str, None,
+               "If set, the tokenized features are saved in this directory on first use and loaded from it later.")
+data_g.add_arg("num_preprocess_workers", int, 4,
+               "The number of processes tokenizing the examples when the feature cache is built.")
 
 run_type_g = ArgumentGroup(parser, "run_type", "running type options.")
 run_type_g.add_arg("use_cuda",                     bool,   True,  "If set, use GPU for training.")
@@ -149,7 +153,9 @@ def main(args):
                                       max_seq_len=args.max_seq_len,
                                       do_lower_case=args.do_lower_case,
                                       in_tokens=args.in_tokens,
-                                      random_seed=args.random_seed)
+                                      random_seed=args.random_seed,
+                                      cache_dir=args.feature_cache_dir,
+                                      num_workers=args.num_preprocess_workers)
     num_labels = len(processor.get_labels())
 
     if not (args.do_train or args.do_val or args.do_test):
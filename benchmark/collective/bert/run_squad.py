@@ -81,6 +81,10 @@ data_g.add_arg("n_best_size",               int,   20,
 data_g.add_arg("null_score_diff_threshold", float, 0.0,
                "If null_score - best_non_null is greater than the threshold predict null.")
 data_g.add_arg("random_seed",               int,   0,      "Random seed.")
+data_g.add_arg("feature_cache_dir",         str,   None,
+               "If set, the tokenized features are saved in this directory on first use and loaded from it later.")
+data_g.add_arg("num_preprocess_workers",    int,   4,
+               "The number of processes tokenizing the examples when the feature cache is built.")
 
 run_type_g = ArgumentGroup(parser, "run_type", "running type options.")
 run_type_g.add_arg("use_cuda",                     bool,   True,  "If set, use GPU for training.")
@@ -230,7 +234,9 @@ def train(args):
         max_seq_length=args.max_seq_len,
         in_tokens=args.in_tokens,
         doc_stride=args.doc_stride,
-        max_query_length=args.max_query_length)
+        max_query_length=args.max_query_length,
+        cache_dir=args.feature_cache_dir,
+        num_workers=args.num_preprocess_workers)
 
     startup_prog = fluid.Program()
     if args.random_seed is not None:
@@ -19,9 +19,20 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import multiprocessing
 import unicodedata
 import six
 
+# the tokenizer of the worker processes of tokenize_many, set before the pool
+# is forked
+_pool_tokenizer = None
+
+# the character classes of BasicTokenizer
+_REMOVED = 1
+_WHITESPACE = 2
+_PUNCTUATION = 4
+_CHINESE = 8
+
 
 def convert_to_unicode(text):
     """Converts `text` to Unicode (if it's not already), assuming utf-8 input."""
@@ -118,11 +129,41 @@ class FullTokenizer(object):
     def tokenize(self, text):
         split_tokens = []
         for token in self.basic_tokenizer.tokenize(text):
-            for sub_token in self.wordpiece_tokenizer.tokenize(token):
-                split_tokens.append(sub_token)
+            split_tokens.extend(self.wordpiece_tokenizer.convert_word(token)[0])
 
         return split_tokens
 
+    def tokenize_to_ids(self, text):
+        """Returns the wordpiece tokens of text and their ids."""
+        split_tokens = []
+        split_ids = []
+        for token in self.basic_tokenizer.tokenize(text):
+            sub_tokens, sub_ids = self.wordpiece_tokenizer.convert_word(token)
+            split_tokens.extend(sub_tokens)
+            split_ids.extend(sub_ids)
+        return split_tokens, split_ids
+
+    def tokenize_many(self, texts, num_workers=1, chunk_size=1000):
+        """Tokenizes a list of texts, in num_workers processes if it is
+        larger than one. Returns the list of the tokens of every text."""
+        global _pool_tokenizer
+        texts = list(texts)
+        if num_workers <= 1 or len(texts) <= chunk_size:
+            return [self.tokenize(text) for text in texts]
+        chunks = [
+            texts[start:start + chunk_size]
+            for start in range(0, len(texts), chunk_size)
+        ]
+        _pool_tokenizer = self
+        pool = multiprocessing.Pool(min(num_workers, len(chunks)))
+        try:
+            results = pool.map(_tokenize_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+            _pool_tokenizer = None
+        return [tokens for result in results for tokens in result]
+
     def convert_tokens_to_ids(self, tokens):
         return convert_by_vocab(self.vocab, tokens)
 
@@ -130,6 +171,10 @@ class FullTokenizer(object):
         return convert_by_vocab(self.inv_vocab, ids)
 
 
+def _tokenize_chunk(texts):
+    return [_pool_tokenizer.tokenize(text) for text in texts]
+
+
 class CharTokenizer(object):
     """Runs end-to-end tokenziation."""
 
@@ -156,6 +201,9 @@ class CharTokenizer(object):
 class BasicTokenizer(object):
     """Runs basic tokenization (punctuation splitting, lower casing, etc.)."""
 
+    # char -> its class flags, shared by all the instances
+    _char_classes = {}
+
     def __init__(self, do_lower_case=True):
         """Constructs a BasicTokenizer.
 
@@ -188,8 +236,31 @@ class BasicTokenizer(object):
         output_tokens = whitespace_tokenize(" ".join(split_tokens))
         return output_tokens
 
+    def _char_class(self, char):
+        """Returns the class flags of a character, memoized per character."""
+        flags = self._char_classes.get(char)
+        if flags is None:
+            cp = ord(char)
+            flags = 0
+            if cp == 0 or cp == 0xfffd or _is_control(char):
+                flags |= _REMOVED
+            if _is_whitespace(char):
+                flags |= _WHITESPACE
+            if _is_punctuation(char):
+                flags |= _PUNCTUATION
+            if self._is_chinese_char(cp):
+                flags |= _CHINESE
+            self._char_classes[char] = flags
+        return flags
+
     def _run_strip_accents(self, text):
         """Strips accents from a piece of text."""
+        try:
+            # ascii text has neither decompositions nor accents
+            text.encode("ascii")
+            return text
+        except UnicodeError:
+            pass
         text = unicodedata.normalize("NFD", text)
         output = []
         for char in text:
@@ -207,7 +278,7 @@ class BasicTokenizer(object):
         output = []
         while i < len(chars):
             char = chars[i]
-            if _is_punctuation(char):
+            if self._char_class(char) & _PUNCTUATION:
                 output.append([char])
                 start_new_word = True
             else:
@@ -223,8 +294,7 @@ class BasicTokenizer(object):
         """Adds whitespace around any CJK character."""
         output = []
         for char in text:
-            cp = ord(char)
-            if self._is_chinese_char(cp):
+            if self._char_class(char) & _CHINESE:
                 output.append(" ")
                 output.append(char)
                 output.append(" ")
@@ -258,10 +328,10 @@ class BasicTokenizer(object):
         """Performs invalid character removal and whitespace cleanup on text."""
         output = []
         for char in text:
-            cp = ord(char)
-            if cp == 0 or cp == 0xfffd or _is_control(char):
+            flags = self._char_class(char)
+            if flags & _REMOVED:
                 continue
-            if _is_whitespace(char):
+            if flags & _WHITESPACE:
                 output.append(" ")
             else:
                 output.append(char)
@@ -269,12 +339,90 @@ class BasicTokenizer(object):
 
 
 class WordpieceTokenizer(object):
-    """Runs WordPiece tokenziation."""
-
-    def __init__(self, vocab, unk_token="[UNK]", max_input_chars_per_word=100):
+    """Runs WordPiece tokenziation.
+
+    The vocab is loaded into two prefix tries, one of the word-initial pieces
+    and one of the "##" continuations, so that the longest piece at a position
+    is found in one walk over the characters. The pieces of the recent words
+    are kept in an LRU cache of cache_size words.
+    """
+
+    def __init__(self,
+                 vocab,
+                 unk_token="[UNK]",
+                 max_input_chars_per_word=100,
+                 cache_size=100000):
         self.vocab = vocab
         self.unk_token = unk_token
         self.max_input_chars_per_word = max_input_chars_per_word
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._prefix_trie = {}
+        self._suffix_trie = {}
+        for token in vocab:
+            if token.startswith("##"):
+                self._add_to_trie(self._suffix_trie, token[2:], token)
+            # "##" pieces are also word-initial pieces, as in a plain lookup
+            self._add_to_trie(self._prefix_trie, token, token)
+
+    @staticmethod
+    def _add_to_trie(trie, chars, token):
+        # pieces match at least one character
+        if not chars:
+            return
+        node = trie
+        for char in chars:
+            node = node.setdefault(char, {})
+        # "" never is a character, so it marks the end of a piece
+        node[""] = token
+
+    @staticmethod
+    def _longest_match(trie, chars, start):
+        """Returns the end and the token of the longest piece in trie which
+        chars[start:] starts with, (None, None) if there is none."""
+        node = trie
+        end = None
+        token = None
+        for i in range(start, len(chars)):
+            node = node.get(chars[i])
+            if node is None:
+                break
+            if "" in node:
+                end = i + 1
+                token = node[""]
+        return end, token
+
+    def _convert_word(self, word):
+        if len(word) > self.max_input_chars_per_word:
+            return (self.unk_token, )
+        sub_tokens = []
+        start = 0
+        trie = self._prefix_trie
+        while start < len(word):
+            end, token = self._longest_match(trie, word, start)
+            if token is None:
+                return (self.unk_token, )
+            sub_tokens.append(token)
+            start = end
+            trie = self._suffix_trie
+        return tuple(sub_tokens)
+
+    def convert_word(self, word):
+        """Returns the tuples of the word pieces of a single word and of
+        their ids, the id of a piece not in vocab is None."""
+        result = self._cache.get(word)
+        if result is not None:
+            # move the word to the most recent end
+            del self._cache[word]
+            self._cache[word] = result
+            return result
+        tokens = self._convert_word(word)
+        result = (tokens, tuple(self.vocab.get(token) for token in tokens))
+        if self.cache_size > 0:
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+            self._cache[word] = result
+        return result
 
     def tokenize(self, text):
         """Tokenizes a piece of text into its word pieces.
@@ -298,35 +446,7 @@ class WordpieceTokenizer(object):
 
         output_tokens = []
         for token in whitespace_tokenize(text):
-            chars = list(token)
-            if len(chars) > self.max_input_chars_per_word:
-                output_tokens.append(self.unk_token)
-                continue
-
-            is_bad = False
-            start = 0
-            sub_tokens = []
-            while start < len(chars):
-                end = len(chars)
-                cur_substr = None
-                while start < end:
-                    substr = "".join(chars[start:end])
-                    if start > 0:
-                        substr = "##" + substr
-                    if substr in self.vocab:
-                        cur_substr = substr
-                        break
-                    end -= 1
-                if cur_substr is None:
-                    is_bad = True
-                    break
-                sub_tokens.append(cur_substr)
-                start = end
-
-            if is_bad:
-                output_tokens.append(self.unk_token)
-            else:
-                output_tokens.extend(sub_tokens)
+            output_tokens.extend(self.convert_word(token)[0])
         return output_tokens
 
 
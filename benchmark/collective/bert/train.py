@@ -76,6 +76,9 @@ data_g.add_arg("batch_size",          int,  8192,
 data_g.add_arg("in_tokens",           bool, True,
                "If set, the batch size will be the maximum number of tokens in one batch. "
                "Otherwise, it will be the maximum number of examples in one batch.")
+data_g.add_arg("num_reader_workers",  int,  4,
+               "The number of processes decompressing, parsing and batching the training files, "
+               "0 to read them in the feeding thread.")
 
 run_type_g = ArgumentGroup(parser, "run_type", "running type options.")
 run_type_g.add_arg("use_cuda",                     bool,   True,   "If set, use GPU for training.")
@@ -285,6 +288,16 @@ def train(args):
     if args.init_checkpoint and args.init_checkpoint != "":
         init_checkpoint(exe, args.init_checkpoint, train_program, args.use_fp16)
 
+    # restart reading from the position saved with the checkpoint
+    data_checkpoint = None
+    data_checkpoint_name = "data_checkpoint.%d.json" % trainer_id
+    if args.init_checkpoint and os.path.exists(
+            os.path.join(args.init_checkpoint, data_checkpoint_name)):
+        with open(os.path.join(args.init_checkpoint,
+                               data_checkpoint_name)) as f:
+            data_checkpoint = json.load(f)
+        print("resume reading from %s" % data_checkpoint)
+
     data_reader = DataReader(
         data_dir=args.data_dir,
         batch_size=args.batch_size,
@@ -293,7 +306,9 @@ def train(args):
         voc_size=bert_config['vocab_size'],
         epoch=args.epoch,
         max_seq_len=args.max_seq_len,
-        generate_neg_sample=args.generate_neg_sample)
+        generate_neg_sample=args.generate_neg_sample,
+        num_workers=args.num_reader_workers,
+        checkpoint=data_checkpoint)
 
     
     train_exe = exe
@@ -350,12 +365,20 @@ def train(args):
                          np.mean(np.exp(np.array(lm_cost))),
                          np.mean(np.array(acc)), skip_steps / used_time,
                          current_file))
+                throughput = data_reader.get_throughput()
+                print("reader: %d batches, %.1f samples/s, %.1f tokens/s" %
+                      (throughput["batches"], throughput["samples_per_sec"],
+                       throughput["tokens_per_sec"]))
 
                 time_begin = time.time()
 
             if steps % args.save_steps == 0:
                 save_path = os.path.join(args.checkpoints, "step_" + str(steps))
                 fluid.io.save_persistables(exe, save_path, fleet._origin_program)
+                # the reader runs ahead by the batches queued in py_reader
+                with open(os.path.join(save_path, data_checkpoint_name),
+                          "w") as f:
+                    json.dump(data_reader.get_checkpoint(), f)
 
             if args.validation_set_dir and steps % args.validation_steps == 0:
                 vali_cost, vali_lm_cost, vali_acc, vali_steps, vali_speed = predict(
@@ -382,9 +405,9 @@ def train(args):
                         print(result)
                         f.writelines(json.dumps(result) + '\n')
 
-		cost = []
-		lm_cost = []
-		acc = []
+                cost = []
+                lm_cost = []
+                acc = []
         except fluid.core.EOFException:
             train_pyreader.reset()
             break
@@ -34,6 +34,7 @@ from paddle.fluid.contrib.mixed_precision.decorator import decorate
 import utils.reader_cv2 as reader
 from utils.utility import add_arguments, print_arguments, check_gpu
 from utils.learning_rate import cosine_decay_with_warmup, lr_warmup
+from utils.img_tool import normalize_image
 from paddle.fluid.incubate.fleet.collective import fleet, DistributedStrategy
 import paddle.fluid.incubate.fleet.base.role_maker as role_maker
 from paddle.fluid import compiler
@@ -72,6 +73,7 @@ add_arg('lower_scale',      float,     0.08,      "Set the lower_scale in ramdom
 add_arg('lower_ratio',      float,     3./4.,      "Set the lower_ratio in ramdom_crop")
 add_arg('upper_ratio',      float,     4./3.,      "Set the upper_ratio in ramdom_crop")
 add_arg('resize_short_size',      int,     256,      "Set the resize_short_size")
+add_arg('normalize_on_device',    bool,    False,    "Feed uint8 images and normalize them on the device.")
 add_arg('use_mixup',      bool,      False,        "Whether to use mixup or not")
 add_arg('mixup_alpha',      float,     0.2,      "Set the mixup_alpha parameter")
 add_arg('is_distill',       bool,  False,        "is distill or not")
@@ -266,6 +268,7 @@ def build_program(is_train, main_prog, startup_prog, args, dist_strategy=None):
     assert model_name in model_list, "{} is not in lists: {}".format(args.model,
                                                                      model_list)
     model = models.__dict__[model_name]()
+    image_dtype = "uint8" if args.normalize_on_device else "float32"
     with fluid.program_guard(main_prog, startup_prog):
         use_mixup = args.use_mixup
         if is_train and use_mixup:
@@ -273,19 +276,21 @@ def build_program(is_train, main_prog, startup_prog, args, dist_strategy=None):
                 capacity=16,
                 shapes=[[-1] + image_shape, [-1, 1], [-1, 1], [-1, 1]],
                 lod_levels=[0, 0, 0, 0],
-                dtypes=["float32", "int64", "int64", "float32"],
+                dtypes=[image_dtype, "int64", "int64", "float32"],
                 use_double_buffer=True)
         else:
             py_reader = fluid.layers.py_reader(
                 capacity=16,
                 shapes=[[-1] + image_shape, [-1, 1]],
                 lod_levels=[0, 0],
-                dtypes=["float32", "int64"],
+                dtypes=[image_dtype, "int64"],
                 use_double_buffer=True)
 
         with fluid.unique_name.guard():
             if is_train and  use_mixup:
                 image, y_a, y_b, lam = fluid.layers.read_file(py_reader)
+                if args.normalize_on_device:
+                    image = normalize_image(image)
                 if args.data_format == 'NHWC':
                     image = fluid.layers.transpose(image, [0, 2, 3, 1])
                 avg_cost = net_config(image=image, y_a=y_a, y_b=y_b, lam=lam, model=model, args=args, label=0, is_train=True)
@@ -293,6 +298,8 @@ def build_program(is_train, main_prog, startup_prog, args, dist_strategy=None):
                 build_program_out = [py_reader, avg_cost]
             else:
                 image, label = fluid.layers.read_file(py_reader)
+                if args.normalize_on_device:
+                    image = normalize_image(image)
                 if args.data_format == 'NHWC':
                     image = fluid.layers.transpose(image, [0, 2, 3, 1])
                 avg_cost, acc_top1, acc_top5 = net_config(image, model, args, label=label, is_train=is_train)
@@ -430,13 +437,14 @@ def train(args):
     # must be the same in the respective processes.
     shuffle_seed = 1 if num_trainers > 1 else None
 
-    train_reader = reader.train(settings=args, data_dir=args.data_dir, pass_id_as_seed=shuffle_seed)
-    test_reader = reader.val(settings=args, data_dir=args.data_dir)
+    train_reader = reader.train(settings=args, data_dir=args.data_dir,
+                                pass_id_as_seed=shuffle_seed,
+                                batch_size=train_batch_size)
+    test_reader = reader.val(settings=args, data_dir=args.data_dir,
+                             batch_size=test_batch_size)
 
-    train_py_reader.decorate_paddle_reader(paddle.batch(train_reader,
-                                                        batch_size=train_batch_size))
-    test_py_reader.decorate_paddle_reader(paddle.batch(test_reader,
-                                                       batch_size=test_batch_size))
+    train_py_reader.decorate_tensor_provider(train_reader)
+    test_py_reader.decorate_tensor_provider(test_reader)
 
     test_fetch_vars = [test_cost, test_acc1, test_acc5]
     test_fetch_list = []
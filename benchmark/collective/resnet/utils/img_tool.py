@@ -18,9 +18,15 @@ import math
 import random
 import functools
 import numpy as np
+import paddle.fluid as fluid
 
 #random.seed(0)
 
+IMG_MEAN = [0.485, 0.456, 0.406]
+IMG_STD = [0.229, 0.224, 0.225]
+_img_mean = np.array(IMG_MEAN).reshape((3, 1, 1))
+_img_std = np.array(IMG_STD).reshape((3, 1, 1))
+
 def rotate_image(img):
     """ rotate_image """
     (h, w) = img.shape[:2]
@@ -97,15 +103,17 @@ def crop_image(img, target_size, center):
     return img
 
 def process_image(sample, mode, color_jitter, rotate, settings,
-        crop_size=224, mean=None, std=None):
-    """ process_image """
-
-    mean = [0.485, 0.456, 0.406] if mean is None else mean
-    std = [0.229, 0.224, 0.225] if std is None else std
+        crop_size=224, mean=None, std=None, normalize=True):
+    """ process_image, returns the uint8 CHW image if normalize is False, to
+    be normalized on the device by normalize_image """
 
     raw_img = sample[0]
         
-    img = cv2.imread(raw_img, cv2.IMREAD_COLOR)
+    if isinstance(raw_img, np.ndarray):
+        # the encoded bytes of a packed record
+        img = cv2.imdecode(raw_img, cv2.IMREAD_COLOR)
+    else:
+        img = cv2.imread(raw_img, cv2.IMREAD_COLOR)
 
     if mode == 'train':
         if rotate:
@@ -122,12 +130,14 @@ def process_image(sample, mode, color_jitter, rotate, settings,
             img = resize_short(img, target_size)
             img = crop_image(img, target_size=crop_size, center=True)
 
-    img = img[:, :, ::-1].astype('float32').transpose((2, 0, 1)) / 255
-    
-    img_mean = np.array(mean).reshape((3, 1, 1))
-    img_std = np.array(std).reshape((3, 1, 1))
-    img -= img_mean
-    img /= img_std
+    if not normalize:
+        img = np.ascontiguousarray(img[:, :, ::-1].transpose((2, 0, 1)))
+    else:
+        img = img[:, :, ::-1].astype('float32').transpose((2, 0, 1)) / 255
+        img_mean = _img_mean if mean is None else np.array(mean).reshape((3, 1, 1))
+        img_std = _img_std if std is None else np.array(std).reshape((3, 1, 1))
+        img -= img_mean
+        img /= img_std
         
 
     if mode == 'train' or mode == 'val':
@@ -139,6 +149,19 @@ def process_image(sample, mode, color_jitter, rotate, settings,
     elif mode == 'test':
         return (img, )
 
+def normalize_image(image, mean=None, std=None):
+    """ cast the uint8 CHW images to float32 and normalize them in the
+    program, as process_image does on the CPU """
+    mean = IMG_MEAN if mean is None else mean
+    std = IMG_STD if std is None else std
+    image = fluid.layers.cast(image, 'float32')
+    img_mean = fluid.layers.assign(
+        np.array(mean, dtype='float32').reshape((3, 1, 1)) * 255)
+    img_std = fluid.layers.assign(
+        np.array(std, dtype='float32').reshape((3, 1, 1)) * 255)
+    image = fluid.layers.elementwise_sub(image, img_mean, axis=1)
+    return fluid.layers.elementwise_div(image, img_std, axis=1)
+
 def image_mapper(**kwargs):
     """ image_mapper """
     return functools.partial(process_image, **kwargs)
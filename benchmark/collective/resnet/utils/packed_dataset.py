@@ -0,0 +1,220 @@
+#copyright (c) 2019 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+"""
+Packed image datasets: a few large shard files instead of a file per image.
+
+A packed dataset at <prefix> consists of
+    <prefix>-00000-of-00008.rec ...: the concatenated encoded images,
+    <prefix>.index.npy: the shard, offset, length and label of every record,
+    <prefix>.json: the class names and the shard files, written last.
+The records are read with mmap or os.pread, so shuffled random access only
+costs one read per image and no metadata operation.
+
+Build a packed dataset from an image folder or a file list in parallel:
+    python utils/packed_dataset.py --file_list data/ILSVRC2012/train.txt \
+        --image_root data/ILSVRC2012/train --output data/ILSVRC2012/train
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+
+import numpy as np
+
+INDEX_DTYPE = np.dtype([("shard", "int32"), ("offset", "int64"),
+                        ("length", "int64"), ("label", "int64")])
+
+
+def is_packed(prefix):
+    """Whether prefix is a complete packed dataset."""
+    return os.path.isfile(prefix + ".json")
+
+
+class PackedRecords(object):
+    """
+    Random access to the records of a packed dataset.
+
+    Args:
+        prefix (string): The prefix of the dataset files.
+        use_mmap (bool): Read the records from mmaps of the shards, or with
+            os.pread otherwise.
+    """
+
+    def __init__(self, prefix, use_mmap=True):
+        with open(prefix + ".json") as f:
+            meta = json.load(f)
+        root = os.path.dirname(os.path.abspath(prefix))
+        self.shards = [os.path.join(root, name) for name in meta["shards"]]
+        self.classes = meta["classes"]
+        self.index = np.load(prefix + ".index.npy")
+        self.labels = self.index["label"]
+        self.use_mmap = use_mmap or not hasattr(os, "pread")
+        # (pid, fds, mmaps) of the process which opened the shards
+        self._files = (None, [], [])
+
+    def __len__(self):
+        return len(self.index)
+
+    def _open(self):
+        # every process opens the shards itself, the tuple is replaced at
+        # once so that the threads of a process can share it
+        fds = []
+        maps = []
+        for path in self.shards:
+            fd = os.open(path, os.O_RDONLY)
+            fds.append(fd)
+            if self.use_mmap and os.fstat(fd).st_size > 0:
+                maps.append(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
+            else:
+                maps.append(None)
+        self._files = (os.getpid(), fds, maps)
+        return self._files
+
+    def read(self, i):
+        """Returns the encoded bytes of record i."""
+        pid, fds, maps = self._files
+        if pid != os.getpid():
+            pid, fds, maps = self._open()
+        shard, offset, length, _ = self.index[i]
+        if self.use_mmap:
+            return maps[shard][offset:offset + length]
+        return os.pread(fds[shard], int(length), int(offset))
+
+    def close(self):
+        pid, fds, maps = self._files
+        if pid == os.getpid():
+            for m in maps:
+                if m is not None:
+                    m.close()
+            for fd in fds:
+                os.close(fd)
+        self._files = (None, [], [])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_files"] = (None, [], [])
+        return state
+
+
+def _pack_shard(job):
+    paths, shard_path = job
+    lengths = []
+    tmp = "%s.%d.tmp" % (shard_path, os.getpid())
+    with open(tmp, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            out.write(data)
+            lengths.append(len(data))
+    os.rename(tmp, shard_path)
+    return lengths
+
+
+def build(samples, prefix, classes, num_shards=8, num_workers=8):
+    """
+    Pack the image files of samples into a packed dataset at prefix.
+
+    Args:
+        samples (list): The (path, label) tuples in the order of the records.
+        classes (list): The class names.
+        num_shards (int): The number of shard files.
+        num_workers (int): The number of processes writing the shards.
+    """
+    num_shards = max(1, min(num_shards, len(samples)))
+    bounds = np.linspace(0, len(samples), num_shards + 1).astype("int64")
+    names = [
+        "%s-%05d-of-%05d.rec" % (os.path.basename(prefix), i, num_shards)
+        for i in range(num_shards)
+    ]
+    root = os.path.dirname(os.path.abspath(prefix))
+    jobs = [([path for path, _ in samples[bounds[i]:bounds[i + 1]]],
+             os.path.join(root, names[i])) for i in range(num_shards)]
+    if num_workers > 1:
+        pool = multiprocessing.Pool(min(num_workers, num_shards))
+        try:
+            shard_lengths = pool.map(_pack_shard, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        shard_lengths = [_pack_shard(job) for job in jobs]
+
+    index = np.empty(len(samples), dtype=INDEX_DTYPE)
+    for i, lengths in enumerate(shard_lengths):
+        lengths = np.asarray(lengths, dtype="int64")
+        begin, end = bounds[i], bounds[i + 1]
+        index["shard"][begin:end] = i
+        index["length"][begin:end] = lengths
+        index["offset"][begin:end] = np.cumsum(lengths) - lengths
+    index["label"] = [label for _, label in samples]
+    np.save(prefix + ".index.npy", index)
+    with open(prefix + ".json", "w") as f:
+        json.dump({"classes": list(classes), "shards": names}, f)
+
+
+def _folder_samples(image_dir,
+                    extensions=('.jpg', '.jpeg', '.png', '.bmp', '.tif',
+                                '.tiff')):
+    classes = sorted(d for d in os.listdir(image_dir)
+                     if os.path.isdir(os.path.join(image_dir, d)))
+    samples = []
+    for label, name in enumerate(classes):
+        for root, _, fnames in sorted(os.walk(os.path.join(image_dir, name))):
+            for fname in sorted(fnames):
+                if fname.lower().endswith(extensions):
+                    samples.append((os.path.join(root, fname), label))
+    return samples, classes
+
+
+def _list_samples(file_list, image_root):
+    samples = []
+    with open(file_list) as f:
+        for line in f:
+            path, label = line.split()
+            # the same file names as reader_cv2 opens
+            path = path.replace("JPEG", "jpeg")
+            samples.append((os.path.join(image_root, path), int(label)))
+    num_classes = max(label for _, label in samples) + 1 if samples else 0
+    return samples, [str(i) for i in range(num_classes)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a packed dataset.")
+    parser.add_argument("--image_dir", type=str, default=None,
+                        help="The image folder, one subdirectory per class.")
+    parser.add_argument("--file_list", type=str, default=None,
+                        help="The file of 'path label' lines.")
+    parser.add_argument("--image_root", type=str, default="",
+                        help="The directory of the paths in file_list.")
+    parser.add_argument("--output", type=str, required=True,
+                        help="The prefix of the packed dataset.")
+    parser.add_argument("--num_shards", type=int, default=64)
+    parser.add_argument("--num_workers", type=int, default=8)
+    args = parser.parse_args()
+    if args.image_dir is not None:
+        samples, classes = _folder_samples(args.image_dir)
+    elif args.file_list is not None:
+        samples, classes = _list_samples(args.file_list, args.image_root)
+    else:
+        parser.error("one of --image_dir and --file_list is required")
+    build(samples, args.output, classes, args.num_shards, args.num_workers)
+    print("packed %d images into %d shards at %s" %
+          (len(samples), min(args.num_shards, len(samples)), args.output))
+
+
+if __name__ == "__main__":
+    main()
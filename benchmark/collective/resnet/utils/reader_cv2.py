@@ -20,8 +20,27 @@ import paddle.fluid as fluid
 import random
 
 from .img_tool import process_image
+from . import packed_dataset
 DATA_DIR=""
 
+def _process_batch(samples, image_mapper, with_label=True):
+    """ process the samples of a batch into one [B, 3, H, W] image array and
+    one [B, 1] int64 label array """
+    imgs = None
+    labels = np.empty((len(samples), 1), dtype='int64')
+    for i, sample in enumerate(samples):
+        out = image_mapper(sample)
+        if imgs is None:
+            imgs = np.empty((len(samples), ) + out[0].shape, dtype=out[0].dtype)
+        imgs[i] = out[0]
+        if with_label:
+            labels[i, 0] = out[1]
+    return (imgs, labels) if with_label else (imgs, )
+
+def _process_record(sample, records, image_mapper):
+    raw_img = np.frombuffer(records.read(sample[0]), dtype='uint8')
+    return image_mapper((raw_img, ) + tuple(sample[1:]))
+
 def _reader_creator(settings,
                     file_list,
                     mode,
@@ -31,46 +50,61 @@ def _reader_creator(settings,
                     data_dir=DATA_DIR,
                     pass_id_as_seed=0,
                     threads=4,
-                    buf_size=4000):
+                    buf_size=4000,
+                    batch_size=None):
+    """ the reader of the processed samples, or of whole batches of
+    contiguous arrays if batch_size is set. The images are read from the
+    packed dataset data_dir/<mode> instead of the files if it exists. """
+    records = None
+    if mode in ('train', 'val') and packed_dataset.is_packed(
+            os.path.join(data_dir, mode)):
+        records = packed_dataset.PackedRecords(os.path.join(data_dir, mode))
+
     def reader():
-        with open(file_list) as flist:
-            full_lines = [line.strip() for line in flist]
-            if shuffle:
-                random.Random(pass_id_as_seed).shuffle(full_lines)
-            
-            if mode == 'train':
-                trainer_id = int(os.getenv("PADDLE_TRAINER_ID", "0"))
-                if os.getenv("PADDLE_TRAINER_ENDPOINTS"):
-                    trainer_count = len(os.getenv("PADDLE_TRAINER_ENDPOINTS").split(","))
-                else:
-                    trainer_count = int(os.getenv("PADDLE_TRAINERS", "1"))
+        if records is not None:
+            # the lines are the indices of the records
+            full_lines = list(range(len(records)))
+        else:
+            with open(file_list) as flist:
+                full_lines = [line.strip() for line in flist]
+        if shuffle:
+            random.Random(pass_id_as_seed).shuffle(full_lines)
 
-                per_node_lines = len(full_lines) // trainer_count
-                lines = full_lines[trainer_id * per_node_lines:(trainer_id + 1)
-                                   * per_node_lines]
-                print("trainerid, trainer_count", trainer_id, trainer_count)
-                print(
-                    "read images from %d, length: %d, lines length: %d, total: %d"
-                    % (trainer_id * per_node_lines, per_node_lines, len(lines),
-                       len(full_lines)))
+        if mode == 'train':
+            trainer_id = int(os.getenv("PADDLE_TRAINER_ID", "0"))
+            if os.getenv("PADDLE_TRAINER_ENDPOINTS"):
+                trainer_count = len(os.getenv("PADDLE_TRAINER_ENDPOINTS").split(","))
             else:
-                print("mode is not train")
-                lines = full_lines
+                trainer_count = int(os.getenv("PADDLE_TRAINERS", "1"))
 
-            for line in lines:
-                if mode == 'train':
-                    img_path, label = line.split()
-                    img_path = img_path.replace("JPEG", "jpeg")
-                    img_path = os.path.join(data_dir, "train", img_path)
-                    yield (img_path, int(label))
-                elif mode == 'val':
-                    img_path, label = line.split()
-                    img_path = img_path.replace("JPEG", "jpeg")
-                    img_path = os.path.join(data_dir, "val", img_path)
-                    yield (img_path, int(label))
-                elif mode == 'test':
-                    img_path = os.path.join(data_dir, line)
-                    yield [img_path]
+            per_node_lines = len(full_lines) // trainer_count
+            lines = full_lines[trainer_id * per_node_lines:(trainer_id + 1)
+                               * per_node_lines]
+            print("trainerid, trainer_count", trainer_id, trainer_count)
+            print(
+                "read images from %d, length: %d, lines length: %d, total: %d"
+                % (trainer_id * per_node_lines, per_node_lines, len(lines),
+                   len(full_lines)))
+        else:
+            print("mode is not train")
+            lines = full_lines
+
+        for line in lines:
+            if records is not None:
+                yield (line, int(records.labels[line]))
+            elif mode == 'train':
+                img_path, label = line.split()
+                img_path = img_path.replace("JPEG", "jpeg")
+                img_path = os.path.join(data_dir, "train", img_path)
+                yield (img_path, int(label))
+            elif mode == 'val':
+                img_path, label = line.split()
+                img_path = img_path.replace("JPEG", "jpeg")
+                img_path = os.path.join(data_dir, "val", img_path)
+                yield (img_path, int(label))
+            elif mode == 'test':
+                img_path = os.path.join(data_dir, line)
+                yield [img_path]
 
 
     image_mapper = functools.partial(
@@ -79,7 +113,21 @@ def _reader_creator(settings,
         mode=mode,
         color_jitter=color_jitter,
         rotate=rotate,
-        crop_size=224)
+        crop_size=224,
+        normalize=not getattr(settings, 'normalize_on_device', False))
+    if records is not None:
+        # the workers read and decode the records
+        image_mapper = functools.partial(
+            _process_record, records=records, image_mapper=image_mapper)
+    if batch_size is not None:
+        # the workers process the batches of image paths, buf_size is
+        # counted in samples
+        batch_mapper = functools.partial(
+            _process_batch, image_mapper=image_mapper,
+            with_label=mode != 'test')
+        return paddle.reader.xmap_readers(
+            batch_mapper, paddle.batch(reader, batch_size), threads,
+            max(buf_size // batch_size, threads), order=False)
     reader = paddle.reader.xmap_readers(
         image_mapper, reader, threads, buf_size, order=False)
     return reader
@@ -88,7 +136,8 @@ def train(settings,
           data_dir=DATA_DIR,
           pass_id_as_seed=0,
           threads=4,
-          buf_size=4000):
+          buf_size=4000,
+          batch_size=None):
     file_list = os.path.join(data_dir, 'train.txt')
     reader =  _reader_creator(
         settings,
@@ -101,13 +150,16 @@ def train(settings,
         pass_id_as_seed=pass_id_as_seed,
         threads=threads,
         buf_size=buf_size,
+        batch_size=batch_size,
         )
     return reader
 
-def val(settings, data_dir=DATA_DIR, threads=16, buf_size=4000):
+def val(settings, data_dir=DATA_DIR, threads=16, buf_size=4000,
+        batch_size=None):
     file_list = os.path.join(data_dir, 'val.txt')
     return _reader_creator(settings ,file_list, 'val', shuffle=False, 
-            data_dir=data_dir, threads=threads, buf_size=buf_size)
+            data_dir=data_dir, threads=threads, buf_size=buf_size,
+            batch_size=batch_size)
 
 
 def test(data_dir=DATA_DIR, threads=4, buf_size=4000):
@@ -0,0 +1,214 @@
+#copyright (c) 2019 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+"""
+Assemble the padded inputs of a transformer batch with numpy.
+
+The token ids of a batch are flattened once and scattered into the padded
+word array with a length mask, the positions, label weights and attention
+biases are derived from the same mask. The arrays can be written into
+reusable buffers, and the attention biases can be kept in the compact
+shapes [B, 1, 1, L] / [1, 1, L, L] for models which broadcast them over the
+heads and queries.
+"""
+
+import itertools
+
+import numpy as np
+
+NEG_INF = -1e9
+
+
+class BatchBuffers(object):
+    """
+    Reusable arrays grown to the largest batch seen. An array returned by
+    get is overwritten by the next call with the same name, so the consumer
+    must copy it first, as py_reader does when it converts the arrays to
+    tensors.
+    """
+
+    def __init__(self):
+        self._arrays = {}
+
+    def get(self, name, shape, dtype):
+        size = int(np.prod(shape))
+        array = self._arrays.get(name)
+        if array is None or array.dtype != np.dtype(dtype) or array.size < size:
+            array = np.empty(size, dtype=dtype)
+            self._arrays[name] = array
+        return array[:size].reshape(shape)
+
+
+def _new_array(buffers, name, shape, dtype):
+    if buffers is None:
+        return np.empty(shape, dtype=dtype)
+    return buffers.get(name, shape, dtype)
+
+
+def _broadcast_into(buffers, name, compact, shape):
+    out = _new_array(buffers, name, shape, "float32")
+    out[...] = compact
+    return out
+
+
+def pad_tokens(insts, pad_idx, buffers=None, name=""):
+    """
+    Pad the instances to the max sequence length in batch.
+    Returns:
+        word: int64 array of shape [B, L]
+        mask: bool array of shape [B, L], True for the real tokens
+        lengths: int64 array of shape [B]
+    """
+    lengths = np.fromiter((len(inst) for inst in insts), dtype="int64",
+                          count=len(insts))
+    max_len = int(lengths.max())
+    mask = np.arange(max_len) < lengths[:, None]
+    word = _new_array(buffers, name + "word", (len(insts), max_len), "int64")
+    word.fill(pad_idx)
+    word[mask] = np.fromiter(
+        itertools.chain.from_iterable(insts),
+        dtype="int64",
+        count=int(lengths.sum()))
+    return word, mask, lengths
+
+
+def padding_bias(mask, buffers=None, name=""):
+    """
+    The compact bias of shape [B, 1, 1, L] to avoid attention on paddings.
+    """
+    bias = _new_array(buffers, name + "compact_bias",
+                      (mask.shape[0], 1, 1, mask.shape[1]), "float32")
+    bias[:, 0, 0, :] = np.where(mask, 0., NEG_INF)
+    return bias
+
+
+def causal_bias(max_len):
+    """
+    The compact bias of shape [1, 1, L, L] to avoid attention on the
+    subsequent words.
+    """
+    return (np.triu(np.ones((max_len, max_len), dtype="float32"), 1) *
+            NEG_INF).reshape([1, 1, max_len, max_len])
+
+
+def pad_batch_data(insts,
+                   pad_idx,
+                   n_head,
+                   is_target=False,
+                   is_label=False,
+                   return_attn_bias=True,
+                   return_max_len=True,
+                   return_num_token=False,
+                   buffers=None,
+                   name="",
+                   compact_bias=False):
+    """
+    Pad the instances to the max sequence length in batch, and generate the
+    corresponding position data and attention bias. The attention bias is
+    [B, n_head, L, L], or [B, 1, 1, L] for the source and [1, 1, L, L] for
+    the target if compact_bias is set.
+    """
+    return_list = []
+    # Any token included in dict can be used to pad, since the paddings' loss
+    # will be masked out by weights and make no effect on parameter gradients.
+    inst_data, mask, lengths = pad_tokens(insts, pad_idx, buffers, name)
+    batch_size, max_len = mask.shape
+    return_list += [inst_data.reshape([-1, 1])]
+    if is_label:  # label weight
+        inst_weight = _new_array(buffers, name + "weight", mask.shape,
+                                 "float32")
+        inst_weight[...] = mask
+        return_list += [inst_weight.reshape([-1, 1])]
+    else:  # position data
+        inst_pos = _new_array(buffers, name + "pos", mask.shape, "int64")
+        np.multiply(mask, np.arange(max_len), out=inst_pos)
+        return_list += [inst_pos.reshape([-1, 1])]
+    if return_attn_bias:
+        if is_target:
+            # This is used to avoid attention on paddings and subsequent
+            # words.
+            slf_attn_bias_data = causal_bias(max_len)
+        else:
+            # This is used to avoid attention on paddings.
+            slf_attn_bias_data = padding_bias(mask, buffers, name)
+        if not compact_bias:
+            slf_attn_bias_data = _broadcast_into(
+                buffers, name + "slf_attn_bias", slf_attn_bias_data,
+                (batch_size, n_head, max_len, max_len))
+        return_list += [slf_attn_bias_data]
+    if return_max_len:
+        return_list += [max_len]
+    if return_num_token:
+        return_list += [int(lengths.sum())]
+    return return_list if len(return_list) > 1 else return_list[0]
+
+
+def src_attn_bias(src_slf_attn_bias, trg_max_len, buffers=None, name="",
+                  compact_bias=False):
+    """
+    The bias of the encoder-decoder attention, [B, n_head, trg_max_len, L]
+    built from the source self attention bias, or its compact [B, 1, 1, L]
+    form if compact_bias is set.
+    """
+    if compact_bias:
+        return src_slf_attn_bias
+    batch_size, n_head, _, src_max_len = src_slf_attn_bias.shape
+    return _broadcast_into(buffers, name + "src_attn_bias",
+                           src_slf_attn_bias[:, :, :1, :],
+                           (batch_size, n_head, trg_max_len, src_max_len))
+
+
+def prepare_train_input(insts, src_pad_idx, trg_pad_idx, n_head,
+                        buffers=None, compact_bias=False):
+    """
+    Assemble the padded training inputs of a batch of (src, trg, label)
+    instances.
+    Returns:
+        The list of src_word, src_pos, src_slf_attn_bias, trg_word, trg_pos,
+        trg_slf_attn_bias, trg_src_attn_bias, lbl_word, lbl_weight, the
+        number of label tokens and the lengths of src and trg.
+    """
+    src_word, src_pos, src_slf_attn_bias, src_max_len = pad_batch_data(
+        [inst[0] for inst in insts], src_pad_idx, n_head, is_target=False,
+        buffers=buffers, name="src_", compact_bias=compact_bias)
+    src_word = src_word.reshape(-1, src_max_len, 1)
+    src_pos = src_pos.reshape(-1, src_max_len, 1)
+    trg_word, trg_pos, trg_slf_attn_bias, trg_max_len = pad_batch_data(
+        [inst[1] for inst in insts], trg_pad_idx, n_head, is_target=True,
+        buffers=buffers, name="trg_", compact_bias=compact_bias)
+    trg_word = trg_word.reshape(-1, trg_max_len, 1)
+    trg_pos = trg_pos.reshape(-1, trg_max_len, 1)
+
+    trg_src_attn_bias = src_attn_bias(src_slf_attn_bias, trg_max_len,
+                                      buffers, "trg_", compact_bias)
+
+    lbl_word, lbl_weight, num_token = pad_batch_data(
+        [inst[2] for inst in insts],
+        trg_pad_idx,
+        n_head,
+        is_target=False,
+        is_label=True,
+        return_attn_bias=False,
+        return_max_len=False,
+        return_num_token=True,
+        buffers=buffers,
+        name="lbl_")
+
+    src_lens = np.fromiter((len(inst[0]) for inst in insts), dtype="int64",
+                           count=len(insts))
+    trg_lens = np.fromiter((len(inst[1]) for inst in insts), dtype="int64",
+                           count=len(insts))
+    return [
+        src_word, src_pos, src_slf_attn_bias, trg_word, trg_pos,
+        trg_slf_attn_bias, trg_src_attn_bias, lbl_word, lbl_weight
+    ], num_token, src_lens, trg_lens
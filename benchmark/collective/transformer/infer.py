@@ -22,6 +22,7 @@ import numpy as np
 import os
 import sys
 from functools import partial
+from six.moves import queue
 
 import paddle
 import paddle.fluid as fluid
@@ -30,7 +31,9 @@ import reader
 from config import *
 from desc import *
 from model import fast_decode as fast_decoder
-from train import pad_batch_data, prepare_data_generator
+from train import prepare_data_generator
+import batch_assembly
+import result_decoder
 
 
 def parse_args():
@@ -60,6 +63,20 @@ def parse_args():
         type=int,
         default=10000,
         help="The buffer size to pool data.")
+    parser.add_argument(
+        "--sort_by_length",
+        type=ast.literal_eval,
+        default=False,
+        help="The flag indicating whether to batch the sentences sorted by "
+        "length to reduce the paddings. The translations are still written "
+        "in the input order.")
+    parser.add_argument(
+        "--use_token_batch",
+        type=ast.literal_eval,
+        default=False,
+        help="The flag indicating whether to produce batch data according to "
+        "token number, batch_size is the number of tokens then. Only works "
+        "with sort_by_length.")
     parser.add_argument(
         "--special_token",
         type=str,
@@ -82,6 +99,11 @@ def parse_args():
         type=ast.literal_eval,
         default=False,
         help="The flag indicating whether to use ParallelExecutor.")
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        default="",
+        help="The file to write the translations to, stdout if not set.")
     parser.add_argument(
         'opts',
         help='See config.py for all options',
@@ -102,38 +124,17 @@ def parse_args():
     return args
 
 
-def post_process_seq(seq,
-                     bos_idx=ModelHyperParams.bos_idx,
-                     eos_idx=ModelHyperParams.eos_idx,
-                     output_bos=InferTaskConfig.output_bos,
-                     output_eos=InferTaskConfig.output_eos):
-    """
-    Post-process the beam-search decoded sequence. Truncate from the first
-    <eos> and remove the <bos> and <eos> tokens currently.
-    """
-    eos_pos = len(seq) - 1
-    for i, idx in enumerate(seq):
-        if idx == eos_idx:
-            eos_pos = i
-            break
-    seq = [
-        idx for idx in seq[:eos_pos + 1]
-        if (output_bos or idx != bos_idx) and (output_eos or idx != eos_idx)
-    ]
-    return seq
-
-
 def prepare_batch_input(insts, data_input_names, src_pad_idx, bos_idx, n_head,
                         d_model, place):
     """
     Put all padded data needed by beam search decoder into a dict.
     """
-    src_word, src_pos, src_slf_attn_bias, src_max_len = pad_batch_data(
-        [inst[0] for inst in insts], src_pad_idx, n_head, is_target=False)
+    src_word, src_pos, src_slf_attn_bias, src_max_len = \
+        batch_assembly.pad_batch_data(
+            [inst[0] for inst in insts], src_pad_idx, n_head, is_target=False)
     # start tokens
     trg_word = np.asarray([[bos_idx]] * len(insts), dtype="int64")
-    trg_src_attn_bias = np.tile(src_slf_attn_bias[:, :, ::src_max_len, :],
-                                [1, 1, 1, 1]).astype("float32")
+    trg_src_attn_bias = batch_assembly.src_attn_bias(src_slf_attn_bias, 1)
     trg_word = trg_word.reshape(-1, 1, 1)
     src_word = src_word.reshape(-1, src_max_len, 1)
     src_pos = src_pos.reshape(-1, src_max_len, 1)
@@ -161,15 +162,18 @@ def prepare_batch_input(insts, data_input_names, src_pad_idx, bos_idx, n_head,
     return data_input_dict
 
 
-def prepare_feed_dict_list(data_generator, count, place):
+def prepare_feed_dict_list(data_generator, count, place, sample_ids=None):
     """
-    Prepare the list of feed dict for multi-devices.
+    Prepare the list of feed dict for multi-devices. If sample_ids is set,
+    the sample ids of every device batch are put into it.
     """
     feed_dict_list = []
     if data_generator is not None:  # use_py_reader == False
         data_input_names = encoder_data_input_fields + fast_decoder_data_input_fields
         data = next(data_generator)
         for idx, data_buffer in enumerate(data):
+            if sample_ids is not None:
+                sample_ids.put([inst[-1] for inst in data_buffer])
             data_input_dict = prepare_batch_input(
                 data_buffer, data_input_names, ModelHyperParams.eos_idx,
                 ModelHyperParams.bos_idx, ModelHyperParams.n_head,
@@ -178,14 +182,18 @@ def prepare_feed_dict_list(data_generator, count, place):
     return feed_dict_list if len(feed_dict_list) == count else None
 
 
-def py_reader_provider_wrapper(data_reader, place):
+def py_reader_provider_wrapper(data_reader, place, sample_ids=None):
     """
-    Data provider needed by fluid.layers.py_reader.
+    Data provider needed by fluid.layers.py_reader. If sample_ids is set,
+    the sample ids of every batch are put into it in the order of the
+    batches fed to py_reader.
     """
 
     def py_reader_provider():
         data_input_names = encoder_data_input_fields + fast_decoder_data_input_fields
         for batch_id, data in enumerate(data_reader()):
+            if sample_ids is not None:
+                sample_ids.put([inst[-1] for inst in data])
             data_input_dict = prepare_batch_input(
                 data, data_input_names, ModelHyperParams.eos_idx,
                 ModelHyperParams.bos_idx, ModelHyperParams.n_head,
@@ -254,29 +262,59 @@ def fast_infer(args):
 
     # data reader settings for inference
     args.train_file_pattern = args.test_file_pattern
-    args.use_token_batch = False
-    args.sort_type = reader.SortType.NONE
+    if args.sort_by_length:
+        # the sample ids must follow the batches actually run: py_reader
+        # hands its batches to the devices of ParallelExecutor in no fixed
+        # order, and Executor only runs the first of the device batches fed
+        if args.use_py_reader and args.use_parallel_exe:
+            raise ValueError("sort_by_length does not work with use_py_reader "
+                             "and use_parallel_exe both set.")
+        if not args.use_py_reader and not args.use_parallel_exe and \
+                dev_count > 1:
+            raise ValueError("sort_by_length without use_py_reader and "
+                             "use_parallel_exe needs a single device, set "
+                             "CPU_NUM=1 or CUDA_VISIBLE_DEVICES.")
+        # batch sentences of similar lengths, the sample ids of the batches
+        # are used to write the translations in the input order
+        args.sort_type = reader.SortType.GLOBAL
+        sample_ids = queue.Queue()
+    else:
+        args.use_token_batch = False
+        args.sort_type = reader.SortType.NONE
+        sample_ids = None
     args.shuffle = False
     args.shuffle_batch = False
+    args.num_trainers = 1
+    args.token_cache_dir = None
     test_data = prepare_data_generator(
         args,
         is_test=False,
         count=dev_count,
         pyreader=pyreader,
-        py_reader_provider_wrapper=py_reader_provider_wrapper,
-        place=place)
+        py_reader_provider_wrapper=partial(
+            py_reader_provider_wrapper, sample_ids=sample_ids),
+        place=place,
+        with_sample_ids=args.sort_by_length)
     if args.use_py_reader:
         pyreader.start()
         data_generator = None
     else:
         data_generator = test_data()
-    trg_idx2word = reader.DataReader.load_dict(
-        dict_path=args.trg_vocab_fpath, reverse=True)
+    trg_vocab = result_decoder.vocab_array(
+        reader.DataReader.load_dict(
+            dict_path=args.trg_vocab_fpath, reverse=True))
+    out_file = open(args.output_file, "w") if args.output_file else None
+    writer = result_decoder.AsyncWriter(out_file)
+    if args.sort_by_length:
+        writer = result_decoder.OrderedWriter(writer)
+    # the number of device batches in the results of one run, which are
+    # merged in the order of the devices
+    run_batches = dev_count if args.use_parallel_exe else 1
 
     while True:
         try:
             feed_dict_list = prepare_feed_dict_list(data_generator, dev_count,
-                                                    place)
+                                                    place, sample_ids)
             if args.use_parallel_exe:
                 seq_ids, seq_scores = infer_exe.run(
                     fetch_list=[out_ids.name, out_scores.name],
@@ -303,29 +341,26 @@ def fast_infer(args):
                 #   from lod[1]:
                 #     the first source sentence has 3 hyps; the lengths are 12, 12, 16
                 #     the second source sentence has 3 hyps; the lengths are 14, 13, 15
-                hyps = [[] for i in range(len(seq_ids.lod()[0]) - 1)]
-                scores = [[] for i in range(len(seq_scores.lod()[0]) - 1)]
-                for i in range(len(seq_ids.lod()[0]) -
-                               1):  # for each source sentence
-                    start = seq_ids.lod()[0][i]
-                    end = seq_ids.lod()[0][i + 1]
-                    for j in range(end - start):  # for each candidate
-                        sub_start = seq_ids.lod()[1][start + j]
-                        sub_end = seq_ids.lod()[1][start + j + 1]
-                        hyps[i].append(" ".join([
-                            trg_idx2word[idx]
-                            for idx in post_process_seq(
-                                np.array(seq_ids)[sub_start:sub_end])
-                        ]))
-                        scores[i].append(np.array(seq_scores)[sub_end - 1])
-                        print(hyps[i][-1])
-                        if len(hyps[i]) >= InferTaskConfig.n_best:
-                            break
+                sents, hyps, scores = result_decoder.decode_batch(
+                    np.array(seq_ids), seq_ids.lod(), np.array(seq_scores),
+                    trg_vocab, InferTaskConfig.n_best,
+                    ModelHyperParams.bos_idx, ModelHyperParams.eos_idx,
+                    InferTaskConfig.output_bos, InferTaskConfig.output_eos)
+                if sample_ids is not None:
+                    batch_ids = []
+                    for _ in range(run_batches):
+                        batch_ids.extend(sample_ids.get())
+                    writer.write(hyps, [batch_ids[i] for i in sents])
+                else:
+                    writer.write(hyps)
         except (StopIteration, fluid.core.EOFException):
             # The data pass is over.
             if args.use_py_reader:
                 pyreader.reset()
             break
+    writer.close()
+    if out_file is not None:
+        out_file.close()
 
 
 if __name__ == "__main__":
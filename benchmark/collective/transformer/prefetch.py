@@ -0,0 +1,256 @@
+#copyright (c) 2019 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+"""
+Prepare the batches of a reader in worker processes.
+
+The raw batches are sent to the workers, which run the batch preparation
+(padding, attention bias) and write the resulting arrays into one of
+queue_depth shared memory slots. Only the shapes and offsets go back through
+the queue, the consumer reads the arrays in place from the slot. A slot is
+reused once the consumer asks for the next batch, which is safe for
+py_reader since it copies the arrays into tensors before that.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+from six.moves import queue
+
+ALIGN = 64
+
+
+class PrefetchStats(object):
+    def __init__(self):
+        self.batches = 0
+        self.pickled_batches = 0
+        # seconds the workers waited for a raw batch or a free slot
+        self.worker_stall_time = 0.
+        # seconds the consumer waited for a prepared batch
+        self.consumer_wait_time = 0.
+        self.max_ready = 0
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "pickled_batches": self.pickled_batches,
+            "worker_stall_time": self.worker_stall_time,
+            "consumer_wait_time": self.consumer_wait_time,
+            "max_ready": self.max_ready
+        }
+
+
+def _write_slot(slot, arrays):
+    """
+    Copy the arrays into the slot one after another, returns their metas or
+    None if they do not fit.
+    """
+    metas = []
+    offset = 0
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        end = offset + array.nbytes
+        if end > len(slot):
+            return None
+        metas.append((offset, array.dtype.str, array.shape))
+        offset = end + (-end) % ALIGN
+    buf = np.frombuffer(slot, dtype="uint8")
+    for array, (offset, _, _) in zip(arrays, metas):
+        array = np.ascontiguousarray(array)
+        buf[offset:offset + array.nbytes] = array.reshape(-1).view("uint8")
+    return metas
+
+
+def _read_slot(slot, metas):
+    arrays = []
+    for offset, dtype, shape in metas:
+        count = int(np.prod(shape))
+        arrays.append(
+            np.frombuffer(slot, dtype=dtype, count=count,
+                          offset=offset).reshape(shape))
+    return arrays
+
+
+def _worker_loop(process_fn, slots, task_queue, free_slots, result_queue):
+    while True:
+        start = time.time()
+        task = task_queue.get()
+        if task is None:
+            break
+        seq, data = task
+        stall = time.time() - start
+        arrays = process_fn(data)
+        start = time.time()
+        slot_id = free_slots.get()
+        stall += time.time() - start
+        metas = _write_slot(slots[slot_id], arrays)
+        if metas is None:
+            # larger than a slot, send copies of the arrays themselves: the
+            # queue pickles them in its feeder thread, after process_fn may
+            # already reuse their buffers for the next batch
+            free_slots.put(slot_id)
+            arrays = [np.array(array, copy=True) for array in arrays]
+            result_queue.put((seq, None, arrays, stall))
+        else:
+            result_queue.put((seq, slot_id, metas, stall))
+
+
+class MultiprocessPrefetcher(object):
+    """
+    Wrap a batch reader so that process_fn runs on its batches in
+    num_workers processes.
+
+    :param reader: The callable returning the iterator of raw batches.
+    :param process_fn: The function mapping a raw batch to a list of numpy
+        arrays, it runs in the workers.
+    :param num_workers: The number of worker processes.
+    :param queue_depth: The number of batches prepared ahead, every one of
+        them owns a shared memory slot.
+    :param slot_size: The bytes of a slot, larger batches are pickled.
+    :param ordered: Whether the batches are yielded in the order of the
+        reader, otherwise in the order they are ready.
+    """
+
+    def __init__(self,
+                 reader,
+                 process_fn,
+                 num_workers=4,
+                 queue_depth=8,
+                 slot_size=128 << 20,
+                 ordered=True):
+        self._reader = reader
+        self._process_fn = process_fn
+        self._num_workers = num_workers
+        self._queue_depth = max(queue_depth, num_workers)
+        self._slot_size = slot_size
+        self._ordered = ordered
+        self._slots = None
+        self.stats = PrefetchStats()
+        self._result_queue = None
+        self._ready = {}
+
+    def queue_depth(self):
+        """
+        The number of prepared batches waiting for the consumer.
+        """
+        size = len(self._ready)
+        if self._result_queue is not None:
+            try:
+                size += self._result_queue.qsize()
+            except NotImplementedError:
+                pass
+        return size
+
+    def _feed(self, task_queue, in_flight, stop):
+        seq = 0
+        for data in self._reader():
+            # at most queue_depth batches are in flight, so every one of
+            # them can get a slot and the ordered consumer never deadlocks
+            while not in_flight.acquire(False):
+                if stop.is_set():
+                    return
+                time.sleep(0.001)
+            if stop.is_set():
+                return
+            task_queue.put((seq, data))
+            seq += 1
+        self._num_batches = seq
+        for _ in range(self._num_workers):
+            task_queue.put(None)
+
+    def _take(self, next_seq):
+        if self._ordered:
+            return next_seq if next_seq in self._ready else None
+        return min(self._ready) if self._ready else None
+
+    def _receive(self, result_queue, feeder, workers):
+        try:
+            seq, slot_id, payload, stall = result_queue.get(timeout=0.1)
+        except queue.Empty:
+            if not feeder.is_alive() and self._num_batches is None:
+                raise RuntimeError("the batch reader failed")
+            if not all(worker.is_alive() for worker in workers):
+                raise RuntimeError("a prefetch worker died")
+            return
+        self._ready[seq] = (slot_id, payload)
+        self.stats.worker_stall_time += stall
+        self.stats.max_ready = max(self.stats.max_ready, len(self._ready))
+
+    def __call__(self):
+        if self._slots is None:
+            self._slots = [
+                multiprocessing.RawArray("b", self._slot_size)
+                for _ in range(self._queue_depth)
+            ]
+        task_queue = multiprocessing.Queue()
+        free_slots = multiprocessing.Queue()
+        self._result_queue = result_queue = multiprocessing.Queue()
+        for slot_id in range(self._queue_depth):
+            free_slots.put(slot_id)
+        workers = [
+            multiprocessing.Process(
+                target=_worker_loop,
+                args=(self._process_fn, self._slots, task_queue, free_slots,
+                      result_queue)) for _ in range(self._num_workers)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        in_flight = threading.Semaphore(self._queue_depth)
+        stop = threading.Event()
+        self._num_batches = None
+        feeder = threading.Thread(
+            target=self._feed, args=(task_queue, in_flight, stop))
+        feeder.daemon = True
+        feeder.start()
+
+        self._ready = {}
+        next_seq = 0
+        try:
+            while True:
+                start = time.time()
+                seq = self._take(next_seq)
+                while seq is None:
+                    if self._num_batches is not None and \
+                            next_seq >= self._num_batches:
+                        break
+                    self._receive(result_queue, feeder, workers)
+                    seq = self._take(next_seq)
+                if seq is None:
+                    break
+                self.stats.consumer_wait_time += time.time() - start
+
+                slot_id, payload = self._ready.pop(seq)
+                next_seq += 1
+                self.stats.batches += 1
+                if slot_id is None:
+                    self.stats.pickled_batches += 1
+                    yield payload
+                else:
+                    yield _read_slot(self._slots[slot_id], payload)
+                    free_slots.put(slot_id)
+                in_flight.release()
+        finally:
+            stop.set()
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for worker in workers:
+                worker.join()
+            self._result_queue = None
+            logging.info("prefetch stats: %s" % self.stats.as_dict())
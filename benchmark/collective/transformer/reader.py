@@ -15,13 +15,21 @@
 # This file is mainly from Paddle/models,
 # the repo: https://github.com/PaddlePaddle/models.git
 
+import array
+import collections
 import glob
+import hashlib
+import json
 import six
 import os
+import shutil
 import tarfile
 
 import numpy as np
 
+# the number of batch plans a DataReader keeps
+PLAN_CACHE_SIZE = 2
+
 
 class SortType(object):
     GLOBAL = 'global'
@@ -112,6 +120,129 @@ class MinMaxFilter(object):
         return self._creator.batch
 
 
+class TokenStore(object):
+    """
+    The token ids of one side of the corpus in flat arrays: tokens holds
+    the ids of all sentences one after another and the ids of sentence i
+    are tokens[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, tokens, offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.lengths = np.diff(offsets).astype("int32")
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, idx):
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]].tolist()
+
+    def save(self, prefix):
+        np.save(prefix + ".tokens.npy", self.tokens)
+        np.save(prefix + ".offsets.npy", self.offsets)
+
+    @classmethod
+    def load(cls, prefix):
+        """
+        Memory-map the arrays saved by save.
+        """
+        return cls(
+            np.load(prefix + ".tokens.npy", mmap_mode="r"),
+            np.load(prefix + ".offsets.npy", mmap_mode="r"))
+
+
+class TokenStoreBuilder(object):
+    def __init__(self):
+        self._tokens = array.array("i")
+        self._offsets = array.array("l" if array.array("l").itemsize == 8
+                                    else "q", [0])
+
+    def append(self, ids):
+        self._tokens.extend(ids)
+        self._offsets.append(len(self._tokens))
+
+    def build(self):
+        return TokenStore(
+            np.frombuffer(self._tokens, dtype="int32"),
+            np.frombuffer(self._offsets, dtype="int64"))
+
+
+def sort_by_length(order, lens, sort_type, pool_size):
+    """
+    Sort the samples in order by their lengths, globally or in every pool
+    of pool_size samples with the direction alternating between the pools
+    to avoid placing short next to long sentences. Samples with the same
+    length keep their relative order, same as sorted().
+    """
+    if sort_type == SortType.GLOBAL:
+        return order[np.argsort(lens[order], kind="mergesort")]
+    if sort_type == SortType.POOL:
+        pool_ids = np.arange(len(order)) // pool_size
+        # ascending in the even pools and descending in the odd ones
+        signs = np.where(pool_ids % 2 == 0, 1, -1)
+        return order[np.lexsort((signs * lens[order], pool_ids))]
+    return order
+
+
+def pack_batches(lens, batch_size, use_token_batch, clip_last_batch):
+    """
+    Split samples of the given lengths into consecutive batches, by the
+    number of samples or greedily by the number of tokens including paddings
+    as TokenBatchCreator does.
+    Returns:
+        The end positions of the batches.
+    """
+    num = len(lens)
+    if not use_token_batch:
+        ends = list(range(batch_size, num + 1, batch_size))
+        if not clip_last_batch and num % batch_size != 0:
+            ends.append(num)
+        return ends
+    ends = []
+    begin = 0
+    counts = np.arange(1, num + 1)
+    # the batch sizes change slowly on sorted data, so only a window a bit
+    # larger than the last batch is scanned and it is doubled when too small
+    window = 16
+    while begin < num:
+        while True:
+            max_lens = np.maximum.accumulate(lens[begin:begin + window])
+            fit = max_lens * counts[:len(max_lens)] <= batch_size
+            if not fit.all() or begin + window >= num:
+                break
+            window *= 2
+        size = len(fit) if fit.all() else int(np.argmin(fit))
+        # a sample longer than batch_size makes a batch of its own
+        size = max(size, 1)
+        begin += size
+        ends.append(begin)
+        window = 2 * size + 1
+    if clip_last_batch and ends:
+        ends.pop()
+    return ends
+
+
+def plan_batches(order, max_lens, min_lens, batch_size, pool_size,
+                 sort_type=SortType.GLOBAL, min_length=0, max_length=100,
+                 use_token_batch=False, clip_last_batch=True):
+    """
+    Plan the batches of a pass with array operations on the lengths alone.
+
+    :param order: The sample indices after shuffling.
+    :param max_lens: The max length of the source and target of every sample.
+    :param min_lens: The min length of the source and target of every sample.
+    :return: The sorted order and the list of sample index arrays of the
+        batches.
+    """
+    order = sort_by_length(order, max_lens, sort_type, pool_size)
+    kept = order[(max_lens[order] <= max_length) &
+                 (min_lens[order] >= min_length)]
+    ends = pack_batches(max_lens[kept], batch_size, use_token_batch,
+                        clip_last_batch)
+    return order, np.split(kept, ends)[:len(ends)]
+
+
 class DataReader(object):
     """
     The data reader loads all data from files and produces batches of data
@@ -181,8 +312,17 @@ class DataReader(object):
     :type end_mark: basestring
     :param unk_mark: The token representing for unknown word in dictionary.
     :type unk_mark: basestring
-    :param seed: The seed for random.
+    :param seed: The seed for random, pass epoch is shuffled with
+        seed + epoch.
     :type seed: int
+    :param token_cache_dir: The directory of the binary token stores. The
+        token ids are built into a subdirectory of it once and memory-mapped
+        by later runs with the same data files, vocabularies and marks.
+    :type token_cache_dir: basestring
+    :param with_sample_ids: Whether to append the index of the sample in the
+        data files to every instance, to restore the input order of batches
+        sorted by length.
+    :type with_sample_ids: bool
     """
 
     def __init__(self,
@@ -204,7 +344,9 @@ class DataReader(object):
                  start_mark="<s>",
                  end_mark="<e>",
                  unk_mark="<unk>",
-                 seed=0):
+                 seed=0,
+                 token_cache_dir=None,
+                 with_sample_ids=False):
         self._src_vocab = self.load_dict(src_vocab_fpath)
         self._only_src = True
         if trg_vocab_fpath is not None:
@@ -221,10 +363,20 @@ class DataReader(object):
         self._max_length = max_length
         self._field_delimiter = field_delimiter
         self._token_delimiter = token_delimiter
-        self.load_src_trg_ids(end_mark, fpattern, start_mark, tar_fname,
-                              unk_mark)
-        self._random = np.random
-        self._random.seed(seed)
+        self._token_cache_dir = token_cache_dir
+        self._with_sample_ids = with_sample_ids
+        self._cache_key = self._get_cache_key(
+            [src_vocab_fpath, trg_vocab_fpath], fpattern, tar_fname,
+            [start_mark, end_mark, unk_mark])
+        if not self.load_token_cache():
+            self.load_src_trg_ids(end_mark, fpattern, start_mark, tar_fname,
+                                  unk_mark)
+            self.save_token_cache()
+        self._init_lengths()
+        self._seed = seed
+        self._epoch = 0
+        # the plans of the last passes, by the seed they were shuffled with
+        self._plan_cache = collections.OrderedDict()
 
     def load_src_trg_ids(self, end_mark, fpattern, start_mark, tar_fname,
                          unk_mark):
@@ -249,18 +401,88 @@ class DataReader(object):
 
         converters = ComposedConverter(converters)
 
-        self._src_seq_ids = []
-        self._trg_seq_ids = None if self._only_src else []
-        self._sample_infos = []
+        src_builder = TokenStoreBuilder()
+        trg_builder = None if self._only_src else TokenStoreBuilder()
 
-        for i, line in enumerate(self._load_lines(fpattern, tar_fname)):
+        for line in self._load_lines(fpattern, tar_fname):
             src_trg_ids = converters(line)
-            self._src_seq_ids.append(src_trg_ids[0])
-            lens = [len(src_trg_ids[0])]
+            src_builder.append(src_trg_ids[0])
             if not self._only_src:
-                self._trg_seq_ids.append(src_trg_ids[1])
-                lens.append(len(src_trg_ids[1]))
-            self._sample_infos.append(SampleInfo(i, max(lens), min(lens)))
+                trg_builder.append(src_trg_ids[1])
+
+        self._src_seq_ids = src_builder.build()
+        self._trg_seq_ids = None if self._only_src else trg_builder.build()
+
+    def _init_lengths(self):
+        lens = [self._src_seq_ids.lengths]
+        if not self._only_src:
+            lens.append(self._trg_seq_ids.lengths)
+        self._max_lens = np.max(lens, axis=0)
+        self._min_lens = np.min(lens, axis=0)
+
+    def _get_cache_key(self, vocab_fpaths, fpattern, tar_fname, marks):
+        files = []
+        for fpath in sorted(glob.glob(fpattern)) + [
+                fpath for fpath in vocab_fpaths if fpath is not None
+        ]:
+            stat = os.stat(fpath)
+            files.append([os.path.abspath(fpath), stat.st_size, stat.st_mtime])
+        return {
+            "files": files,
+            "tar_fname": tar_fname,
+            "marks": marks,
+            "only_src": self._only_src,
+            "field_delimiter": self._field_delimiter,
+            "token_delimiter": self._token_delimiter
+        }
+
+    def _token_cache_path(self):
+        # one store per cache key, so different data never share the files
+        key = json.dumps(self._cache_key, sort_keys=True).encode("utf8")
+        return os.path.join(self._token_cache_dir,
+                            hashlib.sha1(key).hexdigest())
+
+    def load_token_cache(self):
+        """
+        Memory-map the token store of token_cache_dir if it was built from
+        the same data, returns whether the cache is used.
+        """
+        if self._token_cache_dir is None:
+            return False
+        path = self._token_cache_path()
+        meta_fpath = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_fpath):
+            return False
+        with open(meta_fpath, "r") as f:
+            if json.load(f) != json.loads(json.dumps(self._cache_key)):
+                return False
+        self._src_seq_ids = TokenStore.load(os.path.join(path, "src"))
+        self._trg_seq_ids = None if self._only_src else TokenStore.load(
+            os.path.join(path, "trg"))
+        return True
+
+    def save_token_cache(self):
+        """
+        Save the token store into a directory of this process and rename it
+        into place, so the trainers sharing token_cache_dir never see the
+        files of another one half written.
+        """
+        if self._token_cache_dir is None:
+            return
+        path = self._token_cache_path()
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        os.makedirs(tmp)
+        self._src_seq_ids.save(os.path.join(tmp, "src"))
+        if not self._only_src:
+            self._trg_seq_ids.save(os.path.join(tmp, "trg"))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(self._cache_key, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # saved by another trainer meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.load_token_cache()
 
     def _load_lines(self, fpattern, tar_fname):
         fpaths = glob.glob(fpattern)
@@ -302,51 +524,57 @@ class DataReader(object):
                     word_dict[line.strip("\n")] = idx
         return word_dict
 
-    def batch_generator(self):
-        # global sort or global shuffle
-        if self._sort_type == SortType.GLOBAL:
-            infos = sorted(self._sample_infos, key=lambda x: x.max_len)
+    def set_epoch(self, epoch):
+        """
+        Set the pass batch_generator plans when it is not given the epoch.
+        """
+        self._epoch = epoch
+
+    def get_batch_plan(self, epoch=0):
+        """
+        Plan the batches of pass epoch. The samples are shuffled from their
+        original order with seed + epoch, so the plan of a pass does not
+        depend on the previous passes and is computed once for its seed.
+        """
+        if (self._shuffle and self._sort_type != SortType.GLOBAL) or \
+                self._shuffle_batch:
+            key = self._seed + epoch
         else:
-            if self._shuffle:
-                infos = self._sample_infos
-                self._random.shuffle(infos)
-            else:
-                infos = self._sample_infos
-
-            if self._sort_type == SortType.POOL:
-                reverse = True
-                for i in range(0, len(infos), self._pool_size):
-                    # to avoid placing short next to long sentences
-                    reverse = not reverse
-                    infos[i:i + self._pool_size] = sorted(
-                        infos[i:i + self._pool_size],
-                        key=lambda x: x.max_len,
-                        reverse=reverse)
-
-        # concat batch
-        batches = []
-        batch_creator = TokenBatchCreator(
-            self._batch_size
-        ) if self._use_token_batch else SentenceBatchCreator(self._batch_size)
-        batch_creator = MinMaxFilter(self._max_length, self._min_length,
-                                     batch_creator)
-
-        for info in infos:
-            batch = batch_creator.append(info)
-            if batch is not None:
-                batches.append(batch)
-
-        if not self._clip_last_batch and len(batch_creator.batch) != 0:
-            batches.append(batch_creator.batch)
-
+            # the same plan for every pass
+            key = None
+        if key not in self._plan_cache:
+            if len(self._plan_cache) >= PLAN_CACHE_SIZE:
+                self._plan_cache.popitem(last=False)
+            random = np.random.RandomState(self._seed if key is None else key)
+            self._plan_cache[key] = self._plan(
+                np.arange(len(self._max_lens)), random)
+        return self._plan_cache[key]
+
+    def _plan(self, order, random):
+        if self._sort_type != SortType.GLOBAL and self._shuffle:
+            random.shuffle(order)
+        _, batches = plan_batches(
+            order, self._max_lens, self._min_lens, self._batch_size,
+            self._pool_size, self._sort_type, self._min_length,
+            self._max_length, self._use_token_batch, self._clip_last_batch)
         if self._shuffle_batch:
-            self._random.shuffle(batches)
-
-        for batch in batches:
-            batch_ids = [info.i for info in batch]
-
-            if self._only_src:
-                yield [[self._src_seq_ids[idx]] for idx in batch_ids]
-            else:
-                yield [(self._src_seq_ids[idx], self._trg_seq_ids[idx][:-1],
-                        self._trg_seq_ids[idx][1:]) for idx in batch_ids]
+            random.shuffle(batches)
+        return batches
+
+    def batch_generator(self, epoch=None):
+        batches = self.get_batch_plan(self._epoch if epoch is None else epoch)
+        for batch_ids in batches:
+            batch_ids = batch_ids.tolist()
+
+            # token ids are only materialized for the emitted batch
+            batch = []
+            for idx in batch_ids:
+                if self._only_src:
+                    inst = [self._src_seq_ids[idx]]
+                else:
+                    trg_ids = self._trg_seq_ids[idx]
+                    inst = [self._src_seq_ids[idx], trg_ids[:-1], trg_ids[1:]]
+                if self._with_sample_ids:
+                    inst.append(idx)
+                batch.append(inst if self._only_src else tuple(inst))
+            yield batch
@@ -0,0 +1,150 @@
+#copyright (c) 2019 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+"""
+Decode the beam search results of a whole batch at once.
+
+The ids and the two level lod of a batch are converted to numpy once, the
+hypotheses are selected, truncated at the first <eos> and stripped of the
+<bos>/<eos> tokens with offset arithmetic on the flat id array, and the ids
+are mapped to words by indexing an array of the vocabulary. The lines are
+written by a background thread so that the next batch can run meanwhile,
+or collected and written in the input order if the batches are sorted.
+"""
+
+import sys
+import threading
+
+import numpy as np
+
+from six.moves import queue
+
+
+def vocab_array(idx2word):
+    """
+    The array of the words of a {id: word} dict, indexed by the ids.
+    """
+    words = np.empty(len(idx2word), dtype=object)
+    for idx, word in idx2word.items():
+        words[idx] = word
+    return words
+
+
+def decode_batch(ids, lod, scores, vocab, n_best, bos_idx, eos_idx,
+                 output_bos=False, output_eos=False):
+    """
+    Decode the n-best hypotheses of every source sentence of a batch.
+
+    :param ids: The flat int array of the ids of all hypotheses.
+    :param lod: The lod of the ids, lod[0] splits the hypotheses by source
+        sentence and lod[1] splits the ids by hypothesis.
+    :param scores: The flat float array of scores with the same lod.
+    :param vocab: The array of words indexed by id.
+    Returns:
+        The lists of the sentence index, the words and the score of the
+        selected hypotheses, in the order of the sentences.
+    """
+    ids = np.asarray(ids).reshape(-1)
+    scores = np.asarray(scores).reshape(-1)
+    sent_offsets = np.asarray(lod[0], dtype="int64")
+    hyp_offsets = np.asarray(lod[1], dtype="int64")
+    num_hyps = len(hyp_offsets) - 1
+
+    # the first n_best hypotheses of every sentence
+    hyp_sent = np.repeat(
+        np.arange(len(sent_offsets) - 1), np.diff(sent_offsets))
+    hyp_rank = np.arange(num_hyps) - sent_offsets[hyp_sent]
+    hyps = np.nonzero(hyp_rank < n_best)[0]
+
+    # truncate every hypothesis from its first <eos>
+    hyp_lens = np.diff(hyp_offsets)
+    token_hyp = np.repeat(np.arange(num_hyps), hyp_lens)
+    hyp_ends = hyp_offsets[1:] - 1
+    eos_pos = np.nonzero(ids == eos_idx)[0]
+    if len(eos_pos):
+        eos_hyps, first = np.unique(token_hyp[eos_pos], return_index=True)
+        hyp_ends[eos_hyps] = eos_pos[first]
+    keep = np.arange(len(ids)) <= hyp_ends[token_hyp]
+    if not output_bos:
+        keep &= ids != bos_idx
+    if not output_eos:
+        keep &= ids != eos_idx
+
+    words = vocab[ids[keep]].tolist()
+    counts = np.bincount(token_hyp[keep], minlength=num_hyps)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    lines = [" ".join(words[starts[h]:ends[h]]) for h in hyps]
+    # the score of a hypothesis is the one of its last step
+    hyp_scores = scores[hyp_offsets[hyps + 1] - 1]
+    return hyp_sent[hyps].tolist(), lines, hyp_scores.tolist()
+
+
+class AsyncWriter(object):
+    """
+    Write the lines handed to write() from a background thread. At most
+    max_pending batches wait in the queue.
+    """
+
+    def __init__(self, out=None, max_pending=16):
+        self._out = out if out is not None else sys.stdout
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            lines = self._queue.get()
+            if lines is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self._out.write("".join(line + "\n" for line in lines))
+            except Exception as e:
+                self._error = e
+
+    def write(self, lines):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(lines)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._out.flush()
+        if self._error is not None:
+            raise self._error
+
+
+class OrderedWriter(object):
+    """
+    Collect the lines of the batches by the sample ids of their sentences
+    and hand them to writer in the order of the ids on close. The n-best
+    lines of a sentence keep their order.
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._lines = {}
+
+    def write(self, lines, ids):
+        for idx, line in zip(ids, lines):
+            self._lines.setdefault(idx, []).append(line)
+
+    def close(self):
+        self._writer.write(
+            [line for idx in sorted(self._lines) for line in self._lines[idx]])
+        self._writer.close()
@@ -25,6 +25,7 @@ import six
 import sys
 import time
 import json
+from functools import partial
 
 os.environ['FLAGS_sync_nccl_allreduce'] = "1"
 
@@ -32,6 +33,8 @@ import numpy as np
 import paddle.fluid as fluid
 
 import reader
+import batch_assembly
+import prefetch
 from config import *
 from desc import *
 from model import transformer, position_encoding_init
@@ -96,6 +99,12 @@ def parse_args():
         type=ast.literal_eval,
         default=True,
         help="The flag indicating whether to shuffle the data batches.")
+    parser.add_argument(
+        "--token_cache_dir",
+        type=str,
+        default=None,
+        help="The directory of the binary token store. The data is converted "
+        "into it once and memory-mapped by the later runs.")
     parser.add_argument(
         "--special_token",
         type=str,
@@ -120,6 +129,23 @@ def parse_args():
         type=ast.literal_eval,
         default=True,
         help="The flag indicating whether to use py_reader.")
+    parser.add_argument(
+        "--prefetch_workers",
+        type=int,
+        default=0,
+        help="The number of processes preparing the py_reader batches, 0 "
+        "prepares them in the feeding thread.")
+    parser.add_argument(
+        "--prefetch_queue_depth",
+        type=int,
+        default=8,
+        help="The number of batches prepared ahead by the prefetch workers.")
+    parser.add_argument(
+        "--prefetch_slot_mb",
+        type=int,
+        default=128,
+        help="The size in MB of the shared memory slot of a prepared batch, "
+        "larger batches are pickled.")
     parser.add_argument(
         "--use_fp16",
         type=ast.literal_eval,
@@ -161,110 +187,23 @@ def parse_args():
     return args
 
 
-def pad_batch_data(insts,
-                   pad_idx,
-                   n_head,
-                   is_target=False,
-                   is_label=False,
-                   return_attn_bias=True,
-                   return_max_len=True,
-                   return_num_token=False):
-    """
-    Pad the instances to the max sequence length in batch, and generate the
-    corresponding position data and attention bias.
-    """
-    return_list = []
-    max_len = max(len(inst) for inst in insts)
-    # Any token included in dict can be used to pad, since the paddings' loss
-    # will be masked out by weights and make no effect on parameter gradients.
-    inst_data = np.array(
-        [inst + [pad_idx] * (max_len - len(inst)) for inst in insts])
-    return_list += [inst_data.astype("int64").reshape([-1, 1])]
-    if is_label:  # label weight
-        inst_weight = np.array(
-            [[1.] * len(inst) + [0.] * (max_len - len(inst)) for inst in insts])
-        return_list += [inst_weight.astype("float32").reshape([-1, 1])]
-    else:  # position data
-        inst_pos = np.array([
-            list(range(0, len(inst))) + [0] * (max_len - len(inst))
-            for inst in insts
-        ])
-        return_list += [inst_pos.astype("int64").reshape([-1, 1])]
-    if return_attn_bias:
-        if is_target:
-            # This is used to avoid attention on paddings and subsequent
-            # words.
-            slf_attn_bias_data = np.ones((inst_data.shape[0], max_len, max_len))
-            slf_attn_bias_data = np.triu(slf_attn_bias_data,
-                                         1).reshape([-1, 1, max_len, max_len])
-            slf_attn_bias_data = np.tile(slf_attn_bias_data,
-                                         [1, n_head, 1, 1]) * [-1e9]
-        else:
-            # This is used to avoid attention on paddings.
-            slf_attn_bias_data = np.array([[0] * len(inst) + [-1e9] *
-                                           (max_len - len(inst))
-                                           for inst in insts])
-            slf_attn_bias_data = np.tile(
-                slf_attn_bias_data.reshape([-1, 1, 1, max_len]),
-                [1, n_head, max_len, 1])
-        return_list += [slf_attn_bias_data.astype("float32")]
-    if return_max_len:
-        return_list += [max_len]
-    if return_num_token:
-        num_token = 0
-        for inst in insts:
-            num_token += len(inst)
-        return_list += [num_token]
-    return return_list if len(return_list) > 1 else return_list[0]
-
-
 def prepare_batch_input(insts, data_input_names, src_pad_idx, trg_pad_idx,
-                        n_head, d_model):
+                        n_head, d_model, buffers=None):
     """
     Put all padded data needed by training into a dict.
     """
-    src_word, src_pos, src_slf_attn_bias, src_max_len = pad_batch_data(
-        [inst[0] for inst in insts], src_pad_idx, n_head, is_target=False)
-    src_word = src_word.reshape(-1, src_max_len, 1)
-    src_pos = src_pos.reshape(-1, src_max_len, 1)
-    trg_word, trg_pos, trg_slf_attn_bias, trg_max_len = pad_batch_data(
-        [inst[1] for inst in insts], trg_pad_idx, n_head, is_target=True)
-    trg_word = trg_word.reshape(-1, trg_max_len, 1)
-    trg_pos = trg_pos.reshape(-1, trg_max_len, 1)
-
-    trg_src_attn_bias = np.tile(src_slf_attn_bias[:, :, ::src_max_len, :],
-                                [1, 1, trg_max_len, 1]).astype("float32")
-
-    lbl_word, lbl_weight, num_token = pad_batch_data(
-        [inst[2] for inst in insts],
-        trg_pad_idx,
-        n_head,
-        is_target=False,
-        is_label=True,
-        return_attn_bias=False,
-        return_max_len=False,
-        return_num_token=True)
-
-    data_input_dict = dict(
-        zip(data_input_names, [
-            src_word, src_pos, src_slf_attn_bias, trg_word, trg_pos,
-            trg_slf_attn_bias, trg_src_attn_bias, lbl_word, lbl_weight
-        ]))
+    data_inputs, num_token, _, _ = batch_assembly.prepare_train_input(
+        insts, src_pad_idx, trg_pad_idx, n_head, buffers=buffers)
+    data_input_dict = dict(zip(data_input_names, data_inputs))
 
     return data_input_dict, np.asarray([num_token], dtype="float32")
 
 
-def prepare_data_generator(args,
-                           is_test,
-                           count,
-                           pyreader,
-                           py_reader_provider_wrapper,
-                           place=None):
+def create_data_reader(args, is_test, count, with_sample_ids=False):
     """
-    Data generator wrapper for DataReader. If use py_reader, set the data
-    provider for py_reader
+    The DataReader of the validation or the training data.
     """
-    data_reader = reader.DataReader(
+    return reader.DataReader(
         fpattern=args.val_file_pattern if is_test else args.train_file_pattern,
         src_vocab_fpath=args.src_vocab_fpath,
         trg_vocab_fpath=args.trg_vocab_fpath,
@@ -280,7 +219,28 @@ def prepare_data_generator(args,
         unk_mark=args.special_token[2],
         # count start and end tokens out
         max_length=ModelHyperParams.max_length - 2,
-        clip_last_batch=False).batch_generator
+        clip_last_batch=False,
+        token_cache_dir=None if args.token_cache_dir is None else os.path.join(
+            args.token_cache_dir, "val" if is_test else "train"),
+        with_sample_ids=with_sample_ids)
+
+
+def prepare_data_generator(args,
+                           is_test,
+                           count,
+                           pyreader,
+                           py_reader_provider_wrapper,
+                           place=None,
+                           with_sample_ids=False,
+                           data_reader=None):
+    """
+    Data generator wrapper for DataReader. If use py_reader, set the data
+    provider for py_reader. data_reader is created if it is not given.
+    """
+    if data_reader is None:
+        data_reader = create_data_reader(args, is_test, count,
+                                         with_sample_ids)
+    data_reader = data_reader.batch_generator
 
     def stack(data_reader, count, clip_last=True):
         def __impl__():
@@ -360,21 +320,35 @@ def prepare_feed_dict_list(data_generator, init_flag, count):
     return feed_dict_list if len(feed_dict_list) == count else None
 
 
-def py_reader_provider_wrapper(data_reader, place):
+def py_reader_provider_wrapper(data_reader, place, args=None):
     """
-    Data provider needed by fluid.layers.py_reader.
+    Data provider needed by fluid.layers.py_reader. The batches are prepared
+    in args.prefetch_workers processes if it is set.
     """
+    data_input_names = encoder_data_input_fields + \
+                decoder_data_input_fields[:-1] + label_data_input_fields
+    # py_reader copies the arrays into tensors before the next batch, so
+    # the buffers are reused by all batches
+    buffers = batch_assembly.BatchBuffers()
+
+    def prepare_arrays(data):
+        data_input_dict, num_token = prepare_batch_input(
+            data, data_input_names, ModelHyperParams.eos_idx,
+            ModelHyperParams.eos_idx, ModelHyperParams.n_head,
+            ModelHyperParams.d_model, buffers)
+        return [data_input_dict[item] for item in data_input_names]
+
+    if args is not None and args.prefetch_workers > 0:
+        return prefetch.MultiprocessPrefetcher(
+            data_reader,
+            prepare_arrays,
+            num_workers=args.prefetch_workers,
+            queue_depth=args.prefetch_queue_depth,
+            slot_size=args.prefetch_slot_mb << 20)
 
     def py_reader_provider():
-        data_input_names = encoder_data_input_fields + \
-                    decoder_data_input_fields[:-1] + label_data_input_fields
         for batch_id, data in enumerate(data_reader()):
-            data_input_dict, num_token = prepare_batch_input(
-                data, data_input_names, ModelHyperParams.eos_idx,
-                ModelHyperParams.eos_idx, ModelHyperParams.n_head,
-                ModelHyperParams.d_model)
-            total_dict = dict(data_input_dict.items())
-            yield [total_dict[item] for item in data_input_names]
+            yield prepare_arrays(data)
 
     return py_reader_provider
 
@@ -411,7 +385,8 @@ def test_context(exe, dev_count):
         is_test=True,
         count=dev_count,
         pyreader=pyreader,
-        py_reader_provider_wrapper=py_reader_provider_wrapper)
+        py_reader_provider_wrapper=partial(
+            py_reader_provider_wrapper, args=args))
 
     exe.run(startup_prog)  # to init pyreader for testing
     if TrainTaskConfig.ckpt_path:
@@ -472,12 +447,15 @@ def train_loop(args,
         exe.run(startup_program)
 
     logging.info("begin reader")
+    train_reader = create_data_reader(args, is_test=False, count=dev_count)
     train_data = prepare_data_generator(
         args,
         is_test=False,
         count=dev_count,
         pyreader=pyreader,
-        py_reader_provider_wrapper=py_reader_provider_wrapper)
+        py_reader_provider_wrapper=partial(
+            py_reader_provider_wrapper, args=args),
+        data_reader=train_reader)
 
     sum_cost.persistable = True
     token_num.persistable = True
@@ -500,6 +478,8 @@ def train_loop(args,
     result_ppl = []
     for pass_id in six.moves.xrange(args.num_epochs):
         pass_start_time = time.time()
+        # every pass is shuffled with its own seed, see DataReader.get_batch_plan
+        train_reader.set_epoch(pass_id)
 
         if args.use_py_reader:
             pyreader.start()
@@ -0,0 +1,222 @@
+# Copyright (c) 2019 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+feature_hash.py: deterministic hashing of sparse feature keys
+
+The builtin hash of python3 is salted per process, so trainers, pservers and
+the infer program could map the same feature to different ids. The hashers
+here only depend on the bytes of the key and hash a whole array of keys with
+a few numpy operations. The line hashers give the same ids key by key in
+pure python for the readers parsing one line at a time.
+"""
+import struct
+
+import numpy as np
+
+_C1 = np.uint64(0x87c37b91114253d5)
+_C2 = np.uint64(0x4cf5ad432745937f)
+_F1 = np.uint64(0xff51afd7ed558ccd)
+_F2 = np.uint64(0xc4ceb9fe1a85ec53)
+_N1 = np.uint64(0x52dce729)
+_FIVE = np.uint64(5)
+
+
+def _rotl(x, r):
+    return (x << np.uint64(r)) | (x >> np.uint64(64 - r))
+
+
+def _fmix(h):
+    h = h ^ (h >> np.uint64(33))
+    h = h * _F1
+    h = h ^ (h >> np.uint64(33))
+    h = h * _F2
+    return h ^ (h >> np.uint64(33))
+
+
+def _to_byte_matrix(keys):
+    """
+    Convert a flat array of keys to a zero padded uint8 matrix of their
+    utf-8 bytes, text keys in ascii skip the slow np.char.encode
+    Returns:
+        bytes: uint8 array of shape [N, width]
+        lengths: uint64 array of shape [N]
+    """
+    if keys.dtype.kind == 'U':
+        lengths = np.char.str_len(keys).astype('uint64')
+        codes = keys.view('uint32').reshape(len(keys), -1)
+        if codes.size == 0 or codes.max() < 128:
+            return codes.astype('uint8'), lengths
+        keys = np.char.encode(keys, 'utf-8')
+    elif keys.dtype.kind != 'S':
+        keys = np.array([key if isinstance(key, bytes) else key.encode('utf-8')
+                         for key in keys.tolist()], dtype='S')
+    lengths = np.char.str_len(keys).astype('uint64')
+    return keys.view('uint8').reshape(len(keys), -1), lengths
+
+
+def murmur_hash(keys, seed=0):
+    """
+    64 bit murmur style hash of every key
+    Args:
+        keys: str/bytes array-like of any shape
+        seed: the seed of the hash
+    Returns:
+        uint64 array with the same shape as keys
+    """
+    keys = np.asarray(keys)
+    shape = keys.shape
+    keys = np.ascontiguousarray(keys.ravel())
+    if keys.size == 0:
+        return np.zeros(shape, dtype='uint64')
+    key_bytes, lengths = _to_byte_matrix(keys)
+    num_words = (key_bytes.shape[1] + 7) // 8
+
+    # zero padded [N, num_words] little endian words of every key
+    buf = np.zeros((len(keys), num_words * 8), dtype='uint8')
+    buf[:, :key_bytes.shape[1]] = key_bytes
+    words = buf.view('<u8')
+    key_words = (lengths + np.uint64(7)) // np.uint64(8)
+
+    h = np.full(len(keys), seed, dtype='uint64')
+    for i in range(num_words):
+        k = words[:, i] * _C1
+        k = _rotl(k, 31) * _C2
+        mixed = _rotl(h ^ k, 27) * _FIVE + _N1
+        # only the words of the key itself take part in the hash, so the
+        # result does not depend on the longest key of the array
+        h = np.where(key_words > i, mixed, h)
+    h = _fmix(h ^ lengths)
+    return h.reshape(shape)
+
+
+def murmur_hash_ids(keys, hash_dim):
+    """
+    Map keys to ids in [0, hash_dim) with murmur_hash
+    """
+    return (murmur_hash(keys) % np.uint64(hash_dim)).astype('int64')
+
+
+def builtin_hash_ids(keys, hash_dim):
+    """
+    Map keys to ids in [0, hash_dim) with the builtin hash, only stable when
+    PYTHONHASHSEED is fixed, kept to reuse models trained with python2
+    """
+    keys = np.asarray(keys)
+    ids = np.fromiter(map(hash, keys.ravel().tolist()),
+                      dtype='int64', count=keys.size)
+    return (ids % hash_dim).reshape(keys.shape)
+
+
+_MASK = (1 << 64) - 1
+_INT_C1 = int(_C1)
+_INT_C2 = int(_C2)
+_INT_F1 = int(_F1)
+_INT_F2 = int(_F2)
+_INT_N1 = int(_N1)
+
+
+# the unpackers of the little endian words of the short keys
+_UNPACK_WORDS = [struct.Struct('<%dQ' % n).unpack for n in range(9)]
+
+
+def murmur_hash_key(key, seed=0):
+    """
+    murmur_hash of a single str/bytes key with python ints
+    """
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    length = len(key)
+    num_words = (length + 7) // 8
+    if num_words < len(_UNPACK_WORDS):
+        unpack = _UNPACK_WORDS[num_words]
+    else:
+        unpack = struct.Struct('<%dQ' % num_words).unpack
+    h = seed
+    for k in unpack(key.ljust(num_words * 8, b'\0')):
+        k = k * _INT_C1 & _MASK
+        h ^= (k << 31 & _MASK | k >> 33) * _INT_C2 & _MASK
+        h = ((h << 27 & _MASK | h >> 37) * 5 + _INT_N1) & _MASK
+    h ^= length
+    h = (h ^ h >> 33) * _INT_F1 & _MASK
+    h = (h ^ h >> 33) * _INT_F2 & _MASK
+    return h ^ h >> 33
+
+
+# murmur_hash_key of the keys seen first, which are mostly the frequent
+# ones, the cache stops growing when it is full
+_key_cache = {}
+_KEY_CACHE_SIZE = 1 << 19
+
+
+def murmur_line_ids(keys, hash_dim):
+    """
+    Map the keys of a line to a list of ids, the same as murmur_hash_ids
+    """
+    ids = []
+    for key in keys:
+        h = _key_cache.get(key)
+        if h is None:
+            h = murmur_hash_key(key)
+            if len(_key_cache) < _KEY_CACHE_SIZE:
+                _key_cache[key] = h
+        ids.append(h % hash_dim)
+    return ids
+
+
+def builtin_line_ids(keys, hash_dim):
+    """
+    Map the keys of a line to a list of ids, the same as builtin_hash_ids
+    """
+    return [hash(key) % hash_dim for key in keys]
+
+
+HASHERS = {
+    'murmur': murmur_hash_ids,
+    'builtin': builtin_hash_ids,
+}
+
+
+def get_hasher(name='murmur'):
+    """
+    Get the function mapping an array of keys to ids
+    Args:
+        name: murmur or builtin
+    Returns:
+        function(keys, hash_dim) -> int64 array of ids
+    """
+    if name not in HASHERS:
+        raise ValueError("Unknown hash type: {}, choose one of {}".format(
+            name, sorted(HASHERS.keys())))
+    return HASHERS[name]
+
+
+LINE_HASHERS = {
+    'murmur': murmur_line_ids,
+    'builtin': builtin_line_ids,
+}
+
+
+def get_line_hasher(name='murmur'):
+    """
+    Get the function mapping a list of keys to a list of ids, faster than
+    get_hasher for the few keys of a single line
+    Args:
+        name: murmur or builtin
+    Returns:
+        function(keys, hash_dim) -> list of ids
+    """
+    if name not in LINE_HASHERS:
+        raise ValueError("Unknown hash type: {}, choose one of {}".format(
+            name, sorted(LINE_HASHERS.keys())))
+    return LINE_HASHERS[name]
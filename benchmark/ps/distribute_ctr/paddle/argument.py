@@ -49,6 +49,10 @@ def params_args(args=None):
     params.add_argument('--sparse_feature_dim', type=int, default=1000001,
                         help='sparse feature hashing space for index processing')
     params.add_argument('--dense_feature_dim', type=int, default=13)
+    params.add_argument('--reader_block_size', type=int, default=0,
+                        help='lines parsed at once by the block reader, 0 means line by line (default: 0)')
+    params.add_argument('--shard_path', type=str, default="",
+                        help='dir of the binary shards converted by ctr_shard.py, used by py_reader train if set')
 
     # parameters of train method
     params.add_argument("--is_pyreader_train", type=bool, default=False)
@@ -81,6 +85,8 @@ def params_args(args=None):
     params.add_argument("--use_cuda", type=bool, default=False)
 
     params.add_argument("--test_model_dir", type=str, default="")
+    params.add_argument("--test_shard_path", type=str, default="",
+                        help='dir of the parsed test shards, default: <test_files_path>_shard')
     params.add_argument("--ready_path", type=str, default="")
     params.add_argument("--barrier_level", type=int, default=1)
     params = params.parse_args()
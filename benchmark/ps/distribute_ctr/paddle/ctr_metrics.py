@@ -0,0 +1,54 @@
+# Copyright (c) 2019 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+ctr_metrics.py: histogram based auc computed with numpy
+
+The predicts are counted into num_thresholds + 1 buckets in the same way as
+fluid.layers.auc, so the histograms of several batches or processes can be
+summed and the auc is computed once at the end.
+"""
+import numpy as np
+
+
+def auc_histogram(label, predict, num_thresholds=2 ** 12):
+    """
+    Count the positive and negative samples of every bucket of the predicts
+    Args:
+        label: int array of shape [N] or [N, 1]
+        predict: the probability of the positive class, shape [N] or [N, 1]
+    Returns:
+        pos, neg: int64 arrays of shape [num_thresholds + 1]
+    """
+    label = np.asarray(label).ravel() > 0
+    buckets = (np.asarray(predict, dtype='float64').ravel() * num_thresholds).astype('int64')
+    np.clip(buckets, 0, num_thresholds, out=buckets)
+    pos = np.bincount(buckets[label], minlength=num_thresholds + 1)
+    neg = np.bincount(buckets[~label], minlength=num_thresholds + 1)
+    return pos.astype('int64'), neg.astype('int64')
+
+
+def histogram_auc(pos, neg):
+    """
+    The area under the roc curve of the histograms, 0.0 when there are no
+    positive or no negative samples, same as fluid.layers.auc
+    """
+    # walk the thresholds from high to low
+    tp = np.cumsum(np.asarray(pos, dtype='float64')[::-1])
+    fp = np.cumsum(np.asarray(neg, dtype='float64')[::-1])
+    if tp[-1] == 0 or fp[-1] == 0:
+        return 0.0
+    prev_tp = np.concatenate([[0.0], tp[:-1]])
+    prev_fp = np.concatenate([[0.0], fp[:-1]])
+    area = ((fp - prev_fp) * (tp + prev_tp) / 2.0).sum()
+    return float(area / tp[-1] / fp[-1])
@@ -0,0 +1,273 @@
+# Copyright (c) 2019 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+ctr_shard.py: binary pre-parsed shards of the Criteo data
+
+Every raw file is parsed once into a fixed-width binary shard:
+    header   64 bytes, see HEADER_FORMAT
+    dense    float32 [rows, dense_dim]
+    sparse   int64   [sparse_dim, rows], slot major so one slot of a batch is contiguous
+    label    int64   [rows, 1]
+index.json in the shard dir records the source file, size, mtime and rows of
+every shard. The reader memory-maps the shards and yields batch slices of
+them without copying.
+
+usage:
+    python ctr_shard.py --train_files_path=train_data --shard_path=train_shard
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import struct
+import logging
+import multiprocessing
+import numpy as np
+import py_reader_generator as py_reader
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("fluid")
+logger.setLevel(logging.INFO)
+
+MAGIC = b'CTRSHARD'
+VERSION = 1
+# magic, version, dense_dim, sparse_dim, rows, hash_dim, hash_type
+HEADER_FORMAT = '<8sIIIxxxxQQ16s'
+HEADER_SIZE = 64
+INDEX_FILE = 'index.json'
+DENSE_DIM = 13
+SPARSE_DIM = 26
+
+
+def count_lines(path, chunk_size=1 << 22):
+    """
+    Count the lines of a file by scanning newlines block by block
+    """
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(chunk_size)
+            if not buf:
+                break
+            lines += buf.count(b'\n')
+            last = buf[-1:]
+    # the last line has no newline
+    if last != b'\n':
+        lines += 1
+    return lines
+
+
+def _layout(rows, dense_dim, sparse_dim):
+    """
+    Returns the offsets of the dense, sparse and label sections and the file size
+    """
+    dense_offset = HEADER_SIZE
+    sparse_offset = dense_offset + rows * dense_dim * 4
+    # keep the int64 sections 8 bytes aligned
+    sparse_offset += -sparse_offset % 8
+    label_offset = sparse_offset + rows * sparse_dim * 8
+    file_size = label_offset + rows * 8
+    return dense_offset, sparse_offset, label_offset, file_size
+
+
+def _map_shard(path, mode, rows, dense_dim, sparse_dim):
+    dense_offset, sparse_offset, label_offset, _ = _layout(rows, dense_dim, sparse_dim)
+    if rows == 0:
+        return (np.zeros((0, dense_dim), dtype='float32'),
+                np.zeros((sparse_dim, 0), dtype='int64'),
+                np.zeros((0, 1), dtype='int64'))
+    dense = np.memmap(path, dtype='<f4', mode=mode, offset=dense_offset,
+                      shape=(rows, dense_dim))
+    sparse = np.memmap(path, dtype='<i8', mode=mode, offset=sparse_offset,
+                       shape=(sparse_dim, rows))
+    label = np.memmap(path, dtype='<i8', mode=mode, offset=label_offset,
+                      shape=(rows, 1))
+    return dense, sparse, label
+
+
+def read_header(path):
+    """
+    Returns the header of a shard as a dict
+    """
+    with open(path, 'rb') as f:
+        buf = f.read(HEADER_SIZE)
+    if len(buf) < HEADER_SIZE:
+        raise ValueError("{} is not a ctr shard".format(path))
+    magic, version, dense_dim, sparse_dim, rows, hash_dim, hash_type = \
+        struct.unpack(HEADER_FORMAT, buf[:struct.calcsize(HEADER_FORMAT)])
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} is not a ctr shard of version {}".format(path, VERSION))
+    return {'dense_dim': dense_dim, 'sparse_dim': sparse_dim, 'rows': rows,
+            'hash_dim': hash_dim, 'hash_type': hash_type.rstrip(b'\0').decode()}
+
+
+def load_shard(path):
+    """
+    Memory-map a shard
+    Returns:
+        dense: float32 [rows, 13], sparse: int64 [26, rows], label: int64 [rows, 1]
+    """
+    header = read_header(path)
+    return _map_shard(path, 'r', header['rows'], header['dense_dim'],
+                      header['sparse_dim'])
+
+
+def convert_file(source, shard, sparse_feature_dim, hash_type='murmur', block_size=100000):
+    """
+    Parse a raw Criteo file into a shard, returns the rows of the shard
+    """
+    dataset = py_reader.CriteoDataset(sparse_feature_dim, hash_type)
+    rows = count_lines(source)
+    file_size = _layout(rows, DENSE_DIM, SPARSE_DIM)[-1]
+
+    tmp = shard + '.tmp'
+    with open(tmp, 'wb') as f:
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, DENSE_DIM, SPARSE_DIM,
+                             rows, sparse_feature_dim, hash_type.encode())
+        f.write(header + b'\0' * (HEADER_SIZE - len(header)))
+        f.truncate(file_size)
+
+    dense, sparse, label = _map_shard(tmp, 'r+', rows, DENSE_DIM, SPARSE_DIM)
+    begin = 0
+    with open(source, 'r') as f:
+        for lines in py_reader.read_blocks(f, block_size):
+            end = begin + len(lines)
+            block_dense, block_sparse, block_label = dataset._process_block(lines)
+            dense[begin:end] = block_dense
+            sparse[:, begin:end] = block_sparse.T
+            label[begin:end] = block_label
+            begin = end
+    if begin != rows:
+        raise ValueError("{} has {} lines, but {} were parsed".format(source, rows, begin))
+    for column in (dense, sparse, label):
+        if isinstance(column, np.memmap):
+            column.flush()
+    del dense, sparse, label
+    os.rename(tmp, shard)
+    return rows
+
+
+def _convert_job(args):
+    source, shard, sparse_feature_dim, hash_type = args
+    rows = convert_file(source, shard, sparse_feature_dim, hash_type)
+    logger.info("convert {} to {}, rows: {}".format(source, shard, rows))
+    return rows
+
+
+def load_index(shard_path):
+    index_path = os.path.join(shard_path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+def convert(file_list, shard_path, sparse_feature_dim, hash_type='murmur', num_workers=1):
+    """
+    One-time conversion of raw Criteo files into shards under shard_path,
+    the shards whose source file is unchanged since the last conversion are kept
+    Returns:
+        the index of the shards
+    """
+    if not os.path.isdir(shard_path):
+        os.makedirs(shard_path)
+    index = load_index(shard_path)
+    if index is None or index['hash_dim'] != sparse_feature_dim or \
+            index['hash_type'] != hash_type:
+        index = {'version': VERSION, 'hash_dim': sparse_feature_dim,
+                 'hash_type': hash_type, 'shards': []}
+    done = dict((item['source'], item) for item in index['shards'])
+
+    shards = []
+    jobs = []
+    for source in sorted(file_list):
+        source = os.path.abspath(source)
+        stat = os.stat(source)
+        shard = os.path.basename(source) + '.bin'
+        item = {'shard': shard, 'source': source, 'source_size': stat.st_size,
+                'source_mtime': stat.st_mtime, 'rows': None}
+        old = done.get(source)
+        if old is not None and old['source_size'] == stat.st_size and \
+                old['source_mtime'] == stat.st_mtime and \
+                os.path.exists(os.path.join(shard_path, shard)):
+            item['rows'] = old['rows']
+        else:
+            jobs.append((len(shards), (source, os.path.join(shard_path, shard),
+                                       sparse_feature_dim, hash_type)))
+        shards.append(item)
+
+    if num_workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(num_workers)
+        rows = pool.map(_convert_job, [job for _, job in jobs])
+        pool.close()
+        pool.join()
+    else:
+        rows = [_convert_job(job) for _, job in jobs]
+    for (pos, _), shard_rows in zip(jobs, rows):
+        shards[pos]['rows'] = shard_rows
+
+    index['shards'] = shards
+    tmp = os.path.join(shard_path, INDEX_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.rename(tmp, os.path.join(shard_path, INDEX_FILE))
+    return index
+
+
+def shard_list(shard_path):
+    """
+    Returns the paths of the shards recorded in the index of shard_path
+    """
+    index = load_index(shard_path)
+    if index is None:
+        raise ValueError("{} has no {}, convert the data with ctr_shard.py first".format(
+            shard_path, INDEX_FILE))
+    return [os.path.join(shard_path, item['shard']) for item in index['shards']]
+
+
+def batch_reader(shards, batch_size, shuffle=True):
+    """
+    Memory-map the shards and yield (dense, sparse, label) slices of every batch:
+    dense float32 [B, 13], sparse int64 [26, B], label int64 [B, 1].
+    Shuffling permutes the order of shards and batches, the rows of a batch
+    stay contiguous so that no batch is copied.
+    """
+    def reader():
+        order = list(shards)
+        if shuffle:
+            np.random.shuffle(order)
+        for shard in order:
+            dense, sparse, label = load_shard(shard)
+            begins = np.arange(0, len(label), batch_size)
+            if shuffle:
+                np.random.shuffle(begins)
+            for begin in begins.tolist():
+                end = begin + batch_size
+                yield dense[begin:end], sparse[:, begin:end], label[begin:end]
+
+    return reader
+
+
+if __name__ == '__main__':
+    from argument import params_args
+    params = params_args()
+    if not params.shard_path:
+        raise ValueError("Please set --shard_path for the converted shards")
+    file_list = [os.path.join(params.train_files_path, x)
+                 for x in os.listdir(params.train_files_path)]
+    index = convert(file_list, params.shard_path, params.sparse_feature_dim,
+                    num_workers=int(params.cpu_num))
+    print("convert {} files, rows: {}".format(
+        len(index['shards']), sum(item['rows'] for item in index['shards'])))
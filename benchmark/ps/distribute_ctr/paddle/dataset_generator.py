@@ -11,14 +11,21 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import sys
+import itertools
+import numpy as np
 import paddle.fluid.incubate.data_generator as dg
+import feature_hash
 
 cont_min_ = [0, -3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
 cont_max_ = [20, 600, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
 cont_diff_ = [20, 603, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
 hash_dim_ = 1000001
+hash_ids_ = feature_hash.get_hasher('murmur')
+line_hash_ids_ = feature_hash.get_line_hasher('murmur')
 continuous_range_ = range(1, 14)
 categorical_range_ = range(14, 40)
+categorical_prefix_ = np.array([str(idx) for idx in categorical_range_])
 
 class DacDataset(dg.MultiSlotDataGenerator):
     """
@@ -42,8 +49,9 @@ class DacDataset(dg.MultiSlotDataGenerator):
                 else:
                     dense_feature.append(
                         (float(features[idx]) - cont_min_[idx - 1]) / cont_diff_[idx - 1])
-            for idx in categorical_range_:
-                sparse_feature.append([hash(str(idx) + features[idx]) % hash_dim_])
+            keys = [str(idx) + features[idx] for idx in categorical_range_]
+            for sparse_id in line_hash_ids_(keys, hash_dim_):
+                sparse_feature.append([sparse_id])
             label = [int(features[0])]
             process_line = dense_feature,sparse_feature,label
             feature_name = ["dense_input"]
@@ -54,5 +62,37 @@ class DacDataset(dg.MultiSlotDataGenerator):
             yield zip(feature_name,[dense_feature]+sparse_feature+[label])
         return reader
 
+    def run_block_from_stdin(self, block_size):
+        """
+        Parse block_size lines at once with numpy, the output is the same as run_from_stdin
+        """
+        feature_name = ["dense_input"]
+        for idx in categorical_range_:
+            feature_name.append("C" + str(idx - 13))
+        feature_name.append("label")
+        while True:
+            lines = list(itertools.islice(sys.stdin, block_size))
+            if not lines:
+                break
+            features = np.array([line.rstrip('\n').split('\t') for line in lines])
+
+            dense = features[:, list(continuous_range_)]
+            missing = dense == ''
+            dense = np.array(np.where(missing, '0', dense).tolist(), dtype='float64')
+            dense = (dense - cont_min_) / cont_diff_
+            dense[missing] = 0.0
+
+            keys = np.char.add(categorical_prefix_, features[:, list(categorical_range_)])
+            sparse = hash_ids_(keys, hash_dim_).reshape(keys.shape + (1,))
+
+            label = features[:, :1].astype('int64')
+            for dense_feature, sparse_feature, label_feature in \
+                    zip(dense.tolist(), sparse.tolist(), label.tolist()):
+                sample = [dense_feature] + sparse_feature + [label_feature]
+                sys.stdout.write(self._gen_str(zip(feature_name, sample)))
+
 d = DacDataset()
-d.run_from_stdin()
+if len(sys.argv) > 1:
+    d.run_block_from_stdin(int(sys.argv[1]))
+else:
+    d.run_from_stdin()
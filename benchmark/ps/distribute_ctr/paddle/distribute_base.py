@@ -20,6 +20,7 @@ import re
 import commands
 import logging
 import time
+import multiprocessing
 import numpy as np
 import paddle
 import paddle.fluid as fluid
@@ -27,6 +28,8 @@ import paddle.fluid.incubate.fleet.base.role_maker as role_maker
 from paddle.fluid.incubate.fleet.parameter_server.distribute_transpiler import fleet
 from paddle.fluid.transpiler.distribute_transpiler import DistributeTranspilerConfig
 import py_reader_generator as py_reader
+import ctr_shard
+import ctr_metrics
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("fluid")
@@ -259,19 +262,31 @@ class FleetDistRunnerBase(object):
         # Paddle Fluid enter data by variable name
         # When we do the definition of the reader, the program has established the workflow
         train_generator = py_reader.CriteoDataset(params.sparse_feature_dim)
-        file_list = [str(params.train_files_path) + "/%s" % x
-                     for x in os.listdir(params.train_files_path)]
+        if params.shard_path:
+            file_list = ctr_shard.shard_list(params.shard_path)
+        else:
+            file_list = [str(params.train_files_path) + "/%s" % x
+                         for x in os.listdir(params.train_files_path)]
         if params.is_local_cluster:
             file_list = fleet.split_files(file_list)
         logger.info("file list: {}".format(file_list))
         print("file list: {}".format(file_list))
 
-        train_reader = paddle.batch(
-            paddle.reader.shuffle(
-                train_generator.train(file_list, params.trainers, params.current_id),
-                buf_size=params.batch_size * 100
-            ), batch_size=params.batch_size)
-        reader.decorate_paddle_reader(train_reader)
+        if params.shard_path:
+            # the shards are parsed once by ctr_shard.py, feed the mapped batches as tensors
+            reader.decorate_tensor_provider(self.shard_tensor_provider(
+                ctr_shard.batch_reader(file_list, params.batch_size)))
+        else:
+            if params.reader_block_size > 0:
+                train_reader = train_generator.train_batch(
+                    file_list, params.batch_size, params.reader_block_size)
+            else:
+                train_reader = paddle.batch(
+                    paddle.reader.shuffle(
+                        train_generator.train(file_list, params.trainers, params.current_id),
+                        buf_size=params.batch_size * 100
+                    ), batch_size=params.batch_size)
+            reader.decorate_paddle_reader(train_reader)
 
         exec_strategy = fluid.ExecutionStrategy()
         exec_strategy.num_threads = int(params.cpu_num)
@@ -339,6 +354,26 @@ class FleetDistRunnerBase(object):
         fleet.stop_worker()
         return train_result
 
+    def shard_tensor_provider(self, shard_reader):
+        """
+        Convert the (dense, sparse, label) batches of ctr_shard.batch_reader
+        to the tensors of self._words, each sparse slot has one id per sample
+        """
+        place = fluid.CPUPlace()
+
+        def tensor_provider():
+            for dense, sparse, label in shard_reader():
+                lod = [list(range(len(label) + 1))]
+                sparse_tensors = []
+                for slot in sparse:
+                    tensor = fluid.LoDTensor()
+                    tensor.set(slot.reshape([-1, 1]), place)
+                    tensor.set_lod(lod)
+                    sparse_tensors.append(tensor)
+                yield [dense] + sparse_tensors + [label]
+
+        return tensor_provider
+
 
     def check_model_format(self, epoch_id):
         pattern = '^trainer_[0-9]+_epoch_[0-9]+$'
@@ -360,8 +395,12 @@ class FleetDistRunnerBase(object):
         logger.info("file list: {}".format(file_list))
         print("file list: {}".format(file_list))
 
-        train_reader = paddle.batch(
-            dataset.train(file_list, 1, 0), batch_size=params.batch_size)
+        if params.reader_block_size > 0:
+            train_reader = dataset.train_batch(
+                file_list, params.batch_size, params.reader_block_size, shuffle=False)
+        else:
+            train_reader = paddle.batch(
+                dataset.train(file_list, 1, 0), batch_size=params.batch_size)
 
         startup_program = fluid.default_startup_program()
         main_program = fluid.default_main_program()
@@ -474,64 +513,100 @@ class FleetDistRunnerBase(object):
             return
         if os.path.exists(model_path + '.auc'):
             return
-        place = fluid.CPUPlace()
-        dataset = py_reader.CriteoDataset(params.sparse_feature_dim)
+        return self.run_infer_models(params, [model_path])[model_path]
+
+    def run_infer_all(self, params, model_dir):
+        """
+        Function run_infer_all: evaluate every epoch model under model_dir which has no .auc result yet
+        Args:
+            :params params: the hyper parameters of network
+            :params model_dir: the dir of the trainer_x_epoch_y models
+        Returns
+            :infer_results, type:dict, the evalution result of every model path
+        """
+        model_paths = []
+        for epoch_id in sorted(os.listdir(model_dir)):
+            model_path = os.path.join(model_dir, epoch_id)
+            if os.path.isdir(model_path) and self.check_model_format(epoch_id) and \
+                    not os.path.exists(model_path + '.auc'):
+                model_paths.append(model_path)
+        return self.run_infer_models(params, model_paths)
+
+    def run_infer_models(self, params, model_paths):
+        """
+        Parse the test set once into the shards of params.test_shard_path, evaluate the
+        models in params.cpu_num processes and write the .auc results when all are done
+        """
+        shard_path = params.test_shard_path or \
+            params.test_files_path.rstrip('/') + '_shard'
         file_list = [str(params.test_files_path) + "/%s" % x
                      for x in os.listdir(params.test_files_path)]
+        ctr_shard.convert(file_list, shard_path, params.sparse_feature_dim,
+                          num_workers=int(params.cpu_num))
+        shards = ctr_shard.shard_list(shard_path)
+
+        jobs = [(self, params, model_path, shards) for model_path in model_paths]
+        num_workers = min(int(params.cpu_num), len(jobs))
+        if num_workers > 1:
+            pool = multiprocessing.Pool(num_workers)
+            results = pool.map(_infer_job, jobs)
+            pool.close()
+            pool.join()
+        else:
+            results = [_infer_job(job) for job in jobs]
 
-        test_reader = paddle.batch(
-            dataset.test(file_list), batch_size=params.batch_size)
+        infer_results = {}
+        for model_path, (loss_sum, num, pos, neg, cost) in zip(model_paths, results):
+            infer_result = {}
+            infer_result['loss'] = loss_sum / max(num, 1)
+            infer_result['auc'] = ctr_metrics.histogram_auc(pos, neg)
+            infer_result['time'] = cost
+            logger.info("{}: {}".format(model_path, infer_result))
+            infer_results[model_path] = infer_result
+        for model_path in model_paths:
+            with open(model_path + '.auc', 'w') as fout:
+                fout.write(str(infer_results[model_path]) + '\n')
+            if not params.is_local_cluster:
+                self.upload_infer_result(model_path)
+        print("Inference complete")
+        return infer_results
+
+    def infer_shards(self, params, model_path, shards):
+        """
+        Run the model of model_path over the test shards in a scope of its own
+        Returns:
+            the loss sum, the number of samples, the auc histograms of the predicts and the time
+        """
+        place = fluid.CPUPlace()
         startup_program = fluid.framework.Program()
         test_program = fluid.framework.Program()
-
-        def set_zero(var_name):
-            param = fluid.global_scope().var(var_name).get_tensor()
-            param_array = np.zeros(param._get_dims()).astype("int64")
-            param.set(param_array, place)
-
-        with fluid.framework.program_guard(test_program, startup_program):
-            inputs = self.input_data(params)
-            loss, auc_var, batch_auc_var, data_list = self.net(inputs, params)
-            exe = fluid.Executor(place)
-            feeder = fluid.DataFeeder(feed_list=data_list, place=place)
-            train_method = ''
-            if params.is_pyreader_train:
-                train_method = '_pyreader_train/'
-            else:
-                train_method = '_dataset_train/'
-            fluid.io.load_persistables(
-                    executor=exe,
-                    dirname=model_path,
-                    main_program=fluid.default_main_program())
-            auc_states_names = ['_generated_var_0', '_generated_var_1', '_generated_var_2', '_generated_var_3']
-            for name in auc_states_names:
-                set_zero(name)
-            run_index = 0
-            L = []
-            start_time = time.clock()
-            for batch_id, data in enumerate(test_reader()):
-                loss_val, auc_val, batch_auc_val = exe.run(test_program,
-                                            feed=feeder.feed(data),
-                                            fetch_list=[loss, auc_var, batch_auc_var])
-                run_index += 1
-                L.append(loss_val / params.batch_size)
-                if batch_id % 1000 == 0:
-                    print("TEST --> batch: {} loss: {} auc: {}, batch_auc: {}".format(
-                        batch_id, loss_val / params.batch_size, auc_val, batch_auc_val))
-            end_time = time.clock()
-
-            infer_loss = np.mean(L)
-            infer_auc = auc_val[0]
-            infer_result = {}
-            infer_result['loss'] = infer_loss
-            infer_result['auc'] = infer_auc
-            infer_result['time'] = end_time - start_time
-            print(str(infer_result))
-            print("Inference complete")
-        with open(model_path + '.auc', 'w') as fout:
-            fout.write(str(infer_result) + '\n')
-        if not params.is_local_cluster:
-            self.upload_infer_result(model_path)
+        loss_sum = 0.0
+        num = 0
+        # the empty histograms when the shards have no batch
+        pos, neg = ctr_metrics.auc_histogram([], [])
+        start_time = time.time()
+        with fluid.scope_guard(fluid.Scope()):
+            with fluid.framework.program_guard(test_program, startup_program):
+                inputs = self.input_data(params)
+                loss, auc_var, batch_auc_var, data_list = self.net(inputs, params)
+                exe = fluid.Executor(place)
+                fluid.io.load_persistables(
+                    executor=exe, dirname=model_path, main_program=test_program)
+                names = [var.name for var in data_list]
+                tensor_provider = self.shard_tensor_provider(
+                    ctr_shard.batch_reader(shards, params.batch_size, shuffle=False))
+                for tensors in tensor_provider():
+                    label = np.asarray(tensors[-1])
+                    feed = dict(zip(names, [np.asarray(tensors[0])] + tensors[1:-1] + [label]))
+                    loss_val, predict_val = exe.run(
+                        test_program, feed=feed, fetch_list=[loss, self.predict])
+                    batch_pos, batch_neg = ctr_metrics.auc_histogram(
+                        label, np.array(predict_val)[:, 1])
+                    pos = pos + batch_pos
+                    neg = neg + batch_neg
+                    loss_sum += float(np.array(loss_val).sum())
+                    num += len(label)
+        return loss_sum, num, pos, neg, time.time() - start_time
 
     def py_reader(self, params):
         """
@@ -714,6 +789,11 @@ class FleetDistRunnerBase(object):
                 raise ValueError("Please choice training role for current node : PSERVER / TRAINER")
 
     
+def _infer_job(args):
+    runner, params, model_path, shards = args
+    return runner.infer_shards(params, model_path, shards)
+
+
 def process_info():
     pid = os.getpid()
     res = commands.getstatusoutput('ps aux|grep ' + str(pid))[1].split('\n')[0]
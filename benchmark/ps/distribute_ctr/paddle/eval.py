@@ -0,0 +1,13 @@
+from __future__ import print_function
+from model import CTR
+from argument import params_args
+
+params = params_args()
+model = CTR()
+model_path = params.test_model_dir
+
+# the test set is parsed once into shards, then every epoch model without a .auc
+# result is evaluated, params.cpu_num at a time
+result = model.run_infer_all(params, model_path)
+for model_dir in sorted(result):
+    print("%s auc: %.6f" % (model_dir, result[model_dir]['auc']))
@@ -68,6 +68,8 @@ class CTR(FleetDistRunnerBase):
                                       param_attr=fluid.ParamAttr(initializer=fluid.initializer.Normal(
                                           scale=1 / math.sqrt(fc3.shape[1]))))
     
+            # the predict is fetched by infer_shards to compute the auc
+            self.predict = predict
             cost = fluid.layers.cross_entropy(input=predict, label=words[-1])
             avg_cost = fluid.layers.reduce_sum(cost)
             accuracy = fluid.layers.accuracy(input=predict, label=words[-1])
@@ -88,6 +90,8 @@ class CTR(FleetDistRunnerBase):
         dataset = fluid.DatasetFactory().create_dataset()
         dataset.set_use_var([self.dense_input] + self.sparse_input_ids + [self.label])
         pipe_command = "python dataset_generator.py"
+        if params.reader_block_size > 0:
+            pipe_command += " %d" % params.reader_block_size
         dataset.set_pipe_command(pipe_command)
         dataset.set_batch_size(params.batch_size)
         thread_num = int(params.cpu_num)
@@ -12,25 +12,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
+import numpy as np
+import feature_hash
+
 # There are 13 integer features and 26 categorical features
 continous_features = range(1, 14)
 categorial_features = range(14, 40)
 continous_clip = [20, 600, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
+
+
+def read_blocks(fin, block_size):
+    """
+    Read a file object in blocks of at most block_size lines
+    """
+    while True:
+        lines = list(itertools.islice(fin, block_size))
+        if not lines:
+            break
+        yield lines
+
+
 class Dataset:
     def __init__(self):
         pass
 
 
 class CriteoDataset(Dataset):
-    def __init__(self, sparse_feature_dim):
+    def __init__(self, sparse_feature_dim, hash_type='murmur'):
         self.cont_min_ = [0, -3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.cont_max_ = [20, 600, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
         self.cont_diff_ = [20, 603, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
         self.hash_dim_ = sparse_feature_dim
+        self.hash_ids_ = feature_hash.get_hasher(hash_type)
+        self.line_hash_ids_ = feature_hash.get_line_hasher(hash_type)
         # here, training data are lines with line_index < train_idx_
         self.train_idx_ = 41256555
         self.continuous_range_ = range(1, 14)
         self.categorical_range_ = range(14, 40)
+        # column prefixes used to build the hash keys of a whole block
+        self.categorical_prefix_ = np.array([str(idx) for idx in self.categorical_range_])
 
     def _reader_creator(self, file_list, is_train, trainer_num, trainer_id):
         def reader():
@@ -50,14 +71,74 @@ class CriteoDataset(Dataset):
                             else:
                                 dense_feature.append(
                                     (float(features[idx]) - self.cont_min_[idx - 1]) / self.cont_diff_[idx - 1])
-                        for idx in self.categorical_range_:
-                            sparse_feature.append([hash(str(idx) + features[idx]) % self.hash_dim_])
+                        keys = [str(idx) + features[idx] for idx in self.categorical_range_]
+                        for sparse_id in self.line_hash_ids_(keys, self.hash_dim_):
+                            sparse_feature.append([sparse_id])
 
                         label = [int(features[0])]
                         yield [dense_feature] + sparse_feature + [label]
 
         return reader
 
+    def _process_block(self, lines):
+        """
+        Parse a block of lines at once, the columnar version of _reader_creator
+        Returns:
+            dense: float64 array of shape [N, 13]
+            sparse: int64 array of shape [N, 26]
+            label: int64 array of shape [N, 1]
+        """
+        features = np.array([line.rstrip('\n').split('\t') for line in lines])
+
+        dense = features[:, list(self.continuous_range_)]
+        missing = dense == ''
+        dense = np.array(np.where(missing, '0', dense).tolist(), dtype='float64')
+        dense = (dense - self.cont_min_) / self.cont_diff_
+        dense[missing] = 0.0
+
+        keys = np.char.add(self.categorical_prefix_,
+                           features[:, list(self.categorical_range_)])
+        sparse = self.hash_ids_(keys, self.hash_dim_)
+
+        label = features[:, :1].astype('int64')
+        return dense, sparse, label
+
+    def _block_to_samples(self, dense, sparse, label):
+        """
+        Convert the column arrays of a block to the samples of _reader_creator
+        """
+        sparse = sparse.reshape(sparse.shape + (1,)).tolist()
+        return [[d] + s + [l] for d, s, l in
+                zip(dense.tolist(), sparse, label.tolist())]
+
+    def _batch_reader_creator(self, file_list, batch_size, block_size, shuffle):
+        """
+        Parse block_size lines at once and emit whole batches directly,
+        the samples are the same as paddle.batch over _reader_creator
+        """
+        def reader():
+            print(file_list)
+            rest = None
+            for file in file_list:
+                with open(file, 'r') as f:
+                    print("open file success")
+                    for lines in read_blocks(f, block_size):
+                        block = self._process_block(lines)
+                        if shuffle:
+                            perm = np.random.permutation(len(lines))
+                            block = [column[perm] for column in block]
+                        if rest is not None:
+                            block = [np.concatenate(pair) for pair in zip(rest, block)]
+                        end = len(block[0]) - len(block[0]) % batch_size
+                        for begin in range(0, end, batch_size):
+                            yield self._block_to_samples(
+                                *[column[begin:begin + batch_size] for column in block])
+                        rest = [column[end:] for column in block]
+            if rest is not None and len(rest[0]) > 0:
+                yield self._block_to_samples(*rest)
+
+        return reader
+
     def train(self, file_list, trainer_num, trainer_id):
         return self._reader_creator(file_list, True, trainer_num, trainer_id)
 
@@ -66,3 +147,9 @@ class CriteoDataset(Dataset):
 
     def infer(self, file_list):
         return self._reader_creator(file_list, False, 1, 0)
+
+    def train_batch(self, file_list, batch_size, block_size, shuffle=True):
+        return self._batch_reader_creator(file_list, batch_size, block_size, shuffle)
+
+    def test_batch(self, file_list, batch_size, block_size):
+        return self._batch_reader_creator(file_list, batch_size, block_size, False)
@@ -0,0 +1,137 @@
+# Copyright (c) 2019 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+analogy_eval.py: analogy evaluation of the word embedding with numpy
+
+The embedding of a checkpoint is loaded and normalized once, the queries
+"a:b = c:?" are scored against the whole vocabulary in blocks of matmuls and
+the top k words are found with argpartition. Several checkpoints are
+evaluated in parallel processes.
+"""
+from __future__ import print_function
+import os
+import multiprocessing
+import numpy as np
+
+
+def load_lod_tensor(path, shape, dtype='float32'):
+    """
+    Load a float tensor saved by fluid.io.save_persistables, the raw data
+    is stored at the end of the file after the lod and the tensor desc
+    """
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    file_size = os.path.getsize(path)
+    if file_size < nbytes:
+        raise ValueError("{} has {} bytes, less than a tensor of shape {}".format(
+            path, file_size, shape))
+    with open(path, 'rb') as f:
+        f.seek(file_size - nbytes)
+        data = np.fromfile(f, dtype=dtype, count=int(np.prod(shape)))
+    return data.reshape(shape)
+
+
+def load_fluid_emb(model_path, shape, param_name='emb'):
+    """
+    Load the embedding parameter of a model saved by the paddle trainers
+    """
+    return load_lod_tensor(os.path.join(model_path, param_name), shape)
+
+
+def l2_normalize(x):
+    norm = np.sqrt(np.square(x).sum(axis=1, keepdims=True))
+    return x / np.maximum(norm, 1e-12)
+
+
+class AnalogyEvaluator(object):
+    def __init__(self, emb, normalize_inputs=False, block_size=2048, k=4):
+        """
+        Args:
+            emb: float array of shape [vocab_size, emb_size]
+            normalize_inputs: whether the embedding of a, b and c is normalized
+                as well, the paddle infer_net uses the raw embedding and the
+                tensorflow infer_network the normalized one
+            block_size: the number of queries scored by one matmul
+            k: the number of top words checked for every query
+        """
+        emb = np.asarray(emb, dtype='float32')
+        self.nemb = l2_normalize(emb)
+        self.query_emb = self.nemb if normalize_inputs else emb
+        self.block_size = block_size
+        self.k = k
+
+    def topk(self, questions):
+        """
+        Returns the ids of the k nearest words of b - a + c in descending
+        order of the score, int64 array of shape [N, k]
+        """
+        k = self.k
+        result = np.zeros((len(questions), k), dtype='int64')
+        for begin in range(0, len(questions), self.block_size):
+            sub = questions[begin:begin + self.block_size]
+            target = self.query_emb[sub[:, 1]] - self.query_emb[sub[:, 0]] + \
+                self.query_emb[sub[:, 2]]
+            dist = np.dot(target, self.nemb.T)
+            rows = np.arange(len(sub))[:, None]
+            idx = np.argpartition(-dist, k - 1, axis=1)[:, :k]
+            order = np.argsort(-dist[rows, idx], axis=1)
+            result[begin:begin + len(sub)] = idx[rows, order]
+        return result
+
+    def accuracy(self, questions):
+        """
+        A question is correct when the first of its top k words that is not
+        a, b or c is the answer d
+        Args:
+            questions: int array of shape [N, 4] with the ids of a, b, c, d
+        Returns:
+            the number of correct questions and the accuracy
+        """
+        questions = np.asarray(questions, dtype='int64')
+        if len(questions) == 0:
+            return 0, 0.0
+        top = self.topk(questions)
+        is_input = (top[:, :, None] == questions[:, None, :3]).any(axis=2)
+        first = np.argmax(~is_input, axis=1)
+        found = (~is_input).any(axis=1)
+        correct = found & (top[np.arange(len(top)), first] == questions[:, 3])
+        correct = int(correct.sum())
+        return correct, 1.0 * correct / len(questions)
+
+
+def _evaluate_job(args):
+    load_fn, path, questions, normalize_inputs = args
+    evaluator = AnalogyEvaluator(load_fn(path), normalize_inputs)
+    return evaluator.accuracy(questions)
+
+
+def evaluate_models(paths, load_fn, questions, normalize_inputs=False,
+                    num_workers=1):
+    """
+    Evaluate the embedding of every model path
+    Args:
+        paths: the model paths
+        load_fn: module level function(path) -> embedding array
+        questions: int array of shape [N, 4]
+        num_workers: the number of processes evaluating the models
+    Returns:
+        list of (correct, acc) in the order of paths
+    """
+    jobs = [(load_fn, path, questions, normalize_inputs) for path in paths]
+    if num_workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(num_workers, len(jobs)))
+        results = pool.map(_evaluate_job, jobs)
+        pool.close()
+        pool.join()
+        return results
+    return [_evaluate_job(job) for job in jobs]
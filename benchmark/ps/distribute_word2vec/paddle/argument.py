@@ -33,6 +33,8 @@ def params_args(args=None):
                         help="Data file(s) for validation or evaluation.")
     params.add_argument("--log_path", type=str, default="result")
     params.add_argument("--model_path", type=str, default="model")
+    params.add_argument("--manifest_path", type=str, default="",
+                        help="Line counts of the training files, default: <train_files_path>.manifest")
     params.add_argument("--dict_path", type=str, default="./thirdparty/test_build_dict")
     params.add_argument("--infer_dict_path", type=str, default="./thirdparty/test_build_dict_word_to_id_")
 
@@ -14,6 +14,7 @@
 import numpy as np
 import io
 import paddle.fluid.incubate.data_generator as dg
+import negative_sampler
 
 
 neg_num=5
@@ -21,22 +22,29 @@ dict_path = "./thirdparty/test_build_dict"
 window_size = 5
 batch_size = 100
 
-class NumpyRandomInt(object):
-    def __init__(self, a, b, buf_size=1000):
-        self.idx = 0
-        self.buffer = np.random.random_integers(a, b, buf_size)
-        self.a = a
-        self.b = b
-
-    def __call__(self):
-        if self.idx == len(self.buffer):
-            self.buffer = np.random.random_integers(self.a, self.b,
-                                                    len(self.buffer))
-            self.idx = 0
+def skip_gram_pairs(word_ids, window_size):
+    """
+    All the (target, context) pairs of a line. Every target draws its window
+    w from [1, window_size + 1], its contexts are the words of the line at
+    most w positions before and after it, from left to right
+    Args:
+        word_ids: int64 array of the ids of a line
+        window_size: window size
+    Returns:
+        targets, contexts: int64 arrays of shape [num_pairs]
+    """
+    word_ids = np.asarray(word_ids, dtype='int64')
+    num = len(word_ids)
+    max_window = window_size + 1
+    windows = np.random.randint(1, max_window + 1, num)
+    offsets = np.concatenate(
+        [np.arange(-max_window, 0), np.arange(1, max_window + 1)])
+    positions = np.arange(num)[:, None] + offsets
+    mask = (np.abs(offsets) <= windows[:, None]) & (positions >= 0) & \
+        (positions < num)
+    rows, cols = np.nonzero(mask)
+    return word_ids[rows], word_ids[positions[rows, cols]]
 
-        result = self.buffer[self.idx]
-        self.idx += 1
-        return result
 
 class MyDataset(dg.MultiSlotDataGenerator):
     def load_resource(self, dict_path, window_size, batch_size):
@@ -51,43 +59,20 @@ class MyDataset(dg.MultiSlotDataGenerator):
         self.id_frequencys = [
             float(count) / word_all_count for count in self.id_counts
         ]
-        np_power = np.power(np.array(self.id_frequencys), 0.75)
-        self.id_frequencys_pow = np_power / np_power.sum()
+        self.sampler = negative_sampler.load_sampler(dict_path)
+        self.window_size = window_size
         self.dict_size = len(self.id_counts)
-        self.random_generator = NumpyRandomInt(1, window_size + 1)
 
-    def get_context_words(self, words, idx):
-        """
-        Get the context word list of target word.
-        words: the words of the current line
-        idx: input word index
-        window_size: window size
-        """
-        target_window = self.random_generator()
-        #target_window = 2
-        start_point = idx - target_window  # if (idx - target_window) > 0 else 0
-        if start_point < 0:
-            start_point = 0
-        end_point = idx + target_window
-        targets = words[start_point:idx] + words[idx + 1:end_point + 1]
-        return targets
-    
     def generate_sample(self, line):
         def data_iter():
-            cs = np.array(self.id_frequencys_pow).cumsum()
-            neg_array = cs.searchsorted(np.random.sample(neg_num))
-            id_ = 0
-            word_ids = [w for w in line.split()]
-            for idx, target_id in enumerate(word_ids):
-                context_word_ids = self.get_context_words(
-                    word_ids, idx)
-                for context_id in context_word_ids:
-                    neg_id = [ int(str(i)) for i in neg_array ]
-                    output = [('input_word', [int(target_id)]), ('true_label', [int(context_id)]), ('neg_label', neg_id)]
-                    yield output
-                    id_ += 1
-                    if id_ % self.batch_size == 0:
-                        neg_array = cs.searchsorted(np.random.sample(neg_num)) 
+            targets, contexts = skip_gram_pairs(
+                np.array(line.split(), dtype='int64'), self.window_size)
+            neg_ids = self.sampler.sample((len(targets), neg_num)).tolist()
+            for target_id, context_id, neg_id in zip(
+                    targets.tolist(), contexts.tolist(), neg_ids):
+                output = [('input_word', [target_id]), ('true_label', [context_id]),
+                          ('neg_label', neg_id)]
+                yield output
         return data_iter
 
 if __name__ == "__main__":
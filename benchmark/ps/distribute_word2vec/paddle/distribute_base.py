@@ -21,6 +21,7 @@ import io
 import commands
 import logging
 import time
+import functools
 import numpy as np
 import thread
 import paddle
@@ -29,6 +30,9 @@ import paddle.fluid.incubate.fleet.base.role_maker as role_maker
 from paddle.fluid.incubate.fleet.parameter_server.distribute_transpiler import fleet
 from paddle.fluid.transpiler.distribute_transpiler import DistributeTranspilerConfig
 import reader_generator as py_reader
+import line_manifest
+import negative_sampler
+import analogy_eval
 from paddle.fluid.contrib.utils import HDFSClient
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
@@ -201,7 +205,7 @@ class FleetDistRunnerBase(object):
         logger.info("file list: {}".format(file_list))
         logger.info("there are a total of {} files.".format(len(file_list)))
         logger.info('----------------------NO.%s trainer ready----------------' % (params.current_id))
-        all_examples = self.get_example_num(file_list)
+        all_examples = self.get_example_num(file_list, params)
 
         # step7: begin to train your model, good luck
         train_result = {}
@@ -297,10 +301,10 @@ class FleetDistRunnerBase(object):
         # Paddle Fluid enter data by variable name
         # When we do the definition of the reader, the program has established the workflow
 
-        np_power = np.power(np.array(word2vec_reader.id_frequencys), 0.75)
-        id_frequencys_pow = np_power / np_power.sum()
+        sampler = negative_sampler.load_sampler(params.dict_path)
         reader.decorate_tensor_provider(
-            py_reader.convert_python_to_tensor(id_frequencys_pow, params.batch_size, word2vec_reader.train(), params))
+            py_reader.convert_batch_to_tensor(
+                sampler, word2vec_reader.train_batch(params.batch_size), params))
 
         # step7: define the compiled program
         exec_strategy = fluid.ExecutionStrategy()
@@ -319,7 +323,7 @@ class FleetDistRunnerBase(object):
 
         # step8: begin to train your model, good luck
         train_result = {}
-        all_examples = self.get_example_num(file_list)
+        all_examples = self.get_example_num(file_list, params)
         for epoch in range(params.epochs):
             reader.start()
             start_time = time.time()
@@ -360,14 +364,19 @@ class FleetDistRunnerBase(object):
         fleet.stop_worker()
         return train_result
 
-    def get_example_num(self,file_list):
-        count = 0
-        for f in file_list:
-            last_count = count
-            for index, line in enumerate(open(f, 'r')):
-                count += 1
-            logger.info("file: %s has %s examples"%(f,count-last_count))
-        logger.info("Total example: %s"%count)
+    def get_example_num(self, file_list, params):
+        """
+        Count the examples of file_list, the counts are cached in the manifest
+        and only the new or changed files are counted again
+        """
+        manifest_path = params.manifest_path or \
+            params.train_files_path.rstrip('/') + '.manifest'
+        counts = line_manifest.update_manifest(file_list, manifest_path,
+                                               int(params.cpu_num))
+        for f, num in zip(file_list, counts):
+            logger.info("file: %s has %s examples" % (f, num))
+        count = sum(counts)
+        logger.info("Total example: %s" % count)
         return count
 
     def upload_files(self, local_path, params, kind):
@@ -395,9 +404,9 @@ class FleetDistRunnerBase(object):
         word2vec_reader = py_reader.Word2VecReader(params.dict_path, file_list, 0, 1)
         params.dict_size = word2vec_reader.dict_size
       
-        np_power = np.power(np.array(word2vec_reader.id_frequencys), 0.75)
-        id_frequencys_pow = np_power / np_power.sum()
-        reader.decorate_tensor_provider(py_reader.convert_python_to_tensor(id_frequencys_pow, params.batch_size, word2vec_reader.train(), params))
+        sampler = negative_sampler.load_sampler(params.dict_path)
+        reader.decorate_tensor_provider(py_reader.convert_batch_to_tensor(
+            sampler, word2vec_reader.train_batch(params.batch_size), params))
 
         loss = self.net(inputs, params)
 
@@ -432,7 +441,7 @@ class FleetDistRunnerBase(object):
             exec_strategy=exec_strategy)
 
         train_result = {}
-        all_examples = self.get_example_num(file_list)
+        all_examples = self.get_example_num(file_list, params)
         logger.info("--------begin------- ")
         for epoch in range(params.epochs):
             reader.start()
@@ -492,61 +501,50 @@ class FleetDistRunnerBase(object):
         if os.path.exists(model_path + '.acc'):
             return
 
-        params.dict_size, test_reader, id2word = py_reader.prepare_data(
-            params.test_files_path, params.infer_dict_path, batch_size=params.infer_batch_size)
-
-        place = fluid.CPUPlace()
-        exe = fluid.Executor(place)
-        infer_result = {}
-        startup_program = fluid.framework.Program()
-        test_program = fluid.framework.Program()
-
-        with fluid.framework.program_guard(test_program,startup_program):
-            values, pred = self.infer_net(params)
-            logger.info(model_path)
-            fluid.io.load_persistables(
-                executor=exe, dirname=model_path, main_program=fluid.default_main_program())
-
-            accum_num = 0
-            accum_num_sum = 0.0
-            step_id = 0
-            for data in test_reader():
-                step_id += 1
-                b_size = len([dat[0] for dat in data])
-                wa = np.array([dat[0] for dat in data]).astype("int64").reshape(b_size, 1)
-                wb = np.array([dat[1] for dat in data]).astype("int64").reshape(b_size, 1)
-                wc = np.array([dat[2] for dat in data]).astype("int64").reshape(b_size, 1)
-
-                label = [dat[3] for dat in data]
-                input_word = [dat[4] for dat in data]
-                para = exe.run(fluid.default_main_program(),
-                               feed={
-                                   "analogy_a": wa, "analogy_b": wb, "analogy_c": wc,
-                                   "all_label":
-                                       np.arange(params.dict_size).reshape(
-                                           params.dict_size, 1).astype("int64"),
-                               },
-                               fetch_list=[pred.name, values],
-                               return_numpy=False)
-                pre = np.array(para[0])
-                val = np.array(para[1])
-                for ii in range(len(label)):
-                    top4 = pre[ii]
-                    accum_num_sum += 1
-                    for idx in top4:
-                        if int(idx) in input_word[ii]:
-                            continue
-                        if int(idx) == int(label[ii][0]):
-                            accum_num += 1
-                        break
-                if step_id % 1 == 0:
-                    logger.info("step:%d %d " % (step_id, accum_num))
-            acc = 1.0 * accum_num / accum_num_sum
-            logger.info("acc:%.3f " % acc)
-            infer_result['acc'] = acc
+        w2i, i2w = py_reader.BuildWord_IdMap(params.infer_dict_path)
+        params.dict_size = len(i2w)
+        questions = py_reader.read_questions(params.test_files_path, w2i)
+        logger.info(model_path)
+        load_fn = functools.partial(analogy_eval.load_fluid_emb,
+                                    shape=(params.dict_size, params.embedding_size))
+        correct, acc = analogy_eval.evaluate_models([model_path], load_fn, questions)[0]
+        logger.info("correct:%d acc:%.3f " % (correct, acc))
+        infer_result = {'acc': acc}
         with open(model_path + '.acc', 'w') as fout:
             fout.write(str(infer_result) + '\n')
-        #return infer_result
+        return infer_result
+
+    def run_infer_all(self, params, model_dir):
+        """
+        Function run_infer_all: evaluate every epoch model under model_dir which has
+        no .acc result yet, the models are evaluated in params.cpu_num processes
+        Args:
+            :params params: the hyper parameters of network
+            :params model_dir: the dir of the trainer_x_epoch_y models
+        Returns
+            :infer_results, type:dict, the evalution result of every model path
+        """
+        model_paths = []
+        for epoch_id in sorted(os.listdir(model_dir)):
+            model_path = os.path.join(model_dir, epoch_id)
+            if os.path.isdir(model_path) and self.check_model_format(epoch_id) and \
+                    not os.path.exists(model_path + '.acc'):
+                model_paths.append(model_path)
+
+        w2i, i2w = py_reader.BuildWord_IdMap(params.infer_dict_path)
+        params.dict_size = len(i2w)
+        questions = py_reader.read_questions(params.test_files_path, w2i)
+        load_fn = functools.partial(analogy_eval.load_fluid_emb,
+                                    shape=(params.dict_size, params.embedding_size))
+        results = analogy_eval.evaluate_models(model_paths, load_fn, questions,
+                                               num_workers=int(params.cpu_num))
+        infer_results = {}
+        for model_path, (correct, acc) in zip(model_paths, results):
+            logger.info("%s correct:%d acc:%.3f " % (model_path, correct, acc))
+            infer_results[model_path] = {'acc': acc}
+            with open(model_path + '.acc', 'w') as fout:
+                fout.write(str(infer_results[model_path]) + '\n')
+        return infer_results
 
     def py_reader(self, params):
         """
@@ -1,15 +1,12 @@
+from __future__ import print_function
 from model import word2vec
-import paddle.fluid as fluid
 from argument import params_args
-import os
 
 params = params_args()
 model = word2vec()
 model_path = params.test_model_dir
-result = {}
 
-files = os.listdir(model_path)
-for model_dir in files:
-    epoch = model_dir.split('_')[-1]
-    print "process %s" % model_dir
-    model.run_infer(params, os.path.join(model_path, model_dir))
+# every epoch model without a .acc result is evaluated, params.cpu_num at a time
+result = model.run_infer_all(params, model_path)
+for model_dir in sorted(result):
+    print("%s acc: %.3f" % (model_dir, result[model_dir]['acc']))
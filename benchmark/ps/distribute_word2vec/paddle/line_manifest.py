@@ -0,0 +1,133 @@
+# Copyright (c) 2019 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+line_manifest.py: cached line counts of the training files
+
+The manifest is a json file in the format written by preprocess.py:
+    {abs_path: {"size": ..., "mtime": ..., "lines": ...}}
+A file is counted again only when its size or mtime differs from the manifest.
+
+usage:
+    python line_manifest.py --train_files_path=train_data --manifest_path=train_data.manifest
+"""
+from __future__ import print_function
+import os
+import json
+import logging
+import multiprocessing
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("fluid")
+logger.setLevel(logging.INFO)
+
+
+def count_lines(path, chunk_size=1 << 22):
+    """
+    Count the lines of a file by scanning newlines block by block
+    """
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(chunk_size)
+            if not buf:
+                break
+            lines += buf.count(b'\n')
+            last = buf[-1:]
+    # the last line has no newline
+    if last != b'\n':
+        lines += 1
+    return lines
+
+
+def load_manifest(manifest_path):
+    """
+    Returns the manifest as a dict, or an empty dict if it does not exist
+    or can not be parsed
+    """
+    if not manifest_path or not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning("manifest {} is broken, rebuild it".format(manifest_path))
+        return {}
+
+
+def save_manifest(manifest_path, manifest):
+    # several trainers may save the manifest at the same time
+    tmp = '{}.{}.tmp'.format(manifest_path, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.rename(tmp, manifest_path)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def update_manifest(file_list, manifest_path, num_workers=1):
+    """
+    Make sure every file of file_list has an up-to-date entry in the manifest,
+    the stale and missing files are counted in parallel
+    Args:
+        file_list: the files to count
+        manifest_path: the path of the manifest, an empty path disables saving
+        num_workers: the number of counting processes
+    Returns:
+        the list of line counts of file_list
+    """
+    manifest = load_manifest(manifest_path)
+    paths = [os.path.abspath(f) for f in file_list]
+    stats = {}
+    stale = []
+    for path in paths:
+        stat = os.stat(path)
+        stats[path] = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        item = manifest.get(path)
+        if item is None or item.get('size') != stat.st_size or \
+                item.get('mtime') != stat.st_mtime:
+            if path not in stale:
+                stale.append(path)
+
+    if stale:
+        if num_workers > 1 and len(stale) > 1:
+            pool = multiprocessing.Pool(min(num_workers, len(stale)))
+            counts = pool.map(count_lines, stale)
+            pool.close()
+            pool.join()
+        else:
+            counts = [count_lines(path) for path in stale]
+        for path, lines in zip(stale, counts):
+            item = dict(stats[path])
+            item['lines'] = lines
+            manifest[path] = item
+        logger.info("count lines of {} files".format(len(stale)))
+        if manifest_path:
+            save_manifest(manifest_path, manifest)
+    return [manifest[path]['lines'] for path in paths]
+
+
+if __name__ == '__main__':
+    from argument import params_args
+    params = params_args()
+    manifest_path = params.manifest_path or \
+        params.train_files_path.rstrip('/') + '.manifest'
+    file_list = [os.path.join(params.train_files_path, x)
+                 for x in os.listdir(params.train_files_path)]
+    counts = update_manifest(file_list, manifest_path, int(params.cpu_num))
+    print("{} files, {} lines, manifest: {}".format(
+        len(file_list), sum(counts), manifest_path))
@@ -0,0 +1,112 @@
+# Copyright (c) 2019 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+negative_sampler.py: alias method sampler of the negative words
+
+The table over the unigram^0.75 distribution of the dict is built once and
+cached next to the dict as <dict_path>.alias.npz, every draw then costs one
+random index and one comparison.
+"""
+import io
+import os
+import numpy as np
+
+
+class AliasSampler(object):
+    def __init__(self, prob, alias):
+        self.prob = prob
+        self.alias = alias
+        self.size = len(prob)
+
+    @classmethod
+    def from_weights(cls, weights):
+        """
+        Build the alias table of the distribution proportional to weights
+        """
+        weights = np.asarray(weights, dtype='float64')
+        num = len(weights)
+        scaled = weights * num / weights.sum()
+        prob = np.ones(num, dtype='float64')
+        alias = np.arange(num, dtype='int64')
+        small = np.nonzero(scaled < 1.0)[0].tolist()
+        large = np.nonzero(scaled >= 1.0)[0].tolist()
+        scaled = scaled.tolist()
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # the rest only differ from 1 by rounding errors
+        return cls(prob, alias)
+
+    def sample(self, shape):
+        """
+        Draw independent ids of the given shape
+        Returns:
+            int64 array of shape
+        """
+        idx = np.random.randint(0, self.size, shape)
+        accept = np.random.random_sample(shape) < self.prob[idx]
+        return np.where(accept, idx, self.alias[idx]).astype('int64')
+
+
+def read_counts(dict_path):
+    """
+    Returns the counts of the dict in the order of the word ids
+    """
+    counts = []
+    with io.open(dict_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            counts.append(int(line.split()[1]))
+    return np.array(counts, dtype='float64')
+
+
+def load_sampler(dict_path, power=0.75, cache_path=None):
+    """
+    Load the alias sampler of the dict from the cache, it is rebuilt when the
+    dict changed or power differs
+    Args:
+        dict_path: the dict of "word count" lines
+        power: the power applied to the counts
+        cache_path: default <dict_path>.alias.npz
+    Returns:
+        AliasSampler
+    """
+    cache_path = cache_path or dict_path + '.alias.npz'
+    stat = os.stat(dict_path)
+    key = np.array([stat.st_size, stat.st_mtime, power], dtype='float64')
+    if os.path.exists(cache_path):
+        try:
+            cache = np.load(cache_path)
+            if np.array_equal(cache['key'], key):
+                return AliasSampler(cache['prob'], cache['alias'])
+        except (IOError, ValueError, KeyError):
+            pass
+
+    sampler = AliasSampler.from_weights(np.power(read_counts(dict_path), power))
+    # several trainers may build the cache at the same time
+    tmp = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            np.savez(f, key=key, prob=sampler.prob, alias=sampler.alias)
+        os.rename(tmp, cache_path)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return sampler
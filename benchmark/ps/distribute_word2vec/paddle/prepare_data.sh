@@ -13,7 +13,7 @@ mkdir thirdparty
 mv data/test_build_dict thirdparty/
 mv data/test_build_dict_word_to_id_ thirdparty/
 
-python preprocess.py --data_resplit --input_corpus_dir=data/convert_text8 --output_corpus_dir=train_data
+python preprocess.py --data_resplit --input_corpus_dir=data/convert_text8 --output_corpus_dir=train_data --manifest_path=train_data.manifest
 
 # download test data
 wget https://paddlerec.bj.bcebos.com/word2vec/test_dir.tar
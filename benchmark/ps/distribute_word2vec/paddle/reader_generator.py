@@ -21,28 +21,35 @@ import os
 import six
 import paddle
 import paddle.fluid as fluid
+from negative_sampler import AliasSampler
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("fluid")
 logger.setLevel(logging.INFO)
 
 
-class NumpyRandomInt(object):
-    def __init__(self, a, b, buf_size=1000):
-        self.idx = 0
-        self.buffer = np.random.random_integers(a, b, buf_size)
-        self.a = a
-        self.b = b
-
-    def __call__(self):
-        if self.idx == len(self.buffer):
-            self.buffer = np.random.random_integers(self.a, self.b,
-                                                    len(self.buffer))
-            self.idx = 0
-
-        result = self.buffer[self.idx]
-        self.idx += 1
-        return result
+def skip_gram_pairs(word_ids, window_size):
+    """
+    All the (target, context) pairs of a line. Every target draws its window
+    w from [1, window_size + 1], its contexts are the words of the line at
+    most w positions before and after it, from left to right
+    Args:
+        word_ids: int64 array of the ids of a line
+        window_size: window size
+    Returns:
+        targets, contexts: int64 arrays of shape [num_pairs]
+    """
+    word_ids = np.asarray(word_ids, dtype='int64')
+    num = len(word_ids)
+    max_window = window_size + 1
+    windows = np.random.randint(1, max_window + 1, num)
+    offsets = np.concatenate(
+        [np.arange(-max_window, 0), np.arange(1, max_window + 1)])
+    positions = np.arange(num)[:, None] + offsets
+    mask = (np.abs(offsets) <= windows[:, None]) & (positions >= 0) & \
+        (positions < num)
+    rows, cols = np.nonzero(mask)
+    return word_ids[rows], word_ids[positions[rows, cols]]
 
 
 class Word2VecReader(object):
@@ -80,45 +87,51 @@ class Word2VecReader(object):
         print("dict_size = " + str(self.dict_size) + " word_all_count = " + str(
             word_all_count))
 
-        self.random_generator = NumpyRandomInt(1, self.window_size_ + 1)
-
-    def get_context_words(self, words, idx):
-        """
-        Get the context word list of target word.
-        words: the words of the current line
-        idx: input word index
-        window_size: window size
-        """
-        target_window = self.random_generator()
-        start_point = idx - target_window  # if (idx - target_window) > 0 else 0
-        if start_point < 0:
-            start_point = 0
-        end_point = idx + target_window
-        targets = words[start_point:idx] + words[idx + 1:end_point + 1]
-        return targets
+    def _lines(self):
+        for file in self.filelist:
+            with io.open(file, 'r', encoding='utf-8') as f:
+                logger.info("running data in {}".format(file))
+                count = 1
+                for line in f:
+                    if self.trainer_id == count % self.trainer_num:
+                        yield np.array(line.split(), dtype='int64')
+                    count += 1
 
     def train(self):
         def nce_reader():
-            for file in self.filelist:
-                with io.open(file, 'r', encoding='utf-8') as f:
-                    logger.info("running data in {}".format(file))
-                    count = 1
-                    for line in f:
-                        if self.trainer_id == count % self.trainer_num:
-                            word_ids = [int(w) for w in line.split()]
-                            for idx, target_id in enumerate(word_ids):
-                                context_word_ids = self.get_context_words(
-                                    word_ids, idx)
-                                for context_id in context_word_ids:
-                                    yield [target_id], [context_id]
-                        count += 1
+            for word_ids in self._lines():
+                targets, contexts = skip_gram_pairs(word_ids, self.window_size_)
+                for target_id, context_id in zip(targets.tolist(),
+                                                 contexts.tolist()):
+                    yield [target_id], [context_id]
 
         return nce_reader
 
+    def train_batch(self, batch_size):
+        """
+        Yield (targets, contexts) int64 arrays of shape [batch_size, 1],
+        the pairs of a line are generated at once with skip_gram_pairs
+        and the last incomplete batch is dropped
+        """
+        def batch_reader():
+            pending = [np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')]
+            for word_ids in self._lines():
+                targets, contexts = skip_gram_pairs(word_ids, self.window_size_)
+                targets = np.concatenate([pending[0], targets])
+                contexts = np.concatenate([pending[1], contexts])
+                end = len(targets) - len(targets) % batch_size
+                for begin in range(0, end, batch_size):
+                    yield (targets[begin:begin + batch_size].reshape((-1, 1)),
+                           contexts[begin:begin + batch_size].reshape((-1, 1)))
+                pending = [targets[end:], contexts[end:]]
+
+        return batch_reader
+
 
 def convert_python_to_tensor(weight, batch_size, sample_reader,params):
+    sampler = AliasSampler.from_weights(weight)
+
     def __reader__():
-        cs = np.array(weight).cumsum()
         result = [[], []]
         for sample in sample_reader():
             for i, fea in enumerate(sample):
@@ -135,10 +148,8 @@ def convert_python_to_tensor(weight, batch_size, sample_reader,params):
                     t.set(dat, fluid.CPUPlace())
                     tensor_result.append(t)
                 tt = fluid.Tensor()
-                neg_array = cs.searchsorted(np.random.sample(params.nce_num))
-                neg_array = np.tile(neg_array, batch_size)
                 tt.set(
-                    neg_array.reshape((batch_size, params.nce_num)),
+                    sampler.sample((batch_size, params.nce_num)),
                     fluid.CPUPlace())
                 tensor_result.append(tt)
                 yield tensor_result
@@ -146,6 +157,31 @@ def convert_python_to_tensor(weight, batch_size, sample_reader,params):
 
     return __reader__
 
+
+def convert_batch_to_tensor(sampler, batch_reader, params):
+    """
+    Same tensors as convert_python_to_tensor, built from the batches of
+    Word2VecReader.train_batch, every example gets its own negatives drawn
+    from the AliasSampler
+    """
+    def __reader__():
+        for targets, contexts in batch_reader():
+            batch_size = len(targets)
+            tensor_result = []
+            for dat in (targets, contexts):
+                t = fluid.Tensor()
+                t.set(dat, fluid.CPUPlace())
+                tensor_result.append(t)
+            tt = fluid.Tensor()
+            tt.set(
+                sampler.sample((batch_size, params.nce_num)),
+                fluid.CPUPlace())
+            tensor_result.append(tt)
+            yield tensor_result
+
+    return __reader__
+
+
 def BuildWord_IdMap(dict_path):
     word_to_id = dict()
     id_to_word = dict()
@@ -233,3 +269,12 @@ def reader_creator(file_dir, word_to_id):
 
 def test(test_dir, w2i):
     return reader_creator(test_dir, w2i)
+
+
+def read_questions(test_dir, w2i):
+    """
+    Returns the ids of the analogy questions "a b c d", int64 array of shape [N, 4]
+    """
+    questions = [[a[0], b[0], c[0], d[0]]
+                 for a, b, c, d, _ in reader_creator(test_dir, w2i)()]
+    return np.array(questions, dtype='int64').reshape((-1, 4))
@@ -21,7 +21,7 @@ import six
 import re
 import numpy as np
 
-from net import infer_network
+import analogy_eval
 #################### CMD Arguments ####################
 FLAGS = tf.app.flags.FLAGS
 tf.app.flags.DEFINE_integer("embedding_size", 300, "Embedding size")
@@ -31,6 +31,7 @@ tf.app.flags.DEFINE_string("checkpoint_path", '', "directory to save checkpoint
 tf.app.flags.DEFINE_string("dict_path", 'thirdparty/test_build_dict_word_to_id_', "dict path")
 tf.app.flags.DEFINE_string("task_mode", '', "task_mode")
 tf.app.flags.DEFINE_string("result_path", '', "directory to save evaluate result")
+tf.app.flags.DEFINE_integer("num_workers", 1, "number of checkpoints evaluated in parallel")
 
 def BuildWord_IdMap(dict_path):
     word_to_id = dict()
@@ -102,32 +103,9 @@ def read_analogies(word_to_id):
     return np.array(questions, dtype=np.int32)
 
 
-def eval(sess, questions, analogy_pred_idx, analogy_a, analogy_b, analogy_c):
-    start = 0
-    total = questions.shape[0]
-    correct = 0
-    while start < total:
-        limit = min(start + 2500, total)
-        sub = questions[start:limit, :]
-        idx = sess.run([analogy_pred_idx], {
-            analogy_a: sub[:, 0],
-            analogy_b: sub[:, 1],
-            analogy_c: sub[:, 2]
-        })[0]
-        start = limit
-        for question in xrange(sub.shape[0]):
-            for j in xrange(4):
-                if idx[question, j] == sub[question, 3]:
-                    correct += 1
-                    break
-                elif idx[question, j] in sub[question, :3]:
-                    continue
-                else:
-                    # The correct label is not the precision@1
-                    break
-    print("Eval %4d/%d accuracy = %4.1f%%" % (correct, total,
-                                              correct * 100.0 / total))
-    return correct * 100.0 / total
+def load_emb(path):
+    return tf.train.load_variable(path, "emb")
+
 
 def filter_checkpoint(checkpoint_path):
     all_files = os.listdir(checkpoint_path)
@@ -138,8 +116,6 @@ def filter_checkpoint(checkpoint_path):
 def main(result_file_path, checkpoint_path):
     word_to_id, id_to_word = BuildWord_IdMap(FLAGS.dict_path)
     questions = read_analogies(word_to_id)
-    vocab_size = len(id_to_word)
-    pred_idx, analogy_a, analogy_b, analogy_c = infer_network(vocab_size, FLAGS.embedding_size)
 
     res = {}
     if os.path.exists(result_file_path):
@@ -147,23 +123,28 @@ def main(result_file_path, checkpoint_path):
             res = json.load(f)
 
     while True:
-        with tf.Session() as sess:
-            saver = tf.train.Saver()
-            ckpt=tf.train.get_checkpoint_state(checkpoint_path)
-            all_models = filter_checkpoint(checkpoint_path)
-            if ckpt and all_models:
-                for path in all_models:
-                    global_step=path.split('/')[-1].split('-')[-1]
-                    if global_step in res:
-                        continue
-                    print("Start to inference ==> %s" % (path))
-                    saver.restore(sess,path)
-                    acc = eval(sess, questions, pred_idx, analogy_a, analogy_b, analogy_c)
-                    res[global_step] = acc
-                    with open(result_file_path, 'w') as f:
-                        json.dump(res, f)
-            else:
-                print('No checkpoint file found')
+        ckpt = tf.train.get_checkpoint_state(checkpoint_path)
+        all_models = filter_checkpoint(checkpoint_path)
+        if ckpt and all_models:
+            paths = [path for path in all_models
+                     if path.split('/')[-1].split('-')[-1] not in res]
+            for path in paths:
+                print("Start to inference ==> %s" % (path))
+            # the embedding is loaded and normalized once per checkpoint and the
+            # checkpoints are evaluated in num_workers processes
+            results = analogy_eval.evaluate_models(
+                paths, load_emb, questions, normalize_inputs=True,
+                num_workers=FLAGS.num_workers)
+            for path, (correct, acc) in zip(paths, results):
+                global_step = path.split('/')[-1].split('-')[-1]
+                print("Eval %4d/%d accuracy = %4.1f%%" % (correct, len(questions),
+                                                          acc * 100.0))
+                res[global_step] = acc * 100.0
+            if paths:
+                with open(result_file_path, 'w') as f:
+                    json.dump(res, f)
+        else:
+            print('No checkpoint file found')
         print("sleeping 300s")
         time.sleep(300)
 if __name__ == '__main__':
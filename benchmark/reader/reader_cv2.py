@@ -91,8 +91,9 @@ def process_image(sample,
                   color_jitter,
                   rotate,
                   mean=img_mean,
-                  std=img_std):
-    """ process_image """
+                  std=img_std,
+                  normalize=True):
+    """ process_image, returns the uint8 CHW image if normalize is False """
     img_path = sample[0]
     img = cv2.imread(img_path)
 
@@ -108,9 +109,13 @@ def process_image(sample,
         img = resize_short(img, target_size=256)
         img = crop_image(img, target_size=DATA_DIM, center=True)
 
-    img = img[:, :, ::-1].astype('float32').transpose((2, 0, 1)) / 255
-    img -= mean
-    img /= std
+    if not normalize:
+        # the mean and std are applied on the device
+        img = np.ascontiguousarray(img[:, :, ::-1].transpose((2, 0, 1)))
+    else:
+        img = img[:, :, ::-1].astype('float32').transpose((2, 0, 1)) / 255
+        img -= mean
+        img /= std
 
     if mode == 'train' or mode == 'val':
         return img, sample[1]
@@ -127,7 +132,8 @@ def _reader_creator(file_list,
                     rotate=False,
                     data_dir=DATA_DIR,
                     pass_id_as_seed=1,
-                    num_threads=THREAD):
+                    num_threads=THREAD,
+                    normalize=True):
     def reader():
         with open(file_list) as f_list:
             full_lines = [line.strip() for line in f_list]
@@ -151,13 +157,15 @@ def _reader_creator(file_list,
         process_image,
         mode=mode,
         color_jitter=color_jitter,
-        rotate=rotate)
+        rotate=rotate,
+        normalize=normalize)
     reader = paddle.reader.xmap_readers(
         image_mapper, reader, num_threads, BUF_SIZE, order=False)
     return reader
 
 
-def train(data_dir=DATA_DIR, pass_id_as_seed=1, num_threads=THREAD):
+def train(data_dir=DATA_DIR, pass_id_as_seed=1, num_threads=THREAD,
+          normalize=True):
     file_list = os.path.join(data_dir, 'train.txt')
     return _reader_creator(
         file_list,
@@ -167,4 +175,5 @@ def train(data_dir=DATA_DIR, pass_id_as_seed=1, num_threads=THREAD):
         rotate=False,
         data_dir=data_dir,
         pass_id_as_seed=pass_id_as_seed,
-        num_threads=num_threads)
+        num_threads=num_threads,
+        normalize=normalize)
@@ -16,6 +16,10 @@ parser.add_argument('--num_threads',
                     type=int,
                     default=1,
                     help='Number of thread used to run.')
+parser.add_argument('--uint8',
+                    action='store_true',
+                    help='Return the uint8 images without the float '
+                    'normalization, only for the cv2 reader.')
 args = parser.parse_args()
 
 
@@ -35,8 +39,16 @@ def main(args):
         print("Unknown reader type: {}.".format(args.type))
         exit()
 
+    kwargs = {}
+    if args.uint8:
+        if args.type.lower() != 'cv2':
+            print("--uint8 is only supported by the cv2 reader.")
+            exit()
+        kwargs['normalize'] = False
+
     begin = time.time()
-    reader = train(data_dir=args.data_dir, num_threads=args.num_threads)
+    reader = train(data_dir=args.data_dir, num_threads=args.num_threads,
+                   **kwargs)
     batch_id = 0
     for _ in reader():
         batch_id += 1
@@ -46,7 +58,9 @@ def main(args):
             print("why exceed range")
             break
     elapsed = time.time() - begin
-    print("Elapsed time: {}, batches: {}, performance: {} batches per second.".format(elapsed, batch_id, batch_id / elapsed))
+    print("Elapsed time: {}, batches: {}, performance: {} batches per second, "
+          "output: {}.".format(elapsed, batch_id, batch_id / elapsed,
+                               "uint8" if args.uint8 else "float32"))
 
 
 if __name__ == '__main__':
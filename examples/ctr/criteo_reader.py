@@ -1,16 +1,35 @@
 import sys
+import itertools
+import numpy as np
 import paddle.fluid.incubate.data_generator as dg
+import feature_hash
+
+
+def read_blocks(fin, block_size):
+    """
+    Read a file object in blocks of at most block_size lines
+    """
+    while True:
+        lines = list(itertools.islice(fin, block_size))
+        if not lines:
+            break
+        yield lines
+
 
 class CriteoDataset(dg.MultiSlotDataGenerator):
-    def setup(self, sparse_feature_dim):
+    def setup(self, sparse_feature_dim, hash_type='murmur'):
         self.cont_min_ = [0, -3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.cont_max_ = [20, 600, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
         self.cont_diff_ = [20, 603, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
         self.hash_dim_ = sparse_feature_dim
+        self.hash_ids_ = feature_hash.get_hasher(hash_type)
+        self.line_hash_ids_ = feature_hash.get_line_hasher(hash_type)
         # here, training data are lines with line_index < train_idx_
         self.train_idx_ = 41256555
         self.continuous_range_ = range(1, 14)
         self.categorical_range_ = range(14, 40)
+        # column prefixes used to build the hash keys of a whole block
+        self.categorical_prefix_ = np.array([str(idx) for idx in self.categorical_range_])
 
     def _process_line(self, line):
         features = line.rstrip('\n').split('\t')
@@ -22,11 +41,43 @@ class CriteoDataset(dg.MultiSlotDataGenerator):
             else:
                 dense_feature.append((float(features[idx]) - self.cont_min_[idx - 1]) / \
                                      self.cont_diff_[idx - 1])
-        for idx in self.categorical_range_:
-            sparse_feature.append([hash(str(idx) + features[idx]) % self.hash_dim_])
+        keys = [str(idx) + features[idx] for idx in self.categorical_range_]
+        for sparse_id in self.line_hash_ids_(keys, self.hash_dim_):
+            sparse_feature.append([sparse_id])
             
         return dense_feature, sparse_feature, [int(features[0])]
 
+    def _process_block(self, lines):
+        """
+        Columnar version of _process_line, parse a block of lines at once
+        Returns:
+            dense: float64 array of shape [N, 13]
+            sparse: int64 array of shape [N, 26]
+            label: int64 array of shape [N, 1]
+        """
+        features = np.array([line.rstrip('\n').split('\t') for line in lines])
+
+        dense = features[:, list(self.continuous_range_)]
+        missing = dense == ''
+        dense = np.array(np.where(missing, '0', dense).tolist(), dtype='float64')
+        dense = (dense - self.cont_min_) / self.cont_diff_
+        dense[missing] = 0.0
+
+        keys = np.char.add(self.categorical_prefix_,
+                           features[:, list(self.categorical_range_)])
+        sparse = self.hash_ids_(keys, self.hash_dim_)
+
+        label = features[:, :1].astype('int64')
+        return dense, sparse, label
+
+    def _block_to_samples(self, dense, sparse, label):
+        """
+        Convert the column arrays of a block to the samples of _process_line
+        """
+        sparse = sparse.reshape(sparse.shape + (1,)).tolist()
+        return [[d] + s + [l] for d, s, l in
+                zip(dense.tolist(), sparse, label.tolist())]
+
     def infer_reader(self, filelist, batch, buf_size):
         print(filelist)
         def local_iter():
@@ -42,7 +93,31 @@ class CriteoDataset(dg.MultiSlotDataGenerator):
                 local_iter, buf_size=buf_size),
             batch_size=batch)
         return batch_iter
-                        
+
+    def infer_block_reader(self, filelist, batch, buf_size):
+        """
+        Block parsing version of infer_reader, buf_size lines are parsed
+        and shuffled at once, whole batches are emitted directly
+        """
+        print(filelist)
+        def batch_iter():
+            rest = None
+            for fname in filelist:
+                with open(fname.strip(), "r") as fin:
+                    for lines in read_blocks(fin, buf_size):
+                        block = self._process_block(lines)
+                        perm = np.random.permutation(len(lines))
+                        block = [column[perm] for column in block]
+                        if rest is not None:
+                            block = [np.concatenate(pair) for pair in zip(rest, block)]
+                        end = len(block[0]) - len(block[0]) % batch
+                        for begin in range(0, end, batch):
+                            yield self._block_to_samples(
+                                *[column[begin:begin + batch] for column in block])
+                        rest = [column[end:] for column in block]
+            if rest is not None and len(rest[0]) > 0:
+                yield self._block_to_samples(*rest)
+        return batch_iter
 
     def generate_sample(self, line):
         def data_iter():
@@ -55,7 +130,22 @@ class CriteoDataset(dg.MultiSlotDataGenerator):
 
         return data_iter
 
+    def run_block_from_stdin(self, block_size):
+        """
+        Block parsing version of run_from_stdin
+        """
+        feature_name = ["dense_input"]
+        for idx in self.categorical_range_:
+            feature_name.append("C" + str(idx - 13))
+        feature_name.append("label")
+        for lines in read_blocks(sys.stdin, block_size):
+            for sample in self._block_to_samples(*self._process_block(lines)):
+                sys.stdout.write(self._gen_str(zip(feature_name, sample)))
+
 if __name__ == "__main__":
     criteo_dataset = CriteoDataset()
     criteo_dataset.setup(int(sys.argv[1]))
-    criteo_dataset.run_from_stdin()
+    if len(sys.argv) > 2:
+        criteo_dataset.run_block_from_stdin(int(sys.argv[2]))
+    else:
+        criteo_dataset.run_from_stdin()
@@ -111,7 +111,7 @@ def infer():
             for name in auc_states_names:
                 set_zero(name)
 
-            test_reader = criteo_dataset.infer_reader(test_files, 1000, 100000)
+            test_reader = criteo_dataset.infer_block_reader(test_files, 1000, 100000)
             for batch_id, data in enumerate(test_reader()):
                 loss_val, auc_val = exe.run(inference_program,
                                             feed=data2tensor(data, place),
@@ -48,6 +48,8 @@ def params_args(args=None):
                         help="The size for embedding layer (default:10)")
     params.add_argument("--num_field", type=int, default=39)
     params.add_argument("--num_feat", type=int, default=1086460)
+    params.add_argument("--is_feat_hash", type=bool, default=False,
+                        help="Hash categorical features into num_feat ids instead of using feat_dict")
     params.add_argument("--reg", type=float, default=1e-4)
     params.add_argument('--layer_sizes', nargs='+', type=int, default=[400, 400, 400],
                         help='The size of each layers (default: [400, 400, 400])')
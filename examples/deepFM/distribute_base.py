@@ -332,7 +332,8 @@ class FleetDistRunnerBase(object):
         # Notice: Both dataset and py_reader method don't using feed={dict} to input data
         # Paddle Fluid enter data by variable name
         # When we do the definition of the reader, the program has established the workflow
-        train_generator = py_reader.CriteoDataset()
+        train_generator = py_reader.CriteoDataset(
+            params.num_feat if params.is_feat_hash else 0)
         file_list = [str(params.train_files_path) + "/%s" % x
                      for x in os.listdir(params.train_files_path)]
         if params.is_local_cluster:
@@ -408,7 +409,8 @@ class FleetDistRunnerBase(object):
             :infer_result, type:dict, record the evalution parameter and program resource usage situation
         """
         place = fluid.CPUPlace()
-        dataset = py_reader.CriteoDataset()
+        dataset = py_reader.CriteoDataset(
+            params.num_feat if params.is_feat_hash else 0)
         file_list = [str(params.test_files_path) + "/%s" % x
                      for x in os.listdir(params.test_files_path)]
 
@@ -137,6 +137,8 @@ class DeepFM(FleetDistRunnerBase):
         dataset = fluid.DatasetFactory().create_dataset()
         dataset.set_use_var(self.inputs)
         pipe_command = "python dataset_generator.py"
+        if params.is_feat_hash:
+            pipe_command += " %d" % params.num_feat
         dataset.set_pipe_command(pipe_command)
         dataset.set_batch_size(params.batch_size)
         thread_num = int(params.cpu_num)
@@ -14,6 +14,7 @@
 
 # There are 13 integer features and 26 categorical features
 import pickle
+import feature_hash
 
 
 class Dataset:
@@ -22,7 +23,7 @@ class Dataset:
 
 
 class CriteoDataset(Dataset):
-    def __init__(self):
+    def __init__(self, hash_num_feat=0):
         self.cont_min_ = [0, -3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.cont_max_ = [5775, 257675, 65535, 969, 23159456, 431037, 56311, 6047, 29019, 46, 231, 4008, 7393]
         self.cont_diff_ = [
@@ -31,8 +32,40 @@ class CriteoDataset(Dataset):
         ]
         self.continuous_range_ = range(1, 14)
         self.categorical_range_ = range(14, 40)
-        self.feat_dict_ = pickle.load(
-            open('./feat_dict_10.pkl2', 'rb'))
+        # hash_num_feat > 0: hash the categorical features to ids in
+        # [14, hash_num_feat] with feature_hash instead of loading feat_dict
+        self.hash_num_feat_ = hash_num_feat
+        if hash_num_feat > 0:
+            self.feat_dict_ = dict((idx, idx) for idx in self.continuous_range_)
+            self.hash_ids_ = feature_hash.get_line_hasher('murmur')
+        else:
+            self.feat_dict_ = pickle.load(
+                open('./feat_dict_10.pkl2', 'rb'))
+
+    def _categorical_feature(self, features):
+        feat_idx = []
+        feat_value = []
+        if self.hash_num_feat_ > 0:
+            first_id = len(self.continuous_range_) + 1
+            hash_dim = self.hash_num_feat_ - len(self.continuous_range_)
+            keys = [str(idx) + features[idx] for idx in self.categorical_range_]
+            hash_ids = self.hash_ids_(keys, hash_dim)
+            for idx, hash_id in zip(self.categorical_range_, hash_ids):
+                if features[idx] == '':
+                    feat_idx.append(0)
+                    feat_value.append(0.0)
+                else:
+                    feat_idx.append(first_id + hash_id)
+                    feat_value.append(1.0)
+            return feat_idx, feat_value
+        for idx in self.categorical_range_:
+            if features[idx] == '' or features[idx] not in self.feat_dict_:
+                feat_idx.append(0)
+                feat_value.append(0.0)
+            else:
+                feat_idx.append(self.feat_dict_[features[idx]])
+                feat_value.append(1.0)
+        return feat_idx, feat_value
 
     def _reader_creator(self, file_list):
         def reader():
@@ -55,13 +88,9 @@ class CriteoDataset(Dataset):
                                 feat_value.append(
                                     (float(features[idx]) - self.cont_min_[idx - 1]) /
                                     self.cont_diff_[idx - 1])
-                        for idx in self.categorical_range_:
-                            if features[idx] == '' or features[idx] not in self.feat_dict_:
-                                feat_idx.append(0)
-                                feat_value.append(0.0)
-                            else:
-                                feat_idx.append(self.feat_dict_[features[idx]])
-                                feat_value.append(1.0)
+                        categorical_idx, categorical_value = self._categorical_feature(features)
+                        feat_idx.extend(categorical_idx)
+                        feat_value.extend(categorical_value)
                         label = [int(features[0])]
                         yield [feat_idx, feat_value, label]
                 f.close()
@@ -13,11 +13,13 @@
 # limitations under the License.
 
 import paddle.fluid.incubate.data_generator as dg
+import feature_hash
 
 cont_min_ = [0, -3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
 cont_max_ = [20, 600, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
 cont_diff_ = [20, 603, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50]
 hash_dim_ = 1000001
+hash_ids_ = feature_hash.get_line_hasher('murmur')
 continuous_range_ = range(1, 14)
 categorical_range_ = range(14, 40)
 
@@ -47,9 +49,9 @@ class DacDataset(dg.MultiSlotDataGenerator):
                     dense_feature.append(
                         (float(features[idx]) - cont_min_[idx - 1]) /
                         cont_diff_[idx - 1])
-            for idx in categorical_range_:
-                sparse_feature.append(
-                    [hash(str(idx) + features[idx]) % hash_dim_])
+            keys = [str(idx) + features[idx] for idx in categorical_range_]
+            for sparse_id in hash_ids_(keys, hash_dim_):
+                sparse_feature.append([sparse_id])
             label = [int(features[0])]
             process_line = dense_feature, sparse_feature, label
             feature_name = ["dense_feature"]
@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import feature_hash
+
 # There are 13 integer features and 26 categorical features
 continous_features = range(1, 14)
 categorial_features = range(14, 40)
@@ -25,7 +27,7 @@ class Dataset:
 
 
 class CriteoDataset(Dataset):
-    def __init__(self, sparse_feature_dim):
+    def __init__(self, sparse_feature_dim, hash_type='murmur'):
         self.cont_min_ = [0, -3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.cont_max_ = [
             20, 600, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50
@@ -34,6 +36,7 @@ class CriteoDataset(Dataset):
             20, 603, 100, 50, 64000, 500, 100, 50, 500, 10, 10, 10, 50
         ]
         self.hash_dim_ = sparse_feature_dim
+        self.hash_ids_ = feature_hash.get_line_hasher(hash_type)
         # here, training data are lines with line_index < train_idx_
         self.train_idx_ = 41256555
         self.continuous_range_ = range(1, 14)
@@ -57,10 +60,13 @@ class CriteoDataset(Dataset):
                                 dense_feature.append((float(features[idx]) -
                                                       self.cont_min_[idx - 1]) /
                                                      self.cont_diff_[idx - 1])
-                        for idx in self.categorical_range_:
-                            sparse_feature.append([
-                                hash(str(idx) + features[idx]) % self.hash_dim_
-                            ])
+                        keys = [
+                            str(idx) + features[idx]
+                            for idx in self.categorical_range_
+                        ]
+                        for sparse_id in self.hash_ids_(keys,
+                                                       self.hash_dim_):
+                            sparse_feature.append([sparse_id])
 
                         label = [int(features[0])]
                         yield [dense_feature] + sparse_feature + [label]
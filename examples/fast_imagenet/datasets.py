@@ -14,10 +14,13 @@
 # adapted from torchvision.datasets.folder
 
 from PIL import Image
+import io
 import os
 import os.path
 import sys
 
+import packed_dataset
+
 IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
 
 
@@ -64,6 +67,11 @@ def make_dataset(dir, class_to_idx, extensions):
     return images
 
 
+def pil_bytes_loader(data):
+    img = Image.open(io.BytesIO(data))
+    return img.convert('RGB')
+
+
 class DatasetFolder(object):
     """A generic data loader where the samples are arranged in this way: ::
 
@@ -75,6 +83,10 @@ class DatasetFolder(object):
         root/class_y/nsdf3.ext
         root/class_y/asd932_.ext
 
+    If a packed dataset was built with root as its prefix (see
+    packed_dataset.py), the samples are loaded from its records with
+    bytes_loader instead, without walking the directory.
+
     Args:
         root (string): Root directory path.
         loader (callable): A function to load a sample given its path.
@@ -84,6 +96,8 @@ class DatasetFolder(object):
             E.g, ``transforms.RandomCrop`` for images.
         target_transform (callable, optional): A function/transform that takes
             in the target and transforms it.
+        bytes_loader (callable, optional): A function to load a sample given
+            the bytes of its record in a packed dataset.
 
      Attributes:
         classes (list): List of the class names.
@@ -97,12 +111,25 @@ class DatasetFolder(object):
                  loader,
                  extensions,
                  transform=None,
-                 target_transform=None):
+                 target_transform=None,
+                 bytes_loader=pil_bytes_loader):
         self.root = root
         self.transform = transform
         self.target_transform = target_transform
-        classes, class_to_idx = self._find_classes(self.root)
-        samples = make_dataset(self.root, class_to_idx, extensions)
+        self.records = None
+        self.bytes_loader = bytes_loader
+        if packed_dataset.is_packed(os.path.normpath(root)):
+            # the paths of the samples are the indices of the records
+            self.records = packed_dataset.PackedRecords(
+                os.path.normpath(root))
+            loader = self._load_record
+            classes = self.records.classes
+            class_to_idx = {classes[i]: i for i in range(len(classes))}
+            samples = list(
+                zip(range(len(self.records)), self.records.labels.tolist()))
+        else:
+            classes, class_to_idx = self._find_classes(self.root)
+            samples = make_dataset(self.root, class_to_idx, extensions)
         if len(samples) == 0:
             raise (RuntimeError(
                 "Found 0 files in subfolders of: " + self.root + "\n"
@@ -116,6 +143,9 @@ class DatasetFolder(object):
         self.samples = samples
         self.targets = [s[1] for s in samples]
 
+    def _load_record(self, index):
+        return self.bytes_loader(self.records.read(index))
+
     def _find_classes(self, dir):
         """
         Finds the class folders in a dataset.
@@ -176,6 +206,19 @@ def default_loader(path):
     return pil_loader(path)
 
 
+def pil_lazy_loader(path):
+    """Open a JPEG without decoding it, transforms.RandomResizedCrop decodes
+    it at the reduced size its crop needs. Other images are loaded as RGB."""
+    img = Image.open(path)
+    if img.format == 'JPEG':
+        return img
+    return img.convert('RGB')
+
+
+def pil_lazy_bytes_loader(data):
+    return pil_lazy_loader(io.BytesIO(data))
+
+
 class ImageFolder(DatasetFolder):
     """A generic data loader where the images are arranged in this way: ::
 
@@ -195,6 +238,8 @@ class ImageFolder(DatasetFolder):
         target_transform (callable, optional): A function/transform that takes
             in the target and transforms it.
         loader (callable, optional): A function to load an image given its path.
+        bytes_loader (callable, optional): A function to load an image given
+            its encoded bytes, for packed datasets.
 
      Attributes:
         classes (list): List of the class names.
@@ -206,11 +251,13 @@ class ImageFolder(DatasetFolder):
                  root,
                  transform=None,
                  target_transform=None,
-                 loader=default_loader):
+                 loader=default_loader,
+                 bytes_loader=pil_bytes_loader):
         super(ImageFolder, self).__init__(
             root,
             loader,
             IMG_EXTENSIONS,
             transform=transform,
-            target_transform=target_transform)
+            target_transform=target_transform,
+            bytes_loader=bytes_loader)
         self.imgs = self.samples
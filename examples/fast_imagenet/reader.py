@@ -19,15 +19,20 @@ import math
 import random
 import pickle
 import time
-import multiprocessing
 
 import transforms
 import datasets
-
-FINISH_EVENT = "FINISH_EVENT"
+import shm_ring
 
 
 class PaddleDataLoader(object):
+    """
+    Read the samples of this rank's shard of the dataset in concurrent
+    processes. The workers decode the images into a shared memory ring
+    (see shm_ring.py), only the slot positions and the labels go through
+    the queues.
+    """
+
     def __init__(self,
                  dataset,
                  indices=None,
@@ -36,84 +41,108 @@ class PaddleDataLoader(object):
                  shuffle=True,
                  shuffle_seed=0,
                  rank_id=0,
-                 size=1):
+                 size=1,
+                 sample_bytes=None):
         self.dataset = dataset
         self.indices = indices
         self.concurrent = concurrent
         self.shuffle = shuffle
         self.shuffle_seed = shuffle_seed
-        self.queue_size = queue_size // self.concurrent
+        self.queue_size = queue_size
         self.rank_id = rank_id
         self.size = size
+        # the bytes of a CHW image, probed from the first sample if None
+        self.sample_bytes = sample_bytes
+
+    def _rank_indices(self):
+        total_img = len(self.dataset)
+        print("total image: ", total_img)
+        if self.shuffle:
+            indices = list(range(total_img))
+            random.seed(self.shuffle_seed)
+            random.shuffle(indices)
+            print("shuffle indices: %s ..." % indices[:10])
+        elif self.indices is not None:
+            indices = list(self.indices)
+        else:
+            indices = list(range(total_img))
+
+        imgs_per_worker = int(math.ceil(total_img / self.size))
+        total_size = imgs_per_worker * self.size
+        indices += indices[:total_size - total_img]
+        assert len(indices) == total_size
+        offset = self.rank_id * imgs_per_worker
+        return indices[offset:offset + imgs_per_worker]
+
+    def _ring(self, indices, batch_size):
+        sample_bytes = self.sample_bytes
+        if sample_bytes is None:
+            sample_bytes = np.asarray(self.dataset[indices[0]][0]).nbytes
+        num_slots = max(self.queue_size // batch_size, 2)
+        return shm_ring.ShmBatchRing(
+            self.dataset,
+            batch_size,
+            sample_bytes,
+            num_slots=num_slots,
+            num_workers=self.concurrent)
+
+    def batch_reader(self, batch_size, drop_last=False):
+        """
+        The reader of (images, labels) batches, images is a uint8 array of
+        [n, 3, H, W] and labels an int64 array of [n, 1], both are only
+        valid until the next batch is read.
+        """
 
-    def _worker_loop(self, queue, worker_indices, worker_id):
-        cnt = 0
-        for idx in worker_indices:
-            cnt += 1
-            img, label = self.dataset[idx]
-            img = np.array(img).astype('uint8').transpose((2, 0, 1))
-            queue.put((img, label))
-        print("worker: [%d] read [%d] samples. " % (worker_id, cnt))
-        queue.put(FINISH_EVENT)
+        def _reader_creator():
+            indices = self._rank_indices()
+            batches = [
+                indices[i:i + batch_size]
+                for i in range(0, len(indices), batch_size)
+            ]
+            if drop_last and batches and len(batches[-1]) < batch_size:
+                batches.pop()
+            if not batches:
+                return
+            ring = self._ring(indices, batch_size)
+            for batch in ring.batches(batches):
+                yield batch
+
+        return _reader_creator
 
     def reader(self):
         def _reader_creator():
-            worker_processes = []
-            index_queues = []
-            total_img = len(self.dataset)
-            print("total image: ", total_img)
-            if self.shuffle:
-                self.indices = [i for i in xrange(total_img)]
-                random.seed(self.shuffle_seed)
-                random.shuffle(self.indices)
-                print("shuffle indices: %s ..." % self.indices[:10])
-
-            imgs_per_worker = int(math.ceil(total_img / self.size))
-            total_size = imgs_per_worker * self.size
-            self.indices += self.indices[:total_size - total_img]
-            assert len(self.indices) == total_size
-            imgs_per_process = int(math.ceil(imgs_per_worker / self.concurrent))
-            offset = self.rank_id * imgs_per_worker
-            for i in xrange(self.concurrent):
-                start = i * imgs_per_process + offset
-                end = (i + 1) * imgs_per_process + offset \
-                    if i != self.concurrent - 1 \
-                    else (self.rank_id + 1) * imgs_per_worker
-                sliced_indices = self.indices[start:end]
-                print("process: {}, start: {}, end: {}".format(i, start, end))
-                index_queue = multiprocessing.Queue(self.queue_size)
-                w = multiprocessing.Process(
-                    target=self._worker_loop,
-                    args=(index_queue, sliced_indices, i))
-                w.daemon = True
-                w.start()
-                worker_processes.append(w)
-                index_queues.append(index_queue)
-            finish_workers = 0
-            worker_cnt = len(worker_processes)
-            recv_index = 0
-            while finish_workers < worker_cnt:
-                while (index_queues[recv_index].empty()):
-                    recv_index = (recv_index + 1) % self.concurrent
-                sample = index_queues[recv_index].get()
-                recv_index = (recv_index + 1) % self.concurrent
-                if sample == FINISH_EVENT:
-                    finish_workers += 1
-                else:
-                    yield sample
+            indices = self._rank_indices()
+            if not indices:
+                return
+            ring = self._ring(indices, 1)
+            for imgs, labels in ring.batches([[idx] for idx in indices]):
+                # the samples are batched later, copy them out of the ring
+                yield imgs[0].copy(), int(labels[0, 0])
 
         return _reader_creator
 
 
-def train(traindir, sz, min_scale=0.08, shuffle_seed=0, rank_id=0, size=1):
+def train(traindir, sz, min_scale=0.08, shuffle_seed=0, rank_id=0, size=1,
+          batch_size=None):
+    """
+    The reader of the training samples, or of (images, labels) batches if
+    batch_size is set.
+    """
     train_tfms = [
         transforms.RandomResizedCrop(
             sz, scale=(min_scale, 1.0)), transforms.RandomHorizontalFlip()
     ]
-    train_dataset = datasets.ImageFolder(traindir,
-                                         transforms.Compose(train_tfms))
-    return PaddleDataLoader(train_dataset, shuffle_seed=shuffle_seed, 
-        rank_id=rank_id, size=size).reader()
+    # RandomResizedCrop decodes the JPEGs at the size its crops need
+    train_dataset = datasets.ImageFolder(
+        traindir,
+        transforms.Compose(train_tfms),
+        loader=datasets.pil_lazy_loader,
+        bytes_loader=datasets.pil_lazy_bytes_loader)
+    loader = PaddleDataLoader(train_dataset, shuffle_seed=shuffle_seed,
+        rank_id=rank_id, size=size, sample_bytes=3 * sz * sz)
+    if batch_size is not None:
+        return loader.batch_reader(batch_size)
+    return loader.reader()
 
 
 def test(valdir, bs, sz, rect_val=False):
@@ -131,7 +160,7 @@ def test(valdir, bs, sz, rect_val=False):
     val_tfms = [transforms.Resize(int(sz * 1.14)), transforms.CenterCrop(sz)]
     val_dataset = datasets.ImageFolder(valdir, transforms.Compose(val_tfms))
 
-    return PaddleDataLoader(val_dataset).reader()
+    return PaddleDataLoader(val_dataset, sample_bytes=3 * sz * sz).reader()
 
 
 class ValDataset(datasets.ImageFolder):
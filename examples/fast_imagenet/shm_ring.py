@@ -0,0 +1,173 @@
+#copyright (c) 2019 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+"""
+A shared memory ring of batch slots for the image loader workers.
+
+The ring is one shared buffer of num_slots batch slots, a batch slot holds
+batch_size images of at most sample_bytes bytes. The consumer hands the
+samples of a batch to the workers together with the slot and the position
+in it, the workers decode the images straight into the slot and only send
+back the position, the shape and the label. Once all the samples of a batch
+arrived, the batch is a view of [n, C, H, W] into the slot. The consumer
+only dispatches a batch into a slot after the batch previously in it was
+consumed, so the batches come out in order without blocking the workers.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+from six.moves import queue
+
+
+def _worker_loop(dataset, buf, slot_bytes, task_queue, result_queue,
+                 worker_id):
+    ring = np.frombuffer(buf, dtype="uint8")
+    cnt = 0
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        slot, pos, idx = task
+        img, label = dataset[idx]
+        img = np.asarray(img, dtype="uint8").transpose((2, 0, 1))
+        start = slot * slot_bytes + pos * img.nbytes
+        if (pos + 1) * img.nbytes <= slot_bytes:
+            ring[start:start + img.nbytes].reshape(img.shape)[...] = img
+            result_queue.put((slot, pos, img.shape, label))
+        else:
+            # larger than its place in the slot, send the image itself
+            result_queue.put((slot, pos, np.ascontiguousarray(img), label))
+        cnt += 1
+    print("worker: [%d] read [%d] samples. " % (worker_id, cnt))
+
+
+class _Batch(object):
+    def __init__(self, size):
+        self.remaining = size
+        self.shapes = [None] * size
+        self.labels = np.empty((size, 1), dtype="int64")
+        # the images which did not fit into the slot
+        self.images = {}
+
+
+class ShmBatchRing(object):
+    """
+    Decode the samples of the batches in num_workers processes into a shared
+    memory ring.
+
+    :param dataset: The dataset, dataset[idx] returns a HWC image and its
+        label.
+    :param batch_size: The number of samples of a batch.
+    :param sample_bytes: The bytes reserved for a CHW uint8 image, larger
+        images are pickled through the queue.
+    :param num_slots: The number of batches decoded ahead.
+    :param num_workers: The number of worker processes.
+    """
+
+    def __init__(self,
+                 dataset,
+                 batch_size,
+                 sample_bytes,
+                 num_slots=4,
+                 num_workers=4):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.slot_bytes = batch_size * sample_bytes
+        self.num_slots = max(num_slots, 1)
+        self.num_workers = max(num_workers, 1)
+
+    def _batch_view(self, ring, slot, batch):
+        n = len(batch.shapes)
+        if not batch.images:
+            shape = batch.shapes[0]
+            shapes = set(batch.shapes)
+            if len(shapes) > 1:
+                raise ValueError("the images of a batch have different "
+                                 "shapes: %s" % sorted(shapes))
+            nbytes = int(np.prod(shape))
+            start = slot * self.slot_bytes
+            return ring[start:start + n * nbytes].reshape((n, ) + shape)
+        # some images were sent through the queue, copy the batch
+        images = []
+        for pos, shape in enumerate(batch.shapes):
+            if pos in batch.images:
+                images.append(batch.images[pos])
+            else:
+                nbytes = int(np.prod(shape))
+                start = slot * self.slot_bytes + pos * nbytes
+                images.append(ring[start:start + nbytes].reshape(shape))
+        return np.stack(images)
+
+    def batches(self, batch_indices):
+        """
+        Yield (images, labels) of every list of sample indices in
+        batch_indices, images is a uint8 array of [n, C, H, W] and labels an
+        int64 array of [n, 1]. The arrays are views into the ring which are
+        overwritten after the next batch is requested.
+        """
+        buf = multiprocessing.RawArray("B", self.num_slots * self.slot_bytes)
+        ring = np.frombuffer(buf, dtype="uint8")
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue()
+        workers = []
+        for i in range(self.num_workers):
+            w = multiprocessing.Process(
+                target=_worker_loop,
+                args=(self.dataset, buf, self.slot_bytes, task_queue,
+                      result_queue, i))
+            w.daemon = True
+            w.start()
+            workers.append(w)
+
+        pending = {}
+        dispatched = 0
+        try:
+            for batch_id in range(len(batch_indices)):
+                # refill the slots consumed so far
+                while dispatched < len(batch_indices) and \
+                        dispatched < batch_id + self.num_slots:
+                    slot = dispatched % self.num_slots
+                    indices = batch_indices[dispatched]
+                    pending[slot] = _Batch(len(indices))
+                    for pos, idx in enumerate(indices):
+                        task_queue.put((slot, pos, idx))
+                    dispatched += 1
+
+                slot = batch_id % self.num_slots
+                batch = pending[slot]
+                while batch.remaining:
+                    try:
+                        done_slot, pos, payload, label = result_queue.get(
+                            timeout=1)
+                    except queue.Empty:
+                        if not all(w.is_alive() for w in workers):
+                            raise RuntimeError("an image loader worker died")
+                        continue
+                    done = pending[done_slot]
+                    if isinstance(payload, np.ndarray):
+                        done.images[pos] = payload
+                        payload = payload.shape
+                    done.shapes[pos] = payload
+                    done.labels[pos] = label
+                    done.remaining -= 1
+                yield self._batch_view(ring, slot, batch), batch.labels
+            for _ in workers:
+                task_queue.put(None)
+            for w in workers:
+                w.join()
+        finally:
+            for w in workers:
+                if w.is_alive():
+                    w.terminate()
@@ -0,0 +1,102 @@
+#copyright (c) 2019 PaddlePaddle Authors. All Rights Reserve.
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+"""
+Benchmark the decoding of RandomResizedCrop on one core: the full decode of
+datasets.pil_bytes_loader against the reduced size decode of
+datasets.pil_lazy_bytes_loader, with the same crops for both.
+
+    python tools/bench_decode.py --image_dir /data/imagenet/train/n01440764
+"""
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import datasets
+import transforms
+
+
+def synthetic_jpegs(num, size=(500, 375), quality=90):
+    """Smooth random images of the typical ImageNet size, encoded as JPEG."""
+    rng = np.random.RandomState(0)
+    images = []
+    for _ in range(num):
+        small = rng.randint(0, 256, (size[1] // 25, size[0] // 25, 3))
+        img = Image.fromarray(small.astype("uint8")).resize(size,
+                                                            Image.BICUBIC)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality)
+        images.append(buf.getvalue())
+    return images
+
+
+def run(images, loader, tfm, seed):
+    random.seed(seed)
+    outputs = []
+    begin = time.time()
+    for data in images:
+        outputs.append(tfm(loader(data)))
+    return time.time() - begin, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--image_dir", type=str, default=None,
+                        help="The directory of the JPEGs, synthetic images "
+                        "are used if it is not set.")
+    parser.add_argument("--num_images", type=int, default=500)
+    parser.add_argument("--synthetic_size", type=str, default="500,375",
+                        help="The width and height of the synthetic images.")
+    parser.add_argument("--sizes", type=str, default="128,224,288",
+                        help="The output sizes of the crops.")
+    parser.add_argument("--min_scale", type=float, default=0.08)
+    args = parser.parse_args()
+
+    if args.image_dir:
+        names = sorted(os.listdir(args.image_dir))[:args.num_images]
+        images = []
+        for name in names:
+            with open(os.path.join(args.image_dir, name), "rb") as f:
+                images.append(f.read())
+    else:
+        size = tuple(int(s) for s in args.synthetic_size.split(","))
+        images = synthetic_jpegs(args.num_images, size)
+
+    for sz in [int(s) for s in args.sizes.split(",")]:
+        tfm = transforms.RandomResizedCrop(sz, scale=(args.min_scale, 1.0))
+        full_time, full = run(images, datasets.pil_bytes_loader, tfm, sz)
+        draft_time, draft = run(images, datasets.pil_lazy_bytes_loader, tfm, sz)
+        diff = np.mean([
+            np.abs(np.asarray(a, dtype="float32") -
+                   np.asarray(b, dtype="float32")).mean()
+            for a, b in zip(full, draft)
+        ])
+        print("size %d: full decode %.1f img/s, reduced decode %.1f img/s, "
+              "speedup %.2fx, mean abs pixel diff %.2f" %
+              (sz, len(images) / full_time, len(images) / draft_time,
+               full_time / draft_time, diff))
+
+
+if __name__ == "__main__":
+    main()
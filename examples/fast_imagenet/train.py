@@ -263,10 +263,9 @@ def prepare_reader(epoch_id, train_py_reader, train_bs, val_bs, trn_dir,
         min_scale=min_scale,
         shuffle_seed=epoch_id + 1,
         rank_id=trainer_id,
-        size=num_trainers)
-    train_py_reader.decorate_paddle_reader(
-        paddle.batch(
-            train_reader, batch_size=train_bs))
+        size=num_trainers,
+        batch_size=train_bs)
+    train_py_reader.decorate_tensor_provider(train_reader)
 
     test_reader = reader.test(
         valdir="%s/%svalidation" % (args.data_dir, trn_dir),
@@ -27,6 +27,13 @@ __all__ = [
 def _is_pil_image(img):
     return isinstance(img, Image.Image)
 
+
+def _is_undecoded_jpeg(img):
+    # opened by Image.open but not loaded yet, see datasets.pil_lazy_loader
+    return getattr(img, "format", None) == "JPEG" and bool(
+        getattr(img, "tile", None))
+
+
 def crop(img, i, j, h, w):
     if not _is_pil_image(img):
         raise TypeError('img should be a PIL Image, but be {}'.format(
@@ -57,6 +64,32 @@ def resize(img, size, interpolation=Image.BILINEAR):
         return img.resize(size[::-1], interpolation)
 
 
+def draft_resized_crop(img, i, j, h, w, size, interpolation=Image.BILINEAR):
+    """Crop the box (i, j, h, w) of a JPEG which is not decoded yet and
+    resize it to size (h, w). The JPEG is decoded at the smallest DCT scale
+    of 1/2, 1/4 or 1/8 at which the box still covers size, the smaller the
+    crop the cheaper the decoding.
+    """
+    width, height = img.size
+    factor = 1
+    while factor < 8 and w >= 2 * factor * size[1] and \
+            h >= 2 * factor * size[0]:
+        factor *= 2
+    if factor > 1:
+        # the decoder picks the largest scale at which the image is at least
+        # the requested size, which is exactly 1 / factor
+        img.draft("RGB", (width // factor, height // factor))
+        scale = int(round(width / img.size[0]))
+    else:
+        scale = 1
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if scale == 1:
+        return resize(crop(img, i, j, h, w), size, interpolation)
+    box = (j / scale, i / scale, (j + w) / scale, (i + h) / scale)
+    return img.resize(size[::-1], interpolation, box=box)
+
+
 def center_crop(img, output_size):
     if isinstance(output_size, int):
         output_size = (output_size, output_size)
@@ -152,7 +185,9 @@ class RandomHorizontalFlip(object):
 
 class RandomResizedCrop(object):
     """Crop the input PIL Image to random size and aspect ratio, and then
-       resize the PIL Image to target size.
+       resize the PIL Image to target size. A JPEG which is not decoded yet
+       is decoded at a reduced size if the crop allows, see
+       draft_resized_crop.
 
     Args:
         size: target size
@@ -230,6 +265,10 @@ class RandomResizedCrop(object):
         """
         i, j, h, w = self.get_params(img, self._scale, self._ratio)
         assert _is_pil_image(img), 'image should be a PIL Image'
+        if _is_undecoded_jpeg(img):
+            # the crop parameters only need the size from the header
+            return draft_resized_crop(img, i, j, h, w, self._size,
+                                      self._interpolation)
         img = crop(img, i, j, h, w)
         img = resize(img, self._size, self._interpolation)
         return img
@@ -43,6 +43,7 @@ import models
 import utils.reader_cv2 as reader
 from utils.utility import add_arguments, print_arguments, check_gpu
 from utils.learning_rate import lr_warmup
+from utils.img_tool import normalize_image
 from paddle.fluid.incubate.fleet.collective import fleet, DistributedStrategy
 import paddle.fluid.incubate.fleet.base.role_maker as role_maker
 
@@ -70,6 +71,7 @@ add_arg('lower_scale',                  float,  0.08,                 "Set the l
 add_arg('lower_ratio',                  float,  3./4.,                "Set the lower_ratio in ramdom_crop")
 add_arg('upper_ratio',                  float,  4./3.,                "Set the upper_ratio in ramdom_crop")
 add_arg('resize_short_size',            int,    256,                  "Set the resize_short_size")
+add_arg('normalize_on_device',          bool,   False,                "Feed uint8 images and normalize them on the device.")
 add_arg('use_gpu',                      bool,   True,                 "Whether to use GPU or not.")
 add_arg('nccl_comm_num',                int,    1,                    "nccl comm num")
 add_arg('num_iteration_per_drop_scope', int,    30,                   "Ihe iteration intervals to clean up temporary variables.")
@@ -128,11 +130,13 @@ def build_program(is_train, main_prog, startup_prog, args, dist_strategy=None):
             capacity=16,
             shapes=[[-1] + image_shape, [-1, 1]],
             lod_levels=[0, 0],
-            dtypes=["float32", "int64"],
+            dtypes=["uint8" if args.normalize_on_device else "float32", "int64"],
             use_double_buffer=True)
 
         with fluid.unique_name.guard():
             image, label = fluid.layers.read_file(py_reader)
+            if args.normalize_on_device:
+                image = normalize_image(image)
             avg_cost, acc_top1, acc_top5 = net_config(image, model, args, label=label, is_train=is_train)
             avg_cost.persistable = True
             acc_top1.persistable = True
@@ -86,7 +86,8 @@ def _reader_creator(settings,
         mode=mode,
         color_jitter=color_jitter,
         rotate=rotate,
-        crop_size=224)
+        crop_size=224,
+        normalize=not getattr(settings, 'normalize_on_device', False))
     reader = paddle.reader.xmap_readers(
         image_mapper, reader, THREAD, BUF_SIZE, order=False)
     return reader
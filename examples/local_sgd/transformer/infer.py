@@ -30,7 +30,8 @@ import reader
 from config import *
 from desc import *
 from model import fast_decode as fast_decoder
-from train import pad_batch_data, prepare_data_generator
+from train import prepare_data_generator
+import batch_assembly
 
 
 def parse_args():
@@ -128,12 +129,12 @@ def prepare_batch_input(insts, data_input_names, src_pad_idx, bos_idx, n_head,
     """
     Put all padded data needed by beam search decoder into a dict.
     """
-    src_word, src_pos, src_slf_attn_bias, src_max_len = pad_batch_data(
-        [inst[0] for inst in insts], src_pad_idx, n_head, is_target=False)
+    src_word, src_pos, src_slf_attn_bias, src_max_len = \
+        batch_assembly.pad_batch_data(
+            [inst[0] for inst in insts], src_pad_idx, n_head, is_target=False)
     # start tokens
     trg_word = np.asarray([[bos_idx]] * len(insts), dtype="int64")
-    trg_src_attn_bias = np.tile(src_slf_attn_bias[:, :, ::src_max_len, :],
-                                [1, 1, 1, 1]).astype("float32")
+    trg_src_attn_bias = batch_assembly.src_attn_bias(src_slf_attn_bias, 1)
     trg_word = trg_word.reshape(-1, 1, 1)
     src_word = src_word.reshape(-1, src_max_len, 1)
     src_pos = src_pos.reshape(-1, src_max_len, 1)
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*
 import os
-import random
 import re
 import six
 import argparse
 import io
-import math
+import json
+import multiprocessing
+from collections import Counter
+import numpy as np
 prog = re.compile("[^a-z ]", flags=0)
+block_prog = re.compile("[^a-z \n]", flags=0)
 
 
 def parse_args():
@@ -35,11 +38,37 @@ def parse_args():
         default=1024,
         help="re-split input corpus file nums"
     )
+    parser.add_argument(
+        '--split_mode',
+        type=str,
+        default='bytes',
+        choices=['bytes', 'round_robin'],
+        help="re-split by contiguous byte budget or by round robin of lines")
+    parser.add_argument(
+        '--buffer_size',
+        type=int,
+        default=256 * 1024 * 1024,
+        help="Bytes of lines buffered in memory when re-splitting corpus")
+    parser.add_argument(
+        '--manifest_path',
+        type=str,
+        default='',
+        help="Save the line count of every re-split file to this path")
     parser.add_argument(
         '--downsample',
         type=float,
         default=0.001,
         help="filter word by downsample")
+    parser.add_argument(
+        '--num_workers',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="The number of processes to build dict and filter corpus")
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=64 * 1024 * 1024,
+        help="Bytes of corpus counted by one task when building dict")
     parser.add_argument(
         '--filter_corpus',
         action='store_true',
@@ -92,24 +121,177 @@ def _to_unicode(s, ignore_errors=False):
     return s.decode("utf-8", errors=error_mode)
 
 
+def file_chunks(files, chunk_size):
+    """
+    Split files into (path, start, end) byte ranges of about chunk_size bytes,
+    a line belongs to the range in which it starts.
+    """
+    chunks = []
+    for path in files:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_size):
+            chunks.append((path, start, min(start + chunk_size, size)))
+    return chunks
+
+
+def read_chunk(path, start, end):
+    """
+    Yield the lines starting in [start, end) of path
+    """
+    with open(path, 'rb') as f:
+        if start > 0:
+            # skip the line started in the previous chunk
+            f.seek(start - 1)
+            start += len(f.readline()) - 1
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line.decode('utf-8')
+
+
+def _count_chunk(chunk, block_lines=10000):
+    """
+    Count the words of a chunk, lines are stripped and counted in blocks
+    """
+    word_count = Counter()
+    lines = []
+    for line in read_chunk(*chunk):
+        lines.append(line)
+        if len(lines) >= block_lines:
+            word_count.update(block_prog.sub("", "".join(lines).lower()).split())
+            lines = []
+    word_count.update(block_prog.sub("", "".join(lines).lower()).split())
+    return word_count
+
+
+def _merge_counts(counts):
+    merged = counts[0]
+    for count in counts[1:]:
+        merged.update(count)
+    return merged
+
+
+def tree_reduce(pool, parts, merge):
+    """
+    Merge the partial results pairwise in parallel until one is left
+    """
+    while len(parts) > 1:
+        pairs = [parts[i:i + 2] for i in range(0, len(parts), 2)]
+        parts = pool.map(merge, pairs)
+    return parts[0] if parts else Counter()
+
+
+def build_dict(args):
+    """
+    proprocess the data, generate dictionary and save into dict_path.
+    The corpus is split into byte ranges counted by a pool of processes,
+    the partial counts are merged by tree reduction.
+    :param corpus_dir: the input data dir.
+    :param dict_path: the generated dict path. the data in dict is "word count"
+    :param min_count:
+    :return:
+    """
+    files = [
+        args.build_dict_corpus_dir + "/" + file
+        for file in sorted(os.listdir(args.build_dict_corpus_dir))
+    ]
+    for file in files:
+        print("build dict : ", file)
+    chunks = file_chunks(files, args.chunk_size)
+    pool = multiprocessing.Pool(max(args.num_workers, 1))
+    word_count = tree_reduce(pool, pool.map(_count_chunk, chunks),
+                             _merge_counts)
+    pool.close()
+    pool.join()
+
+    unk_sum = 0
+    for item, count in list(word_count.items()):
+        if count <= args.min_count:
+            unk_sum += count
+            del word_count[item]
+    #sort by count, ties by word so that the dict does not depend on the workers
+    word_count[native_to_unicode('<UNK>')] = unk_sum
+    word_count = sorted(
+        word_count.items(), key=lambda word_count: (-word_count[1], word_count[0]))
+
+    with io.open(args.dict_path, 'w+', encoding='utf-8') as f:
+        for k, v in word_count:
+            f.write(k + " " + str(v) + '\n')
+
+
+_filter_state = {}
+
+
+def _init_filter(word_to_id, keep_prob, unk_id):
+    _filter_state['word_to_id'] = word_to_id
+    _filter_state['keep_prob'] = keep_prob
+    _filter_state['unk_id'] = unk_id
+
+
+def _filter_file(task, block_lines=10000):
+    """
+    Convert a corpus file to ids and subsample them, the keep probabilities of
+    a whole block of lines are looked up and drawn at once
+    """
+    input_file, output_file = task
+    word_to_id = _filter_state['word_to_id']
+    keep_prob = _filter_state['keep_prob']
+    unk_id = _filter_state['unk_id']
+    # the forked workers share the global random state, use their own one
+    rng = np.random.RandomState()
+
+    def write_block(wf, ids, lengths):
+        ids = np.array(ids, dtype='int64')
+        keep = rng.random_sample(len(ids)) <= keep_prob[ids]
+        ends = np.cumsum(lengths)
+        kept = np.add.reduceat(keep.astype('int64'), ends - lengths) if len(ids) else []
+        kept_ids = ids[keep].tolist()
+        begin = 0
+        lines = []
+        for num in kept:
+            if num > 0:
+                lines.append(" ".join(map(str, kept_ids[begin:begin + num])) + "\n")
+            begin += num
+        wf.write(_to_unicode("".join(lines)))
+
+    print(input_file)
+    with io.open(output_file, "w") as wf:
+        with io.open(input_file, encoding='utf-8') as rf:
+            ids = []
+            lengths = []
+            for line in rf:
+                words = text_strip(line).split()
+                if not words:
+                    continue
+                ids.extend([word_to_id.get(item, unk_id) for item in words])
+                lengths.append(len(words))
+                if len(lengths) >= block_lines:
+                    write_block(wf, ids, lengths)
+                    ids = []
+                    lengths = []
+            write_block(wf, ids, lengths)
+    return output_file
+
+
 def filter_corpus(args):
     """
     filter corpus and convert id.
+    The input files are converted by a pool of processes, every process
+    writes its own output files.
     """
-    word_count = dict()
     word_to_id_ = dict()
-    word_all_count = 0
     id_counts = []
     word_id = 0
     #read dict
     with io.open(args.dict_path, 'r', encoding='utf-8') as f:
         for line in f:
             word, count = line.split()[0], int(line.split()[1])
-            word_count[word] = count
             word_to_id_[word] = word_id
             word_id += 1
             id_counts.append(count)
-            word_all_count += count
 
     #write word2id file
     print("write word2id file to : " + args.dict_path + "_word_to_id_")
@@ -117,108 +299,139 @@ def filter_corpus(args):
             args.dict_path + "_word_to_id_", 'w+', encoding='utf-8') as fid:
         for k, v in word_to_id_.items():
             fid.write(k + " " + str(v) + '\n')
+
+    #keep probability of every id for subsampling
+    id_counts = np.array(id_counts, dtype='float64')
+    threshold = args.downsample * id_counts.sum()
+    with np.errstate(divide='ignore'):
+        keep_prob = (np.sqrt(id_counts / threshold) + 1) * threshold / id_counts
+
     #filter corpus and convert id
     if not os.path.exists(args.output_corpus_dir):
         os.makedirs(args.output_corpus_dir)
-    for file in os.listdir(args.input_corpus_dir):
-        with io.open(args.output_corpus_dir + '/convert_' + file + '.csv', "w") as wf:
-            with io.open(
-                    args.input_corpus_dir + '/' + file, encoding='utf-8') as rf:
-                print(args.input_corpus_dir + '/' + file)
-                for line in rf:
-                    signal = False
-                    line = text_strip(line)
-                    words = line.split()
-                    write_line = ""
-                    for item in words:
-                        if item in word_count:
-                            idx = word_to_id_[item]
-                        else:
-                            idx = word_to_id_[native_to_unicode('<UNK>')]
-                        count_w = id_counts[idx]
-                        corpus_size = word_all_count
-                        keep_prob = (
-                            math.sqrt(count_w /
-                                      (args.downsample * corpus_size)) + 1
-                        ) * (args.downsample * corpus_size) / count_w
-                        r_value = random.random()
-                        if r_value > keep_prob:
-                            continue
-                        write_line += str(idx)
-                        write_line += " "
-                        signal = True
-                    if signal:
-                        write_line = write_line[:-1] + "\n"
-                        wf.write(_to_unicode(write_line))
+    tasks = [(args.input_corpus_dir + '/' + file,
+              args.output_corpus_dir + '/convert_' + file + '.csv')
+             for file in sorted(os.listdir(args.input_corpus_dir))]
+    pool = multiprocessing.Pool(
+        max(args.num_workers, 1),
+        initializer=_init_filter,
+        initargs=(word_to_id_, keep_prob,
+                  word_to_id_[native_to_unicode('<UNK>')]))
+    pool.map(_filter_file, tasks, chunksize=1)
+    pool.close()
+    pool.join()
 
 
-def build_dict(args):
+def write_manifest(manifest_path, paths, line_counts):
     """
-    proprocess the data, generate dictionary and save into dict_path.
-    :param corpus_dir: the input data dir.
-    :param dict_path: the generated dict path. the data in dict is "word count"
-    :param min_count:
-    :return:
+    Save the size, mtime and line count of every file, so that the trainers
+    do not need to count the lines again
     """
-    # word to count
+    manifest = {}
+    for path, lines in zip(paths, line_counts):
+        stat = os.stat(path)
+        manifest[os.path.abspath(path)] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'lines': lines
+        }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
 
-    word_count = dict()
 
-    for file in os.listdir(args.build_dict_corpus_dir):
-        with io.open(
-                args.build_dict_corpus_dir + "/" + file, encoding='utf-8') as f:
-            print("build dict : ", args.build_dict_corpus_dir + "/" + file)
+def _split_by_bytes(input_files, output_files, buffer_size):
+    """
+    Write contiguous lines into every output file until it gets its share of bytes
+    """
+    total = sum(os.path.getsize(path) for path in input_files)
+    num = len(output_files)
+    line_counts = [0] * num
+    shard = 0
+    written = 0
+    fout = open(output_files[shard], 'wb', buffer_size)
+    for path in input_files:
+        with open(path, 'rb') as f:
             for line in f:
-                line = text_strip(line)
-                words = line.split()
-                for item in words:
-                    if item in word_count:
-                        word_count[item] = word_count[item] + 1
-                    else:
-                        word_count[item] = 1
-
-    item_to_remove = []
-    for item in word_count:
-        if word_count[item] <= args.min_count:
-            item_to_remove.append(item)
+                if written * num >= total * (shard + 1) and shard < num - 1:
+                    fout.close()
+                    shard += 1
+                    fout = open(output_files[shard], 'wb', buffer_size)
+                fout.write(line)
+                written += len(line)
+                line_counts[shard] += 1
+    fout.close()
+    for path in output_files[shard + 1:]:
+        open(path, 'wb').close()
+    return line_counts
 
-    unk_sum = 0
-    for item in item_to_remove:
-        unk_sum += word_count[item]
-        del word_count[item]
-    #sort by count
-    word_count[native_to_unicode('<UNK>')] = unk_sum
-    word_count = sorted(
-        word_count.items(), key=lambda word_count: -word_count[1])
 
-    with io.open(args.dict_path, 'w+', encoding='utf-8') as f:
-        for k, v in word_count:
-            f.write(k + " " + str(v) + '\n')
+def _split_round_robin(input_files, output_files, buffer_size):
+    """
+    Write line i into output file i % num, the lines of every output file are
+    buffered and appended once the buffer is full
+    """
+    num = len(output_files)
+    shard_buffer_size = max(buffer_size // num, 1)
+    line_counts = [0] * num
+    buffers = [[] for _ in range(num)]
+    buffered = [0] * num
+
+    def flush(shard):
+        with open(output_files[shard], 'ab') as fout:
+            fout.write(b"".join(buffers[shard]))
+        buffers[shard] = []
+        buffered[shard] = 0
+
+    for path in output_files:
+        open(path, 'wb').close()
+    shard = 0
+    for path in input_files:
+        with open(path, 'rb') as f:
+            for line in f:
+                buffers[shard].append(line)
+                buffered[shard] += len(line)
+                line_counts[shard] += 1
+                if buffered[shard] >= shard_buffer_size:
+                    flush(shard)
+                shard = (shard + 1) % num
+    for shard in range(num):
+        if buffers[shard]:
+            flush(shard)
+    return line_counts
 
 
 def data_split(args):
+    """
+    re-split the corpus into file_nums files in one streaming pass, the whole
+    corpus is never loaded into memory.
+    split_mode bytes: every file gets contiguous lines of about the same bytes
+    split_mode round_robin: line i goes to file i % file_nums
+    """
     raw_data_dir = args.input_corpus_dir
     new_data_dir = args.output_corpus_dir
     if not os.path.exists(new_data_dir):
         os.mkdir(new_data_dir)
-    files = os.listdir(raw_data_dir)
+    files = sorted(os.listdir(raw_data_dir))
     print(files)
-    index = 0
-    contents = []
-    for file_ in files:
-        with open(os.path.join(raw_data_dir, file_), 'r') as f:
-            contents.extend(f.readlines())
-    
+    input_files = [os.path.join(raw_data_dir, file_) for file_ in files]
+
     num = int(args.file_nums)
-    lines_per_file = len(contents) / num
-    print("contents: ", str(len(contents)))
-    print("lines_per_file: ", str(lines_per_file))
-    
-    for i in range(1, num+1):
-        with open(os.path.join(new_data_dir, "part_" + str(i)), 'w') as fout:
-            data = contents[(i-1)*lines_per_file:min(i*lines_per_file,len(contents))]
-            for line in data:
-               fout.write(line)
+    output_files = [
+        os.path.join(new_data_dir, "part_" + str(i)) for i in range(1, num + 1)
+    ]
+    if args.split_mode == 'round_robin':
+        line_counts = _split_round_robin(input_files, output_files,
+                                         args.buffer_size)
+    else:
+        line_counts = _split_by_bytes(input_files, output_files,
+                                      min(args.buffer_size, 16 * 1024 * 1024))
+    print("contents: ", str(sum(line_counts)))
+    print("lines_per_file: ", str(min(line_counts)), "-", str(max(line_counts)))
+
+    if args.manifest_path:
+        write_manifest(args.manifest_path, output_files, line_counts)
+        print("write manifest to : " + args.manifest_path)
+
 
 if __name__ == "__main__":
     args = parse_args()